@@ -0,0 +1,129 @@
+"""Compares the farthest point sampling of `quests.compression.fps` with the
+reference implementation that rebuilds the full matrix of distances at each
+step, checking that both select the same frames in the same order.
+
+Usage:
+
+    python benchmarks/bench_fps.py --frames 1000,10000,100000 --size 50
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from quests.compression.fps import SELECT_FNS, fps
+from quests.matrix import cdist
+from quests.tools.time import Timer
+
+
+def reference_fps(descriptors, entropies, size, method="fps"):
+    """Implementation of `fps` with the list of lists of distances."""
+    select_fn = SELECT_FNS[method]
+
+    remaining = list(range(len(descriptors)))
+    next_i = entropies.argmax()
+    remaining.pop(next_i)
+    entropies = entropies.tolist()
+    entropies.pop(next_i)
+
+    compressed = [next_i]
+    matrix = []
+    size = len(descriptors) if size >= len(descriptors) else size
+    while len(compressed) < size:
+        x = descriptors[next_i]
+        dists = [np.min(cdist(x, descriptors[i])) for i in remaining]
+        matrix.append(dists)
+
+        dm = np.array(matrix).reshape(len(compressed), len(remaining))
+        selected = select_fn(dm, entropies)
+
+        next_i = remaining.pop(selected)
+        entropies.pop(selected)
+        compressed.append(next_i)
+
+        for dlist in matrix:
+            dlist.pop(selected)
+
+    return compressed
+
+
+def make_frames(n_frames: int, n_envs: int, dim: int, dtype, seed: int = 0):
+    """Creates random frames of descriptors and entropies."""
+    rng = np.random.default_rng(seed)
+    x = rng.random((n_frames * n_envs, dim)).astype(dtype)
+    frames = [x[i : i + n_envs] for i in range(0, len(x), n_envs)]
+    entropies = rng.random(n_frames)
+    return frames, entropies
+
+
+def run(n_frames, size, methods, n_envs, dim, dtype, seed, max_reference):
+    results = []
+    for n in n_frames:
+        frames, entropies = make_frames(n, n_envs, dim, dtype, seed=seed)
+
+        for method in methods:
+            # compiles the kernels before timing
+            fps(frames[:3], entropies[:3], 3, method=method)
+
+            with Timer() as t:
+                selected = fps(frames, entropies, size, method=method)
+            new_time = t.time
+
+            result = {
+                "n_frames": n,
+                "size": size,
+                "method": method,
+                "time": new_time,
+            }
+
+            if n <= max_reference:
+                with Timer() as t:
+                    expected = reference_fps(frames, entropies, size, method=method)
+                result["reference_time"] = t.time
+                result["identical"] = [int(i) for i in expected] == selected
+
+            results.append(result)
+
+            msg = f"N = {n:>8d}  s = {size:>5d}  {method:<5s}  time = {new_time:.3f} s"
+            if "reference_time" in result:
+                msg += (
+                    f"  reference = {result['reference_time']:.3f} s"
+                    + f"  identical = {result['identical']}"
+                )
+            print(msg, flush=True)
+
+    return results
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--frames", type=parse_ints, default=[2000, 100000])
+    parser.add_argument("--size", type=int, default=50)
+    parser.add_argument("--methods", type=str, default="fps,msc,mscw")
+    parser.add_argument("--n_envs", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=16)
+    parser.add_argument("--float32", action="store_true")
+    parser.add_argument("--max_reference", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str, default=None)
+    args = parser.parse_args()
+
+    results = run(
+        args.frames,
+        args.size,
+        args.methods.split(","),
+        args.n_envs,
+        args.dim,
+        np.float32 if args.float32 else np.float64,
+        args.seed,
+        args.max_reference,
+    )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
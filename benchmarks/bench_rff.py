@@ -0,0 +1,117 @@
+"""Compares the random Fourier feature approximation of the entropy
+(`quests.rff`) against the exact kernel sums (`quests.entropy`) for
+several dataset sizes and numbers of random features.
+
+Usage:
+
+    python benchmarks/bench_rff.py --sizes 1000,4000,16000 --features 512,2048,8192
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from quests import rff
+from quests.descriptor import get_descriptors
+from quests.entropy import DEFAULT_BANDWIDTH, delta_entropy, diversity, perfect_entropy
+from quests.tools.example import get_noisy_structures
+from quests.tools.time import Timer
+
+
+def make_dataset(n_envs: int, seed: int = 0) -> np.ndarray:
+    """Creates descriptors of noisy fcc, bcc and hcp Cu until there are at
+    least `n_envs` environments, and returns `n_envs` of them.
+    """
+    np.random.seed(seed)
+    x = []
+    total = 0
+    while total < n_envs:
+        for noise in [0.02, 0.05, 0.1]:
+            dset = get_noisy_structures(noise=noise, supercell_size=6)
+            x.append(get_descriptors(dset))
+            total += len(x[-1])
+
+    x = np.concatenate(x, axis=0)
+    rng = np.random.default_rng(seed)
+    return x[rng.permutation(len(x))[:n_envs]]
+
+
+def run(sizes, features, h, n_test, seed):
+    data = make_dataset(max(sizes) + n_test, seed=seed)
+    test, pool = data[:n_test], data[n_test:]
+
+    results = []
+    for N in sizes:
+        x = pool[:N]
+
+        with Timer() as t:
+            H = perfect_entropy(x, h=h)
+            D = diversity(x, h=h)
+            dH = delta_entropy(test, x, h=h)
+        exact_time = t.time
+
+        # points with p(x) > 1 are well resolved by the random features
+        in_domain = dH < 0
+
+        for n_features in features:
+            with Timer() as t:
+                H_rff = rff.perfect_entropy(x, h=h, n_features=n_features, seed=seed)
+                D_rff = rff.diversity(x, h=h, n_features=n_features, seed=seed)
+                dH_rff = rff.delta_entropy(
+                    test, x, h=h, n_features=n_features, seed=seed
+                )
+            rff_time = t.time
+
+            results.append(
+                {
+                    "n_envs": N,
+                    "n_features": n_features,
+                    "entropy": float(H),
+                    "entropy_rff": float(H_rff),
+                    "entropy_rel_error": float(abs(H_rff - H) / abs(H)),
+                    "diversity": float(D),
+                    "diversity_rff": float(D_rff),
+                    "diversity_rel_error": float(abs(D_rff - D) / abs(D)),
+                    "dH_mae": float(np.mean(np.abs(dH_rff - dH))),
+                    "dH_mae_in_domain": (
+                        float(np.mean(np.abs(dH_rff - dH)[in_domain]))
+                        if in_domain.any()
+                        else None
+                    ),
+                    "exact_time": exact_time,
+                    "rff_time": rff_time,
+                }
+            )
+
+            r = results[-1]
+            print(
+                f"N = {N:>8d}  D = {n_features:>6d}  "
+                + f"H err = {r['entropy_rel_error']:.2e}  "
+                + f"diversity err = {r['diversity_rel_error']:.2e}  "
+                + f"dH MAE = {r['dH_mae']:.3f} ({r['dH_mae_in_domain']} in domain)  "
+                + f"exact = {exact_time:.3f} s  rff = {rff_time:.3f} s"
+            )
+
+    return results
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=parse_ints, default=[1000, 4000, 16000])
+    parser.add_argument("--features", type=parse_ints, default=[512, 2048, 8192])
+    parser.add_argument("--bandwidth", type=float, default=DEFAULT_BANDWIDTH)
+    parser.add_argument("--n_test", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=str, default=None)
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.features, args.bandwidth, args.n_test, args.seed)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,275 @@
+"""Runs the benchmark suite of the descriptors, kernels and compression.
+
+Synthetic datasets of noisy fcc, bcc and hcp Cu are created with
+`quests.tools.example.get_noisy_structures`, and each benchmark is run for
+all combinations of supercell size, number of neighbors, batch size and
+number of threads. The first call of each benchmark (which includes the JIT
+compilation, or loading the numba cache) is reported separately from the
+steady-state times of the following calls. With `--cold`, the numba cache
+is placed in an empty folder, so the first calls always compile.
+
+Usage:
+
+    python benchmarks/run.py --supercells 4,6,8 --threads 1,8 -o results.json
+    python benchmarks/run.py --supercells 4,6,8 --threads 1,8 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+BENCHMARKS = (
+    "descriptor_pbc",
+    "descriptor_nopbc",
+    "get_descriptors",
+    "kernel_sum",
+    "perfect_entropy",
+    "approx_delta_entropy",
+    "fps",
+)
+
+# benchmarks whose time depends on the batch size of the distances
+BATCHED = ("kernel_sum", "perfect_entropy")
+
+FRAME_SIZE = 64
+
+
+def make_dataset(supercell: int, noise: float = 0.05, seed: int = 0):
+    """Creates the noisy fcc, bcc and hcp structures of a given supercell."""
+    from quests.tools.example import get_noisy_structures
+
+    np.random.seed(seed)
+    return get_noisy_structures(noise=noise, supercell_size=supercell)
+
+
+def timeit(fn, repeat: int) -> dict:
+    """Times the first call of `fn` and `repeat` steady-state calls."""
+    from quests.tools.time import Timer
+
+    with Timer() as t:
+        fn()
+    first = t.time
+
+    times = []
+    for _ in range(repeat):
+        with Timer() as t:
+            fn()
+        times.append(t.time)
+
+    median = float(np.median(times)) if times else first
+    return {
+        "first_call": first,
+        "compile": max(first - median, 0.0),
+        "median": median,
+        "min": float(np.min(times)) if times else first,
+        "times": times,
+    }
+
+
+def get_benchmarks(dset, x, k, cutoff, batch_size, h, seed) -> dict:
+    """Returns the functions of the benchmarks for one configuration."""
+    from quests.compression.fps import fps
+    from quests.descriptor import descriptor_nopbc, descriptor_pbc, get_descriptors
+    from quests.entropy import approx_delta_entropy, kernel_sum, perfect_entropy
+
+    rng = np.random.default_rng(seed)
+    test, ref = x[::2], x[1::2]
+
+    # consecutive rows are grouped into frames for the compression
+    frames = [x[i : i + FRAME_SIZE] for i in range(0, len(x), FRAME_SIZE)]
+    entropies = rng.random(len(frames))
+
+    def _descriptor_pbc():
+        for atoms in dset:
+            descriptor_pbc(atoms.positions, np.array(atoms.cell), k=k, cutoff=cutoff)
+
+    def _descriptor_nopbc():
+        for atoms in dset:
+            descriptor_nopbc(atoms.positions, k=k, cutoff=cutoff)
+
+    return {
+        "descriptor_pbc": _descriptor_pbc,
+        "descriptor_nopbc": _descriptor_nopbc,
+        "get_descriptors": lambda: get_descriptors(dset, k=k, cutoff=cutoff),
+        "kernel_sum": lambda: kernel_sum(x, x, h=h, batch_size=batch_size),
+        "perfect_entropy": lambda: perfect_entropy(x, h=h, batch_size=batch_size),
+        "approx_delta_entropy": lambda: approx_delta_entropy(test, ref, h=h),
+        "fps": lambda: fps(frames, entropies, min(20, len(frames)), method="fps"),
+    }
+
+
+def run(args) -> list:
+    from quests.descriptor import get_descriptors
+    from quests.threads import configure_threads
+
+    results = []
+    for threads in args.threads:
+        configure_threads(jobs=threads)
+
+        for supercell in args.supercells:
+            dset = make_dataset(supercell, seed=args.seed)
+
+            for k in args.nbrs:
+                x = get_descriptors(dset, k=k, cutoff=args.cutoff)
+
+                for name in args.benchmarks:
+                    # benchmarks without distance batches are run only once
+                    batch_sizes = args.batch_sizes if name in BATCHED else [None]
+
+                    for batch_size in batch_sizes:
+                        fns = get_benchmarks(
+                            dset,
+                            x,
+                            k,
+                            args.cutoff,
+                            batch_size,
+                            args.bandwidth,
+                            args.seed,
+                        )
+                        result = {
+                            "benchmark": name,
+                            "threads": threads,
+                            "supercell": supercell,
+                            "n_envs": len(x),
+                            "k": k,
+                            "batch_size": batch_size,
+                        }
+
+                        try:
+                            result.update(timeit(fns[name], args.repeat))
+                        except ImportError as e:
+                            # optional dependencies, such as pynndescent
+                            result["skipped"] = str(e)
+
+                        results.append(result)
+                        print(format_result(result), flush=True)
+
+    return results
+
+
+def get_key(result: dict) -> tuple:
+    return tuple(
+        result[key]
+        for key in ("benchmark", "threads", "supercell", "k", "batch_size")
+    )
+
+
+def format_result(result: dict, baseline: dict = None) -> str:
+    msg = (
+        f"{result['benchmark']:<22s} threads = {result['threads']:<3d} "
+        + f"N = {result['n_envs']:<8d} k = {result['k']:<3d} "
+        + f"batch = {str(result['batch_size']):<7s} "
+    )
+    if "skipped" in result:
+        return msg + f"skipped ({result['skipped']})"
+
+    msg += (
+        f"first = {result['first_call']:.4f} s  "
+        + f"median = {result['median']:.4f} s  min = {result['min']:.4f} s"
+    )
+    if baseline is not None and "median" in baseline:
+        msg += f"  speedup = {baseline['median'] / result['median']:.2f}x"
+
+    return msg
+
+
+def compare(results: list, path: str):
+    """Prints the speedup of each result with respect to a previous run."""
+    with open(path, "r") as f:
+        baseline = {get_key(r): r for r in json.load(f)["results"]}
+
+    print(f"\nComparison with {path}:")
+    for result in results:
+        print(format_result(result, baseline.get(get_key(result))))
+
+
+def get_environment(args) -> dict:
+    import numba as nb
+
+    from quests.threads import thread_report
+
+    try:
+        from importlib.metadata import version
+
+        quests_version = version("quests")
+    except Exception:
+        quests_version = None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "date": datetime.now().isoformat(),
+        "quests": quests_version,
+        "commit": commit or None,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "numba": nb.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "threads": thread_report(),
+        "arguments": vars(args),
+    }
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",")]
+
+
+def parse_names(value):
+    names = [v.strip() for v in value.split(",")]
+    for name in names:
+        if name not in BENCHMARKS:
+            raise argparse.ArgumentTypeError(f"Unknown benchmark {name}")
+
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--benchmarks", type=parse_names, default=list(BENCHMARKS))
+    parser.add_argument("--supercells", type=parse_ints, default=[4, 6])
+    parser.add_argument("--nbrs", type=parse_ints, default=[32])
+    parser.add_argument("--batch_sizes", type=parse_ints, default=[1000, 20000])
+    parser.add_argument("--threads", type=parse_ints, default=None)
+    parser.add_argument("--cutoff", type=float, default=5.0)
+    parser.add_argument("--bandwidth", type=float, default=0.015)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cold", action="store_true")
+    parser.add_argument("--compare", type=str, default=None)
+    parser.add_argument("-o", "--output", type=str, default=None)
+    args = parser.parse_args()
+
+    # the cache folder is read when numba is imported
+    if args.cold:
+        os.environ["NUMBA_CACHE_DIR"] = tempfile.mkdtemp(prefix="quests-bench-")
+
+    if args.threads is None:
+        import numba as nb
+
+        args.threads = [nb.config.NUMBA_NUM_THREADS]
+
+    results = run(args)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+    if args.output is not None:
+        output = {"environment": get_environment(args), "results": results}
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
@@ -5,7 +5,6 @@ import sys
 import time
 
 import click
-import numba as nb
 import numpy as np
 
 from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, get_descriptors
@@ -16,10 +15,13 @@ from quests.entropy import (
     DEFAULT_UQ_NBRS,
     approx_delta_entropy,
 )
+from quests.output import is_binary_output, write_environments
+from quests.profiling import stage
 from quests.tools.time import Timer
 
-from .load_file import descriptors_from_file
+from .load_file import dataset_from_file, descriptors_from_file, get_frame_offsets
 from .log import format_time, logger
+from .options import profile_options, profile_report, thread_options
 
 
 @click.command("approx_dH")
@@ -67,13 +69,18 @@ from .log import format_time, logger
     default=None,
     help="Number of jobs to distribute the calculation in (default: all)",
 )
+@thread_options
+@profile_options
 @click.option(
     "-o",
     "--output",
     type=str,
     default=None,
-    help="path to the json file that will contain the output\
-            (default: no output produced)",
+    help=(
+        "path to the output file. Its extension selects the format: .json, "
+        + "or a binary table with one row per environment (.npz, .npy, "
+        + ".parquet, .arrow) (default: no output produced)"
+    ),
 )
 @click.option(
     "--overwrite",
@@ -97,34 +104,47 @@ def approx_dH(
         logger(f"Output file {output} exists. Aborting...")
         sys.exit(0)
 
-    if jobs is not None:
-        nb.set_num_threads(jobs)
-
-    x, _ = descriptors_from_file(test, nbrs, cutoff)
+    x, metadata, _, _ = dataset_from_file(test, nbrs, cutoff)
     ref, _ = descriptors_from_file(reference, nbrs, cutoff)
 
     logger("Computing dH...")
-    with Timer() as t:
+    with Timer() as t, stage("approx_dH"):
         delta = approx_delta_entropy(
             x, ref, h=bandwidth, n=uq_nbrs, graph_neighbors=graph_nbrs
         )
     entropy_time = t.time
     logger(f"dH computed in: {format_time(entropy_time)}")
 
-    if output is not None:
-        results = {
-            "reference_file": reference,
-            "test_file": test,
-            "test_envs": x.shape[0],
-            "ref_envs": ref.shape[0],
-            "k": nbrs,
-            "n": uq_nbrs,
-            "cutoff": cutoff,
-            "bandwidth": bandwidth,
-            "jobs": jobs,
-            "delta_entropy": list(delta.astype(float)),
-            "time": entropy_time,
-        }
+    if output is None:
+        sys.exit()
+
+    results = {
+        "reference_file": reference,
+        "test_file": test,
+        "test_envs": x.shape[0],
+        "ref_envs": ref.shape[0],
+        "k": nbrs,
+        "n": uq_nbrs,
+        "cutoff": cutoff,
+        "bandwidth": bandwidth,
+        "jobs": jobs,
+        "time": entropy_time,
+    }
+
+    # the profile is saved as an attribute of binary outputs
+    results["profile"] = profile_report()
+
+    if is_binary_output(output):
+        write_environments(
+            output,
+            {"dH": delta},
+            offsets=get_frame_offsets(x, metadata),
+            numbers=None if metadata is None else metadata["numbers"],
+            attrs=results,
+        )
+        sys.exit()
+
+    results["delta_entropy"] = list(delta.astype(float))
 
-        with open(output, "w") as f:
-            json.dump(results, f)
+    with open(output, "w") as f:
+        json.dump(results, f)
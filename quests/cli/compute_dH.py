@@ -5,16 +5,30 @@ import sys
 import time
 
 import click
-import numba as nb
 import numpy as np
-from ase.io import read, write
+from ase.io import write
 
+from quests.dataset import metadata_to_atoms
+from quests.dedup import deduplicate
 from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, get_descriptors
+from quests.driver import DEFAULT_INTERVAL
 from quests.entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, delta_entropy
+from quests.output import is_binary_output, write_environments
+from quests.profiling import stage
 from quests.tools.time import Timer
 
-from .load_file import descriptors_from_file
+from .load_file import dataset_from_file, descriptors_from_file, get_frame_offsets
 from .log import format_time, logger
+from .options import (
+    apply_memory_budget,
+    get_driver,
+    handle_cancel,
+    parse_bandwidth,
+    profile_options,
+    profile_report,
+    thread_options,
+    to_json,
+)
 
 
 @click.command("dH")
@@ -37,9 +51,13 @@ from .log import format_time, logger
 @click.option(
     "-b",
     "--bandwidth",
-    type=float,
-    default=DEFAULT_BANDWIDTH,
-    help=f"Bandwidth when computing the kernel (default: {DEFAULT_BANDWIDTH})",
+    type=str,
+    default=str(DEFAULT_BANDWIDTH),
+    callback=parse_bandwidth,
+    help=(
+        f"Bandwidth when computing the kernel (default: {DEFAULT_BANDWIDTH}). "
+        + "A comma-separated list computes the results for all bandwidths at once."
+    ),
 )
 @click.option(
     "-j",
@@ -48,19 +66,94 @@ from .log import format_time, logger
     default=None,
     help="Number of jobs to distribute the calculation in (default: all)",
 )
+@thread_options
+@profile_options
 @click.option(
     "--batch_size",
     type=int,
     default=DEFAULT_BATCH,
     help=f"Size of the batches when computing the distances (default: {DEFAULT_BATCH})",
 )
+@click.option(
+    "--block_size",
+    type=int,
+    default=None,
+    help=(
+        "If given, streams the descriptors in blocks of this many rows to limit "
+        + "the memory (default: streams only memory-mapped .npy files)"
+    ),
+)
+@click.option(
+    "--memory",
+    type=str,
+    default=None,
+    help=(
+        "Memory budget (e.g., 8G, or auto) used to derive the batch sizes "
+        + "from the number of threads (default: uses --batch_size)"
+    ),
+)
+@click.option(
+    "--dedup",
+    type=float,
+    default=None,
+    help=(
+        "If given, merges environments whose descriptors are equal up to this "
+        + "resolution (e.g., 1e-5) and weights them by their multiplicity "
+        + "(default: no deduplication)"
+    ),
+)
+@click.option(
+    "--chunk_size",
+    type=int,
+    default=None,
+    help=(
+        "Number of environments computed between two progress reports and "
+        + "checkpoints (default: one batch per thread)"
+    ),
+)
+@click.option(
+    "--checkpoint",
+    type=str,
+    default=None,
+    help=(
+        "Path to a .npz file where the partial results are periodically saved, "
+        + "and when the calculation is interrupted (default: no checkpoint)"
+    ),
+)
+@click.option(
+    "--checkpoint_interval",
+    type=float,
+    default=DEFAULT_INTERVAL,
+    help=(
+        "Minimum time (in s) between two saves of the --checkpoint file "
+        + f"(default: {DEFAULT_INTERVAL:.0f})"
+    ),
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="If set, continues the calculation from the --checkpoint file",
+)
+@click.option(
+    "--cache",
+    type=str,
+    default=None,
+    help=(
+        "Folder where the descriptors and the metadata of each file are cached "
+        + "and reused while the file is unchanged (default: no cache)"
+    ),
+)
 @click.option(
     "-o",
     "--output",
     type=str,
     default=None,
-    help="path to the json file that will contain the output\
-            (default: no output produced)",
+    help=(
+        "path to the output file. Its extension selects the format: .json, "
+        + ".xyz, or a binary table with one row per environment (.npz, .npy, "
+        + ".parquet, .arrow) (default: no output produced)"
+    ),
 )
 @click.option(
     "--overwrite",
@@ -76,6 +169,14 @@ def dH(
     bandwidth,
     jobs,
     batch_size,
+    block_size,
+    memory,
+    dedup,
+    chunk_size,
+    checkpoint,
+    checkpoint_interval,
+    resume,
+    cache,
     output,
     overwrite,
 ):
@@ -83,15 +184,38 @@ def dH(
         logger(f"Output file {output} exists. Aborting...")
         sys.exit(0)
 
-    if jobs is not None:
-        nb.set_num_threads(jobs)
+    x, metadata, dset, _ = dataset_from_file(test, nbrs, cutoff, cache=cache)
+    ref, _ = descriptors_from_file(reference, nbrs, cutoff, cache=cache)
 
-    x, _ = descriptors_from_file(test, nbrs, cutoff)
-    ref, _ = descriptors_from_file(reference, nbrs, cutoff)
+    # dH is computed once per unique test environment and the reference
+    # is weighted by the multiplicity of its environments
+    x_unique, ref_unique, ref_counts, inverse = x, ref, None, None
+    if dedup is not None:
+        x_unique, _, inverse = deduplicate(x, resolution=dedup)
+        ref_unique, ref_counts, _ = deduplicate(ref, resolution=dedup)
+        logger(
+            f"Unique environments: {x_unique.shape[0]} (test), "
+            + f"{ref_unique.shape[0]} (reference)"
+        )
+
+    batch_size, block_size = apply_memory_budget(
+        memory, x_unique, ref_unique, bandwidth, batch_size, block_size
+    )
 
     logger("Computing dH...")
-    with Timer() as t:
-        delta = delta_entropy(x, ref, h=bandwidth, batch_size=batch_size)
+    driver = get_driver(chunk_size, checkpoint, resume, checkpoint_interval)
+    with Timer() as t, stage("dH"), handle_cancel():
+        delta = delta_entropy(
+            x_unique,
+            ref_unique,
+            h=bandwidth,
+            batch_size=batch_size,
+            block_size=block_size,
+            weights=ref_counts,
+            backend=driver,
+        )
+    if inverse is not None:
+        delta = delta[..., inverse]
     entropy_time = t.time
     logger(f"dH computed in: {format_time(entropy_time)}")
 
@@ -99,11 +223,20 @@ def dH(
         sys.exit()
 
     if output.endswith(".xyz"):
-        dset = read(test, index=":")
+        # the structures are recovered from the metadata if the test file
+        # was not parsed in this run
+        if dset is None and metadata is None:
+            logger(f"Structures of {test} are not available. Aborting...")
+            sys.exit(1)
+
+        if dset is None:
+            dset = metadata_to_atoms(metadata)
+
         i = 0
         for atoms in dset:
             n = len(atoms)
-            _dH = delta[i:i + n]
+            # multiple bandwidths are stored as columns of the array
+            _dH = delta[..., i:i + n].T
             atoms.set_array("dH", _dH)
             i += n
 
@@ -115,12 +248,28 @@ def dH(
         "test_file": test,
         "test_envs": x.shape[0],
         "ref_envs": ref.shape[0],
+        "n_unique_ref_envs": ref_unique.shape[0],
         "k": nbrs,
         "cutoff": cutoff,
-        "bandwidth": bandwidth,
+        "bandwidth": to_json(bandwidth),
         "jobs": jobs,
-        "delta_entropy": list(delta),
     }
 
+    # the profile is saved as an attribute of binary outputs
+    results["profile"] = profile_report()
+
+    if is_binary_output(output):
+        # multiple bandwidths are stored as columns of the dH values
+        write_environments(
+            output,
+            {"dH": delta.T},
+            offsets=get_frame_offsets(x, metadata),
+            numbers=None if metadata is None else metadata["numbers"],
+            attrs=results,
+        )
+        sys.exit()
+
+    results["delta_entropy"] = to_json(delta)
+
     with open(output, "w") as f:
         json.dump(results, f, indent=4)
@@ -1,18 +1,36 @@
 import gc
 import json
 import os
+import sys
 import time
 
 import click
-import numba as nb
 import numpy as np
 
+from quests.dedup import deduplicate
 from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, get_descriptors
-from quests.entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, perfect_entropy
+from quests.driver import DEFAULT_INTERVAL
+from quests.entropy import (
+    DEFAULT_BANDWIDTH,
+    DEFAULT_BATCH,
+    frame_entropy,
+    perfect_entropy,
+)
+from quests.profiling import stage
 from quests.tools.time import Timer
 
-from .load_file import descriptors_from_file
+from .load_file import dataset_from_file, get_frame_offsets
 from .log import format_time, logger
+from .options import (
+    apply_memory_budget,
+    get_driver,
+    handle_cancel,
+    parse_bandwidth,
+    profile_options,
+    profile_report,
+    thread_options,
+    to_json,
+)
 
 
 @click.command("entropy")
@@ -34,9 +52,13 @@ from .log import format_time, logger
 @click.option(
     "-b",
     "--bandwidth",
-    type=float,
-    default=DEFAULT_BANDWIDTH,
-    help=f"Bandwidth when computing the kernel (default: {DEFAULT_BANDWIDTH})",
+    type=str,
+    default=str(DEFAULT_BANDWIDTH),
+    callback=parse_bandwidth,
+    help=(
+        f"Bandwidth when computing the kernel (default: {DEFAULT_BANDWIDTH}). "
+        + "A comma-separated list computes the results for all bandwidths at once."
+    ),
 )
 @click.option(
     "-j",
@@ -45,12 +67,91 @@ from .log import format_time, logger
     default=None,
     help="Number of jobs to distribute the calculation in (default: all)",
 )
+@thread_options
+@profile_options
 @click.option(
     "--batch_size",
     type=int,
     default=DEFAULT_BATCH,
     help=f"Size of the batches when computing the distances (default: {DEFAULT_BATCH})",
 )
+@click.option(
+    "--block_size",
+    type=int,
+    default=None,
+    help=(
+        "If given, streams the descriptors in blocks of this many rows to limit "
+        + "the memory (default: streams only memory-mapped .npy files)"
+    ),
+)
+@click.option(
+    "--memory",
+    type=str,
+    default=None,
+    help=(
+        "Memory budget (e.g., 8G, or auto) used to derive the batch sizes "
+        + "from the number of threads (default: uses --batch_size)"
+    ),
+)
+@click.option(
+    "--per-frame",
+    "per_frame",
+    is_flag=True,
+    default=False,
+    help="If True, also computes the entropy and diversity of each frame",
+)
+@click.option(
+    "--dedup",
+    type=float,
+    default=None,
+    help=(
+        "If given, merges environments whose descriptors are equal up to this "
+        + "resolution (e.g., 1e-5) and weights them by their multiplicity "
+        + "(default: no deduplication)"
+    ),
+)
+@click.option(
+    "--chunk_size",
+    type=int,
+    default=None,
+    help=(
+        "Number of environments computed between two progress reports and "
+        + "checkpoints (default: one batch per thread)"
+    ),
+)
+@click.option(
+    "--checkpoint",
+    type=str,
+    default=None,
+    help=(
+        "Path to a .npz file where the partial results are periodically saved, "
+        + "and when the calculation is interrupted (default: no checkpoint)"
+    ),
+)
+@click.option(
+    "--checkpoint_interval",
+    type=float,
+    default=DEFAULT_INTERVAL,
+    help=(
+        "Minimum time (in s) between two saves of the --checkpoint file "
+        + f"(default: {DEFAULT_INTERVAL:.0f})"
+    ),
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="If set, continues the calculation from the --checkpoint file",
+)
+@click.option(
+    "--cache",
+    type=str,
+    default=None,
+    help=(
+        "Folder where the descriptors and the metadata of each file are cached "
+        + "and reused while the file is unchanged (default: no cache)"
+    ),
+)
 @click.option(
     "-o",
     "--output",
@@ -72,6 +173,15 @@ def entropy(
     bandwidth,
     jobs,
     batch_size,
+    block_size,
+    memory,
+    per_frame,
+    dedup,
+    chunk_size,
+    checkpoint,
+    checkpoint_interval,
+    resume,
+    cache,
     output,
     overwrite,
 ):
@@ -79,34 +189,76 @@ def entropy(
         logger(f"Output file {output} exists. Aborting...")
         sys.exit(0)
 
-    if jobs is not None:
-        nb.set_num_threads(jobs)
-
     logger(f"Loading and creating descriptors for file {file}")
-    x, descriptor_time = descriptors_from_file(file, k=nbrs, cutoff=cutoff)
+    x, metadata, _, descriptor_time = dataset_from_file(
+        file, k=nbrs, cutoff=cutoff, cache=cache
+    )
+    offsets = get_frame_offsets(x, metadata)
+    x = x.reshape(-1, x.shape[-1])
     logger(f"Descriptors built in: {format_time(descriptor_time)}")
     logger(f"Descriptors shape: {x.shape}")
 
-    with Timer() as t:
-        entropy = perfect_entropy(x, h=bandwidth, batch_size=batch_size)
+    unique, counts = x, None
+    if dedup is not None:
+        unique, counts, _ = deduplicate(x, resolution=dedup)
+        logger(f"Unique environments: {unique.shape[0]} of {x.shape[0]}")
+
+    batch_size, block_size = apply_memory_budget(
+        memory, unique, unique, bandwidth, batch_size, block_size
+    )
+
+    driver = get_driver(chunk_size, checkpoint, resume, checkpoint_interval)
+    with Timer() as t, stage("entropy"), handle_cancel():
+        entropy = perfect_entropy(
+            unique,
+            h=bandwidth,
+            batch_size=batch_size,
+            block_size=block_size,
+            weights=counts,
+            backend=driver,
+        )
     entropy_time = t.time
     logger(f"Entropy computed in: {format_time(entropy_time)}")
 
-    logger(f"Dataset entropy: {entropy: .3f} (nats)")
+    if np.ndim(entropy) == 0:
+        logger(f"Dataset entropy: {entropy: .3f} (nats)")
+    else:
+        for h, _entropy in zip(bandwidth, entropy):
+            logger(f"Dataset entropy (h = {h:.4f}): {_entropy: .3f} (nats)")
+
     logger(f"Max theoretical entropy: {np.log(x.shape[0]): .3f} (nats)")
 
+    if per_frame:
+        with Timer() as t, stage("frame_entropy"):
+            frame_entropies, frame_diversities = frame_entropy(
+                x, offsets, h=bandwidth, batch_size=batch_size
+            )
+        frame_time = t.time
+        logger(
+            f"Entropies of {len(offsets) - 1} frames computed in: "
+            + f"{format_time(frame_time)}"
+        )
+
     if output is not None:
         results = {
             "file": file,
             "n_envs": x.shape[0],
+            "n_unique_envs": unique.shape[0],
             "k": nbrs,
             "cutoff": cutoff,
-            "bandwidth": bandwidth,
+            "bandwidth": to_json(bandwidth),
             "jobs": jobs,
-            "entropy": entropy,
+            "entropy": to_json(entropy),
             "descriptor_time": descriptor_time,
             "entropy_time": entropy_time,
         }
 
+        if per_frame:
+            results["frame_entropies"] = to_json(frame_entropies)
+            results["frame_diversities"] = to_json(frame_diversities)
+            results["frame_time"] = frame_time
+
+        results["profile"] = profile_report()
+
         with open(output, "w") as f:
             json.dump(results, f, indent=4)
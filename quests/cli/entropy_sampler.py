@@ -5,10 +5,8 @@ import time
 from typing import List
 
 import click
-import numba as nb
 import numpy as np
 from ase import Atoms
-from ase.io import read
 
 from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, get_descriptors
 from quests.entropy import (
@@ -17,13 +15,18 @@ from quests.entropy import (
     get_bandwidth,
     perfect_entropy,
 )
+from quests.profiling import stage
 from quests.tools.time import Timer
 
-from .load_file import descriptors_from_file
-from .log import format_time, logger
-
-from .load_file import descriptors_from_file
+from .load_file import dataset_from_file
 from .log import format_time, logger
+from .options import (
+    apply_memory_budget,
+    profile_options,
+    profile_report,
+    thread_options,
+    to_json,
+)
 
 
 def sample_indices(size: int, n: int):
@@ -93,12 +96,32 @@ def get_sampling_fn(x: np.ndarray, sample):
     default=None,
     help="Number of jobs to distribute the calculation in (default: all)",
 )
+@thread_options
+@profile_options
 @click.option(
     "--batch_size",
     type=int,
     default=DEFAULT_BATCH,
     help=f"Size of the batches when computing the distances (default: {DEFAULT_BATCH})",
 )
+@click.option(
+    "--memory",
+    type=str,
+    default=None,
+    help=(
+        "Memory budget (e.g., 8G, or auto) used to derive the batch sizes "
+        + "from the number of threads (default: uses --batch_size)"
+    ),
+)
+@click.option(
+    "--cache",
+    type=str,
+    default=None,
+    help=(
+        "Folder where the descriptors and the metadata of each file are cached "
+        + "and reused while the file is unchanged (default: no cache)"
+    ),
+)
 @click.option(
     "-o",
     "--output",
@@ -123,6 +146,8 @@ def entropy_sampler(
     num_runs,
     jobs,
     batch_size,
+    memory,
+    cache,
     output,
     overwrite,
 ):
@@ -130,14 +155,18 @@ def entropy_sampler(
         logger(f"Output file {output} exists. Aborting...")
         sys.exit(0)
 
-    if jobs is not None:
-        nb.set_num_threads(jobs)
-
-    x, descriptor_time = descriptors_from_file(file, k=nbrs, cutoff=cutoff)
+    x, metadata, _, descriptor_time = dataset_from_file(
+        file, k=nbrs, cutoff=cutoff, cache=cache
+    )
+    x = x.reshape(-1, x.shape[-1])
 
+    # the volumes are taken from the metadata instead of parsing the file again
     if estimate_bw:
-        dset = read(file, index=":")
-        volume = np.mean([at.get_volume() / len(at) for at in dset])
+        if metadata is None:
+            logger(f"Volumes of {file} are not available. Aborting...")
+            sys.exit(1)
+
+        volume = np.nanmean(metadata["volumes"] / metadata["natoms"])
         bandwidth = get_bandwidth(volume)
 
     # if dataset is smaller than sample, no need to
@@ -148,12 +177,17 @@ def entropy_sampler(
     # determine how the dataset is going to be sampled
     sample_items = get_sampling_fn(x, sample)
 
+    n_sample = min(len(x), sample)
+    batch_size, _ = apply_memory_budget(
+        memory, x[:n_sample], x[:n_sample], bandwidth, batch_size
+    )
+
     # compute the entropy `num_runs` times
     entropies = []
     entropies_times = []
     for n in range(num_runs):
         xsample = sample_items()
-        with Timer() as t:
+        with Timer() as t, stage("entropy"):
             entropy = perfect_entropy(xsample, h=bandwidth, batch_size=batch_size)
         entropy_time = t.time
 
@@ -171,14 +205,16 @@ def entropy_sampler(
             "n_envs": x.shape[0],
             "k": nbrs,
             "cutoff": cutoff,
-            "bandwidth": bandwidth,
+            "bandwidth": to_json(bandwidth),
             "jobs": jobs,
             "sample": sample,
             "num_runs": num_runs,
-            "entropies": entropies,
+            "entropies": to_json(np.array(entropies)),
             "descriptor_time": descriptor_time,
             "entropies_times": entropies_times,
         }
 
+        results["profile"] = profile_report()
+
         with open(output, "w") as f:
             json.dump(results, f, indent=4)
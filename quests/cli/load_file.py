@@ -1,22 +1,119 @@
+import os
+
 import numpy as np
 from ase.io import read
 
+from quests.dataset import get_metadata, load_dataset, save_dataset, source_stamp
 from quests.descriptor import get_descriptors
+from quests.profiling import stage
+from quests.store import DescriptorStore, is_store
+from quests.stream import load_descriptors
 from quests.tools.time import Timer
 
+from .log import logger
 
-def descriptors_from_file(file, k, cutoff):
-    if file.endswith(".npz"):
-        with Timer() as t:
-            with open(file, "rb") as f:
-                x = np.load(f)
+
+def descriptors_from_file(file, k, cutoff, cache=None):
+    if cache is not None or is_store(file):
+        x, _, _, descriptor_time = dataset_from_file(file, k, cutoff, cache=cache)
+        return x, descriptor_time
+
+    # .npy files are memory-mapped and streamed by the kernels
+    if file.endswith(".npy") or file.endswith(".npz"):
+        with Timer() as t, stage("load"):
+            x = load_descriptors(file, mmap=True)
         descriptor_time = t.time
         return x, descriptor_time
 
-    dset = read(file, index=":")
+    with stage("parse"):
+        dset = read(file, index=":")
 
-    with Timer() as t:
+    with Timer() as t, stage("descriptors"):
         x = get_descriptors(dset, k=k, cutoff=cutoff)
     descriptor_time = t.time
 
     return x, descriptor_time
+
+
+def get_cache_file(cache, file, k, cutoff):
+    name = f"{os.path.basename(file)}.k{k}.c{cutoff}.npz"
+    return os.path.join(cache, name)
+
+
+def dataset_from_file(file, k, cutoff, cache=None):
+    """Parses `file` only once and returns its descriptors and the metadata
+    table of its frames (see `quests.dataset.get_metadata`). Descriptors
+    saved as .npy files have no metadata, whereas .npz files created by
+    `quests make_descriptors` keep it. If `cache` (a folder) is given, the
+    descriptors and the metadata are loaded from it if they were created
+    from the same file with the same parameters, and saved to it otherwise.
+
+    Descriptor stores (see `quests.store.DescriptorStore`) are memory-mapped
+    and keep their metadata, so they are never copied into the memory.
+
+    Returns the descriptors, the metadata (or None), the parsed frames (or
+    None if the file was not parsed) and the time to create the descriptors.
+    """
+    if is_store(file):
+        with Timer() as t, stage("load"):
+            store = DescriptorStore(file)
+            x, metadata = store.descriptors, store.metadata
+
+        if (store.k, store.cutoff) != (k, cutoff):
+            logger(
+                f"Descriptors of {file} were created with k={store.k} and "
+                + f"cutoff={store.cutoff}, which are used instead"
+            )
+
+        return x, metadata, None, t.time
+
+    if file.endswith(".npy"):
+        x, descriptor_time = descriptors_from_file(file, k, cutoff)
+        return x, None, None, descriptor_time
+
+    if file.endswith(".npz"):
+        with Timer() as t, stage("load"):
+            x, metadata, _ = load_dataset(file)
+        return x, metadata, None, t.time
+
+    if cache is not None:
+        os.makedirs(cache, exist_ok=True)
+        cache = get_cache_file(cache, file, k, cutoff)
+
+    if cache is not None and os.path.exists(cache):
+        with Timer() as t, stage("load"):
+            x, metadata, attrs = load_dataset(cache)
+
+        valid = attrs.get("source") == source_stamp(file)
+        valid = valid and attrs.get("k") == k and attrs.get("cutoff") == cutoff
+        if valid and metadata is not None:
+            logger(f"Descriptors loaded from cache {cache}")
+            return x, metadata, None, t.time
+
+    with stage("parse"):
+        dset = read(file, index=":")
+
+    with Timer() as t, stage("descriptors"):
+        x = get_descriptors(dset, k=k, cutoff=cutoff)
+    descriptor_time = t.time
+
+    metadata = get_metadata(dset)
+    if cache is not None:
+        save_dataset(cache, x, metadata, source=source_stamp(file), k=k, cutoff=cutoff)
+        logger(f"Descriptors cached in {cache}")
+
+    return x, metadata, dset, descriptor_time
+
+
+def get_frame_offsets(x, metadata):
+    """Returns the offsets of the frames of the descriptors `x`. Descriptors
+    without metadata are split into frames only if they have shape
+    (n_frames, n_atoms, d).
+    """
+    if metadata is not None:
+        return metadata["offsets"]
+
+    if x.ndim == 3:
+        return np.arange(x.shape[0] + 1) * x.shape[1]
+
+    return np.array([0, x.shape[0]])
@@ -1,16 +1,20 @@
 import json
+import sys
 import time
 
 import click
-import numba as nb
-import numpy as np
 from ase.io import read
 
+from quests.dataset import get_metadata, save_dataset, source_stamp
 from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, get_descriptors
 from quests.entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, perfect_entropy
+from quests.store import STORE_SUFFIX, DescriptorStore, is_store
+from quests.stream import save_descriptors
+from quests.profiling import stage
 from quests.tools.time import Timer
 
 from .log import format_time, logger
+from .options import profile_options, thread_options
 
 
 @click.command("make_descriptors")
@@ -36,6 +40,8 @@ from .log import format_time, logger
     default=None,
     help="Number of jobs to distribute the calculation in (default: all)",
 )
+@thread_options
+@profile_options
 @click.option(
     "-r",
     "--reshape",
@@ -46,13 +52,29 @@ from .log import format_time, logger
         + "Only valid if all frames in the dataset have the same number of atoms."
     ),
 )
+@click.option(
+    "--dtype",
+    type=click.Choice(["float64", "float32", "float16", "bfloat16"]),
+    default="float32",
+    help=(
+        "Storage dtype of the descriptors (default: float32). Half-precision "
+        + "descriptors are computed in float32 by the other commands."
+    ),
+)
 @click.option(
     "-o",
     "--output",
     type=str,
     default=None,
-    help="path to the file that will contain the output\
-            (default: no output produced)",
+    help="path to the .npy (or .npz) file that will contain the output. .npz files\
+            also store the metadata of the frames, and .qds folders create a\
+            memory-mappable descriptor store (default: no output produced)",
+)
+@click.option(
+    "--append",
+    is_flag=True,
+    default=False,
+    help="If the output is an existing .qds store, appends the frames to it",
 )
 def make_descriptors(
     file,
@@ -60,17 +82,17 @@ def make_descriptors(
     nbrs,
     reshape,
     jobs,
+    dtype,
     output,
+    append,
 ):
-    if jobs is not None:
-        nb.set_num_threads(jobs)
-
     logger(f"Loading {file}")
-    dset = read(file, index=":")
+    with stage("parse"):
+        dset = read(file, index=":")
 
     logger(f"Creating descriptors...")
-    with Timer() as t:
-        x = get_descriptors(dset, k=nbrs, cutoff=cutoff)
+    with Timer() as t, stage("descriptors"):
+        x = get_descriptors(dset, k=nbrs, cutoff=cutoff, dtype=dtype)
     descriptor_time = t.time
     logger(f"Descriptors built in: {format_time(descriptor_time)}")
 
@@ -82,6 +104,25 @@ def make_descriptors(
 
     logger(f"Descriptors shape: {x.shape}")
 
-    if output is not None:
-        with open(output, "wb") as f:
-            np.save(f, x)
+    if output is not None and output.endswith(STORE_SUFFIX):
+        if append and is_store(output):
+            store = DescriptorStore(output, mode="a")
+            if (store.k, store.cutoff) != (nbrs, cutoff):
+                logger(f"Parameters of {output} do not match. Aborting...")
+                sys.exit(1)
+        else:
+            store = DescriptorStore.create(
+                output, d=x.shape[-1], k=nbrs, cutoff=cutoff, dtype=dtype, overwrite=True
+            )
+
+        store.append(x, metadata=get_metadata(dset))
+        logger(f"Store {output}: {store.n_frames} frames, {len(store)} environments")
+
+    elif output is not None and output.endswith(".npz"):
+        metadata = get_metadata(dset)
+        save_dataset(
+            output, x, metadata, source=source_stamp(file), k=nbrs, cutoff=cutoff
+        )
+
+    elif output is not None:
+        save_descriptors(output, x)
@@ -0,0 +1,191 @@
+import functools
+import sys
+from contextlib import contextmanager
+
+import click
+import numpy as np
+
+from quests.driver import DEFAULT_INTERVAL, Cancelled, ChunkedDriver
+from quests.memory import plan_kernel_sum
+from quests.profiling import format_profile, get_profiler, profiling
+from quests.stream import is_out_of_core
+from quests.threads import (
+    DEFAULT_BLAS_THREADS,
+    THREADING_LAYERS,
+    configure_threads,
+    format_report,
+)
+
+from .log import logger
+
+
+def parse_bandwidth(ctx, param, value):
+    """Parses the bandwidth given in the command line. A single value
+    returns a float, whereas a comma-separated list of values (e.g.,
+    `0.01,0.015,0.02`) returns a vector of bandwidths that is evaluated
+    with a single pass over the distances.
+    """
+    if isinstance(value, float):
+        return value
+
+    try:
+        values = [float(v) for v in str(value).split(",") if v.strip()]
+    except ValueError:
+        raise click.BadParameter(
+            f"'{value}' is not a number or a comma-separated list of numbers"
+        )
+
+    if len(values) == 0:
+        raise click.BadParameter("at least one bandwidth has to be given")
+
+    if len(values) == 1:
+        return values[0]
+
+    return np.array(values)
+
+
+def to_json(value):
+    """Converts numpy scalars and arrays into objects that can be
+    serialized with `json.dump`.
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+
+    return value
+
+
+def apply_memory_budget(memory, x, y, bandwidth, batch_size, block_size=None):
+    """Derives the batch size and block size of the kernel sums from the
+    memory budget given in the command line and logs the chosen sizes.
+    If no budget is given, returns the sizes unchanged.
+    """
+    if memory is None:
+        return batch_size, block_size
+
+    streaming = block_size is not None or is_out_of_core(x) or is_out_of_core(y)
+    plan = plan_kernel_sum(
+        memory,
+        M=x.shape[0],
+        N=y.shape[0],
+        d=x.shape[1],
+        dtype=x.dtype,
+        n_bandwidths=np.size(bandwidth),
+        streaming=streaming,
+    )
+    block_size = block_size or plan["block_size"]
+
+    msg = f"Memory budget {memory}: batch_size = {plan['batch_size']}"
+    if streaming:
+        msg += f", block_size = {block_size}"
+    logger(msg)
+
+    return plan["batch_size"], block_size
+
+
+def thread_options(func):
+    """Adds the options that control the threads of the kernels to a command
+    and applies them, together with `--jobs`, before the command runs. The
+    effective configuration is logged.
+    """
+
+    @click.option(
+        "--blas_threads",
+        type=int,
+        default=DEFAULT_BLAS_THREADS,
+        help=(
+            f"Number of BLAS threads within the parallel kernels (default: "
+            + f"{DEFAULT_BLAS_THREADS}). The kernels call BLAS from each of their "
+            + "threads, so larger values oversubscribe the CPUs. Serial BLAS "
+            + "calls, such as the PCA and k-means, use all threads"
+        ),
+    )
+    @click.option(
+        "--threading_layer",
+        type=click.Choice(THREADING_LAYERS),
+        default=None,
+        help="Threading layer of numba (default: numba's default)",
+    )
+    @click.option(
+        "--numa",
+        is_flag=True,
+        default=False,
+        help=(
+            "If set, copies the descriptors with the threads that process them, "
+            + "so their memory is allocated in the NUMA node of each thread"
+        ),
+    )
+    @functools.wraps(func)
+    def wrapper(*args, blas_threads, threading_layer, numa, **kwargs):
+        report = configure_threads(
+            kwargs.get("jobs"), blas_threads, layer=threading_layer, numa=numa
+        )
+        logger(format_report(report))
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def profile_options(func):
+    """Records the stages of a command with `quests.profiling`, so their
+    report can be saved in the outputs with `profile_report`. Adds the
+    `--profile` flag, which also prints the breakdown at the end of the
+    command.
+    """
+
+    @click.option(
+        "--profile",
+        is_flag=True,
+        default=False,
+        help=(
+            "If set, prints the time, compilation time and memory of each "
+            + "stage and the work counters at the end of the command (they "
+            + "are always saved to the output)"
+        ),
+    )
+    @functools.wraps(func)
+    def wrapper(*args, profile, **kwargs):
+        with profiling() as profiler:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profile:
+                    logger("Profile:\n" + format_profile(profiler.report()))
+
+    return wrapper
+
+
+def profile_report():
+    """Returns the report of the active profiler for the outputs, or None
+    if the command is not profiled.
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        return None
+
+    return profiler.report()
+
+
+def get_driver(chunk_size, checkpoint, resume, interval=DEFAULT_INTERVAL):
+    """Creates the chunked driver of the kernel sums from the options of the
+    command line. The driver logs the progress of the calculation.
+    """
+    if resume and checkpoint is None:
+        raise click.UsageError("--resume requires a --checkpoint file")
+
+    return ChunkedDriver(
+        chunk_size=chunk_size,
+        checkpoint=checkpoint,
+        resume=resume,
+        interval=interval,
+        log=logger,
+    )
+
+
+@contextmanager
+def handle_cancel():
+    """Exits the command when a calculation is cancelled by the user."""
+    try:
+        yield
+    except Cancelled as e:
+        logger(str(e))
+        sys.exit(1)
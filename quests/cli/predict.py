@@ -0,0 +1,167 @@
+import json
+import os
+import sys
+
+import click
+import numpy as np
+from ase.io import write
+
+from quests.dataset import metadata_to_atoms
+from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K
+from quests.entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, kernel_regression
+from quests.profiling import stage
+from quests.tools.time import Timer
+
+from .load_file import dataset_from_file, descriptors_from_file
+from .log import format_time, logger
+from .options import (
+    apply_memory_budget,
+    profile_options,
+    profile_report,
+    thread_options,
+    to_json,
+)
+
+
+@click.command("predict")
+@click.argument("test", required=1)
+@click.argument("reference", required=1)
+@click.argument("values", required=1)
+@click.option(
+    "-c",
+    "--cutoff",
+    type=float,
+    default=DEFAULT_CUTOFF,
+    help=f"Cutoff (in Å) for computing the neighbor list (default: {DEFAULT_CUTOFF:.1f})",
+)
+@click.option(
+    "-k",
+    "--nbrs",
+    type=int,
+    default=DEFAULT_K,
+    help=f"Number of neighbors when creating the descriptor (default: {DEFAULT_K})",
+)
+@click.option(
+    "-b",
+    "--bandwidth",
+    type=float,
+    default=DEFAULT_BANDWIDTH,
+    help=f"Bandwidth when computing the kernel (default: {DEFAULT_BANDWIDTH})",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of jobs to distribute the calculation in (default: all)",
+)
+@thread_options
+@profile_options
+@click.option(
+    "--batch_size",
+    type=int,
+    default=DEFAULT_BATCH,
+    help=f"Size of the batches when computing the distances (default: {DEFAULT_BATCH})",
+)
+@click.option(
+    "--memory",
+    type=str,
+    default=None,
+    help=(
+        "Memory budget (e.g., 8G, or auto) used to derive the batch sizes "
+        + "from the number of threads (default: uses --batch_size)"
+    ),
+)
+@click.option(
+    "-o",
+    "--output",
+    type=str,
+    default=None,
+    help="path to the json (or xyz) file that will contain the output\
+            (default: no output produced)",
+)
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    default=False,
+    help="If True, overwrite the output file",
+)
+def predict(
+    test,
+    reference,
+    values,
+    cutoff,
+    nbrs,
+    bandwidth,
+    jobs,
+    batch_size,
+    memory,
+    output,
+    overwrite,
+):
+    """Predicts per-environment properties of TEST with a kernel regression
+    of the VALUES (a .npy file with one row per environment) of REFERENCE.
+    """
+    if output is not None and os.path.exists(output) and not overwrite:
+        logger(f"Output file {output} exists. Aborting...")
+        sys.exit(0)
+
+    x, metadata, dset, _ = dataset_from_file(test, nbrs, cutoff)
+    ref, _ = descriptors_from_file(reference, nbrs, cutoff)
+    y = np.load(values)
+
+    if len(y) != len(ref):
+        logger(
+            f"Number of values ({len(y)}) does not match the number "
+            + f"of reference environments ({len(ref)}). Aborting..."
+        )
+        sys.exit(1)
+
+    batch_size, _ = apply_memory_budget(memory, x, ref, bandwidth, batch_size)
+
+    logger("Computing predictions...")
+    with Timer() as t, stage("predict"):
+        predictions = kernel_regression(
+            x, ref, y, h=bandwidth, batch_size=batch_size
+        )
+    predict_time = t.time
+    logger(f"Predictions computed in: {format_time(predict_time)}")
+
+    if output is None:
+        sys.exit()
+
+    if output.endswith(".xyz"):
+        if dset is None and metadata is None:
+            logger(f"Structures of {test} are not available. Aborting...")
+            sys.exit(1)
+
+        if dset is None:
+            dset = metadata_to_atoms(metadata)
+
+        i = 0
+        for atoms in dset:
+            n = len(atoms)
+            atoms.set_array("prediction", predictions[i : i + n])
+            i += n
+
+        write(output, dset, format="extxyz")
+        sys.exit()
+
+    results = {
+        "reference_file": reference,
+        "test_file": test,
+        "values_file": values,
+        "test_envs": x.shape[0],
+        "ref_envs": ref.shape[0],
+        "k": nbrs,
+        "cutoff": cutoff,
+        "bandwidth": bandwidth,
+        "jobs": jobs,
+        "predictions": to_json(predictions),
+        "time": predict_time,
+    }
+
+    results["profile"] = profile_report()
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
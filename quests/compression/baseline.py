@@ -4,6 +4,8 @@ from typing import List
 
 import numpy as np
 
+from .distance import set_distances
+
 
 def random_sample(
     descriptors: List[np.ndarray], entropies: np.ndarray, size: int
@@ -20,14 +22,19 @@ def mean_fps(
     avg_descriptors = np.array([x.mean(0) for x in descriptors])
     n_points, n_dim = avg_descriptors.shape
 
+    # each frame is represented by a single environment
+    offsets = np.arange(n_points + 1)
+    points = np.arange(n_points)
+
     start_idx = np.random.randint(0, n_points)
 
     sampled_indices = [start_idx]
     min_distances = np.full(n_points, np.inf)
     
     for _ in range(size - 1):
-        current_point = avg_descriptors[sampled_indices[-1]]
-        dist_to_current_point = np.linalg.norm(avg_descriptors - current_point, axis=1)
+        dist_to_current_point = set_distances(
+            avg_descriptors, offsets, sampled_indices[-1], points
+        )
         min_distances = np.minimum(min_distances, dist_to_current_point)
         for num in sampled_indices:
             min_distances[num] = -np.inf
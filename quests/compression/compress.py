@@ -1,12 +1,18 @@
+import warnings
 from collections import defaultdict
 from typing import Callable, List, Tuple
 
 import numpy as np
 from ase import Atoms
-from bayes_opt import BayesianOptimization
-from quests.descriptor import get_descriptors
-from quests.entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, diversity, perfect_entropy
-import ray 
+from quests.descriptor import get_descriptors, pack_frames
+from quests.entropy import (
+    DEFAULT_BANDWIDTH,
+    DEFAULT_BATCH,
+    diversity,
+    frame_entropy,
+    kernel_sum,
+    perfect_entropy,
+)
 
 from .fps import fps
 
@@ -24,11 +30,11 @@ class DatasetCompressor:
         self.bandwidth = bandwidth
         self.batch_size = batch_size
         self._descriptors = [descriptor_fn(at) for at in dset]
-        self._entropies = np.array(
-            [
-                perfect_entropy(x, h=bandwidth, batch_size=batch_size)
-                for x in self._descriptors
-            ]
+
+        # entropies of all frames are computed in a single parallel call
+        x, offsets = pack_frames(self._descriptors)
+        self._entropies, _ = frame_entropy(
+            x, offsets, h=bandwidth, batch_size=batch_size
         )
 
     def entropy(self, selected: List[int] = None):
@@ -80,26 +86,132 @@ class DatasetCompressor:
         div = self.diversity(selected)
         return entropy * div
 
-    def optimal_compression(
+    def compression_curve(
         self,
         method: str = "msc",
         min_frac: float = 0.1,
-        random_state: int = 1243,
-        init_points: int = 5,
-        n_iter: int = 20,
-    ):
+        n_points: int = None,
+    ) -> dict:
+        """Computes the cost function (entropy times diversity) of the compressed
+            datasets along the selection order. As the selection is greedy, the
+            compressed dataset of each size is a prefix of the full order, so the
+            order is computed once and the prefixes are evaluated incrementally.
+
+        Arguments:
+            method (str): compression method ("msc" or "fps").
+            min_frac (float): smallest fraction of the dataset in the curve.
+            n_points (int): number of sizes evaluated between `min_frac` and the
+                full dataset. If None, evaluates all sizes.
+
+        Returns:
+            curve (dict): dictionary with the "sizes", "fracs", "entropy",
+                "diversity" and "cost" of the compressed datasets, and the
+                "optimal_size" and "optimal_frac" that maximize the cost.
+        """
         self._check_frac(min_frac)
 
-        fn = lambda frac: self.cost_fn(frac=frac, method=method)
+        sizes = np.arange(self.frac_to_size(min_frac), self.dataset_size + 1)
+        sizes = sizes[sizes > 0]
+        if n_points is not None and n_points < len(sizes):
+            sizes = np.linspace(sizes[0], sizes[-1], n_points).round()
+            sizes = np.unique(sizes.astype(int))
+
+        order = self.get_indices(method, self.dataset_size)
+        entropy, div = prefix_entropies(
+            [self._descriptors[i] for i in order],
+            sizes,
+            h=self.bandwidth,
+            batch_size=self.batch_size,
+        )
 
-        bounds = {"frac": (min_frac, 1)}
-        opt = BayesianOptimization(f=fn, pbounds=bounds, random_state=random_state, allow_duplicate_points = True)
-        opt.maximize(init_points=init_points, n_iter=n_iter)
-        optimal_frac = opt.max["params"]["frac"]
+        cost = entropy * div
+        best = int(np.nanargmax(cost))
+        return {
+            "sizes": sizes,
+            "fracs": sizes / self.dataset_size,
+            "entropy": entropy,
+            "diversity": div,
+            "cost": cost,
+            "optimal_size": int(sizes[best]),
+            "optimal_frac": float(sizes[best] / self.dataset_size),
+            "order": order,
+        }
 
-        return self.fixed_compression(method, optimal_frac), optimal_frac
+    def optimal_compression(
+        self,
+        method: str = "msc",
+        min_frac: float = 0.1,
+        random_state: int = None,
+        init_points: int = None,
+        n_iter: int = None,
+        n_points: int = None,
+    ):
+        # the optimal fraction used to be found with bayesian optimization
+        if random_state is not None or init_points is not None or n_iter is not None:
+            warnings.warn(
+                "random_state, init_points and n_iter are deprecated and ignored, "
+                + "as the optimal fraction is found from the compression curve",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+
+        curve = self.compression_curve(method, min_frac=min_frac, n_points=n_points)
+
+        indices = set(curve["order"][: curve["optimal_size"]])
+        compressed = [x for i, x in enumerate(self.dset) if i in indices]
+        return compressed, curve["optimal_frac"]
 
     def get_indices(self, method: str, size: int, **kwargs):
         self._check_compression_method(method)
         return fps(self._descriptors, self._entropies, size, method=method)
-    
+
+
+def prefix_entropies(
+    descriptors: List[np.ndarray],
+    sizes: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the entropy and diversity of the datasets made by the first
+        frames of `descriptors`. The kernel sums of the environments are kept
+        between prefixes and only the environments of the frames that were
+        added are computed, so all prefixes cost as much as a single
+        calculation of the entropy of the full dataset.
+
+    Arguments:
+        descriptors (List[np.ndarray]): descriptors of each frame, in order.
+        sizes (np.ndarray): increasing numbers of frames of each prefix.
+        h (float): bandwidth for the Gaussian kernel.
+        batch_size (int): maximum batch size to consider when
+            performing a distance calculation.
+
+    Returns:
+        entropy (np.ndarray): entropy of each prefix.
+        diversity (np.ndarray): diversity of each prefix.
+    """
+    y, offsets = pack_frames(descriptors)
+
+    entropy = np.full(len(sizes), np.nan)
+    div = np.full(len(sizes), np.nan)
+
+    # kernel sums of the environments of the current prefix
+    p_x = np.zeros(len(y), dtype=np.float64)
+    n = 0
+    for k, size in enumerate(sizes):
+        m = offsets[size]
+        if m == 0:
+            continue
+
+        # kernel sums of the previous environments with the new ones, and of
+        # the new environments with the whole prefix
+        if m > n:
+            if n > 0:
+                p_x[:n] += kernel_sum(y[:n], y[n:m], h=h, batch_size=batch_size)
+            p_x[n:m] = kernel_sum(y[n:m], y[:m], h=h, batch_size=batch_size)
+            n = m
+
+        # same expressions as `perfect_entropy` and `diversity`
+        entropy[k] = -np.mean(np.log(p_x[:n] / n))
+        div[k] = np.log(np.sum(1 / p_x[:n]))
+
+    return entropy, div
@@ -0,0 +1,133 @@
+import math
+
+import numba as nb
+import numpy as np
+
+# distances between two frames A and B computed from the distances between
+# their environments:
+#   min: smallest distance between an environment of A and one of B
+#   mean: mean distance of each environment to its nearest neighbor in the
+#       other frame, averaged over both directions
+#   hausdorff: largest distance of an environment to its nearest neighbor
+#       in the other frame
+SET_DISTANCES = {"min": 0, "mean": 1, "hausdorff": 2}
+
+
+@nb.njit(fastmath=True, cache=True)
+def _sqdist(x: np.ndarray, i: int, j: int) -> float:
+    _sum = 0.0
+    for k in range(x.shape[1]):
+        d = x[i, k] - x[j, k]
+        _sum += d * d
+
+    return _sum
+
+
+@nb.njit(fastmath=True, cache=True)
+def _nearest(x: np.ndarray, a0: int, a1: int, b0: int, b1: int):
+    """Returns the sum, the maximum and the minimum of the distances between
+    each environment of the frame [a0, a1) and its nearest neighbor in the
+    frame [b0, b1). The minima are reduced as they are computed.
+    """
+    _sum = 0.0
+    _max = 0.0
+    _min = np.inf
+    for i in range(a0, a1):
+        nearest = np.inf
+        for j in range(b0, b1):
+            d = _sqdist(x, i, j)
+            if d < nearest:
+                nearest = d
+
+        nearest = math.sqrt(nearest)
+        _sum += nearest
+        _max = max(_max, nearest)
+        _min = min(_min, nearest)
+
+    return _sum, _max, _min
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _set_distances(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    metric: int,
+):
+    n_sources = sources.shape[0]
+    n_targets = targets.shape[0]
+    dm = np.empty((n_sources, n_targets), dtype=x.dtype)
+
+    # each thread processes entire target frames
+    for t in nb.prange(n_targets):
+        b0 = offsets[targets[t]]
+        b1 = offsets[targets[t] + 1]
+
+        for s in range(n_sources):
+            a0 = offsets[sources[s]]
+            a1 = offsets[sources[s] + 1]
+
+            if a1 == a0 or b1 == b0:
+                dm[s, t] = np.inf
+                continue
+
+            sum_a, max_a, min_a = _nearest(x, a0, a1, b0, b1)
+            if metric == 0:
+                dm[s, t] = min_a
+                continue
+
+            sum_b, max_b, _ = _nearest(x, b0, b1, a0, a1)
+            if metric == 1:
+                dm[s, t] = 0.5 * (sum_a / (a1 - a0) + sum_b / (b1 - b0))
+            else:
+                dm[s, t] = max(max_a, max_b)
+
+    return dm
+
+
+def set_distances(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    sources,
+    targets: np.ndarray = None,
+    metric: str = "min",
+) -> np.ndarray:
+    """Computes the distances between frames of a packed matrix of
+        descriptors (see `quests.descriptor.pack_frames`), where each frame
+        is treated as the set of its environments. The distances between
+        environments are reduced on the fly, without creating the matrix
+        of distances between the frames.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors of all frames.
+        offsets (np.ndarray): an (n_frames + 1,) vector with the offsets of
+            each frame followed by the total number of environments.
+        sources (int or np.ndarray): index of a frame, or a vector with the
+            indices of a block of frames.
+        targets (np.ndarray): indices of the frames towards which the
+            distances are computed. If None, uses all frames.
+        metric (str): "min", "mean" or "hausdorff" (see `SET_DISTANCES`).
+
+    Returns:
+        dm (np.ndarray): an (n_targets,) vector with the distances from the
+            frame `sources`, or an (n_sources, n_targets) matrix if
+            `sources` is a vector. Empty frames have infinite distance.
+    """
+    assert metric in SET_DISTANCES, f"Distance {metric} not supported"
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if targets is None:
+        targets = np.arange(offsets.shape[0] - 1)
+
+    targets = np.asarray(targets, dtype=np.int64)
+    block = np.atleast_1d(np.asarray(sources, dtype=np.int64))
+
+    dm = _set_distances(
+        np.ascontiguousarray(x), offsets, block, targets, SET_DISTANCES[metric]
+    )
+
+    if np.ndim(sources) == 0:
+        return dm[0]
+
+    return dm
@@ -1,8 +1,10 @@
-import itertools
 from typing import List
 
+import numba as nb
 import numpy as np
-from quests.matrix import cdist
+from quests.descriptor import pack_frames
+
+from .distance import set_distances
 
 
 def select_fps_greedy(dm: np.ndarray, entropies: np.ndarray) -> int:
@@ -23,46 +25,131 @@ SELECT_FNS = {
     "mscw": select_msc_weighted,
 }
 
+# the strategies of `SELECT_FNS`, computed from running accumulators
+METHODS = {"fps": 0, "msc": 1, "mscw": 2}
+
+
+@nb.njit(cache=True)
+def _accumulate(
+    indices: np.ndarray,
+    dists: np.ndarray,
+    min_dist: np.ndarray,
+    sum_dist: np.ndarray,
+):
+    """Adds the distances between the latest selected frame and the frames
+    `indices` to the running minimum and sum of the distances.
+    """
+    for j in range(len(indices)):
+        i = indices[j]
+        d = dists[j]
+        if d < min_dist[i]:
+            min_dist[i] = d
+        sum_dist[i] += d
+
+
+@nb.njit(cache=True)
+def _select(
+    method: int,
+    min_dist: np.ndarray,
+    sum_dist: np.ndarray,
+    count,
+    entropies: np.ndarray,
+    remaining: np.ndarray,
+    weight: float,
+) -> int:
+    """Returns the remaining frame with the highest score, which is given by
+    the minimum distance to the selected frames (fps), their mean distance
+    times the entropy (msc), or the mean distance plus the weighted entropy
+    (mscw). Ties are broken by the lowest index, as in `np.argmax`.
+    """
+    best = -1
+    best_score = 0.0
+    for i in range(len(remaining)):
+        if not remaining[i]:
+            continue
+
+        if method == 0:
+            score = min_dist[i]
+        elif method == 1:
+            score = (sum_dist[i] / count) * entropies[i]
+        else:
+            score = sum_dist[i] / count + weight * entropies[i]
+
+        if best == -1 or score > best_score:
+            best = i
+            best_score = score
+
+    return best
+
 
 def fps(
-    descriptors: List[np.ndarray], entropies: np.ndarray, size: int, method: str = "fps"
+    descriptors: List[np.ndarray],
+    entropies: np.ndarray,
+    size: int,
+    method: str = "fps",
+    weight: float = 1.0,
+    distance: str = "min",
 ) -> List[int]:
+    """Selects `size` frames with farthest point sampling. The first frame
+        is the one with the highest entropy, and each following frame is the
+        remaining frame that maximizes the strategy `method`. The minimum and
+        the sum of the distances between each remaining frame and the
+        selected ones are kept as running accumulators, so each step only
+        computes the distances towards the latest selected frame.
+
+    Arguments:
+        descriptors (List[np.ndarray]): descriptors of each frame.
+        entropies (np.ndarray): entropy of each frame.
+        size (int): number of frames to select.
+        method (str): "fps" (farthest point), "msc" (mean distance times
+            the entropy) or "mscw" (mean distance plus the weighted entropy).
+        weight (float): weight of the entropy in "mscw".
+        distance (str): distance between two frames, "min" (closest pair
+            of environments), "mean" or "hausdorff" (see
+            `quests.compression.distance.set_distances`).
+
+    Returns:
+        compressed (List[int]): indices of the selected frames, in order.
+    """
     # select the sampling strategy
-    assert method in SELECT_FNS, f"Method {method} not supported"
-    select_fn = SELECT_FNS[method]
+    assert method in METHODS, f"Method {method} not supported"
+    method = METHODS[method]
+
+    n = len(descriptors)
+    x, offsets = pack_frames(descriptors)
+    entropies = np.array(entropies, dtype=np.float64)
+    size = min(size, n)
 
     # setting up the calculation: the initial data point is selected to be
     # the one with highest entropy (most diversity of environments)
-    remaining = list(range(len(descriptors)))
-    next_i = entropies.argmax()
+    next_i = int(np.nanargmax(entropies))
     compressed = [next_i]
-    remaining.pop(next_i)
-    entropies = entropies.tolist()
-    entropies.pop(next_i)
+    remaining = np.ones(n, dtype=bool)
+    remaining[next_i] = False
 
-    # now, we sample the dataset until convergence
-    matrix = []
-    size = len(descriptors) if size >= len(descriptors) else size
+    min_dist, sum_dist = None, None
     while len(compressed) < size:
         # computes the distances towards the latest sampled configuration
-        x = descriptors[next_i]
-        dists = [np.min(cdist(x, descriptors[i])) for i in remaining]
-        matrix.append(dists)
+        indices = np.flatnonzero(remaining)
+        dists = set_distances(x, offsets, next_i, indices, metric=distance)
 
-        # creates a temporary distance matrix to do the farthest point sampling
-        dm = np.array(matrix).reshape(len(compressed), len(remaining))
+        # accumulators have the dtype of the distances, as the matrix of
+        # distances used by the strategies of `SELECT_FNS`
+        if min_dist is None:
+            min_dist = np.full(n, np.inf, dtype=dists.dtype)
+            sum_dist = np.zeros(n, dtype=dists.dtype)
+
+        _accumulate(indices, dists, min_dist, sum_dist)
 
         # select the element that has the largest distance towards all the existing
         # points in the compressed set AND has high entropy
-        selected = select_fn(dm, entropies)
+        count = sum_dist.dtype.type(len(compressed))
+        next_i = _select(
+            method, min_dist, sum_dist, count, entropies, remaining, weight
+        )
 
         # update the loop and the set of compressed data
-        next_i = remaining.pop(selected)
-        entropies.pop(selected)
+        remaining[next_i] = False
         compressed.append(next_i)
 
-        # delete the distances to reuse the matrix in the next iteration
-        for dlist in matrix:
-            dlist.pop(selected)
-
     return compressed
@@ -1,5 +1,10 @@
+import heapq
+import math
+
 import numpy as np
-from quests.entropy import delta_entropy
+from quests.descriptor import pack_frames
+from quests.entropy import kernel_sum
+from quests.profiling import count
 
 DEFAULT_CUTOFF: float = 5.0
 DEFAULT_K: int = 32
@@ -7,73 +12,219 @@ EPS: float = 1e-15
 DEFAULT_H: float = 0.015
 DEFAULT_BS: int = 10000
 
-
-def find_key(input_dict: dict, target: np.ndarray):
-    """Given a dictionary of descriptors, determines the index of the target descriptors
-
-    Arguments:
-        input_dict (dictionary): dictionary containing descriptors
-        target (np.ndarray): numpy array of descriptor
-
-    Returns: key (int): original index
-
-
-    """
-
-    for key in input_dict:
-        if target.shape != input_dict[key].shape:
-            continue
-        if (target == input_dict[key]).all():
-            return key
-    return None
+# frames re-evaluated at once by the lazy greedy selection
+LAZY_BATCH: int = 32
 
 
 def minimum_set_coverage(
-    frames: list, initial_entropies: np.ndarray, h: float, entropy_weight: float, value: int = None
+    frames: list,
+    initial_entropies: np.ndarray,
+    h: float,
+    entropy_weight: float,
+    value: int = None,
+    batch_size: int = DEFAULT_BS,
+    lazy: bool = False,
+    epsilon: float = None,
+    seed: int = 0,
 ):
-    """Given the frames and initial entropies, determine the most diverse set of atoms in the set
+    """Given the frames and initial entropies, determine the most diverse set of atoms in the set.
+        The kernel sums of the environments of each remaining frame with respect to the
+        selected frames are kept and updated with the environments of each newly selected
+        frame, so each step costs O(remaining environments x new environments).
+
+        As the mean dH of a frame can only decrease when frames are selected, the previous
+        scores are upper bounds of the current ones. With `lazy`, the frames are kept in a
+        priority queue of these bounds and only the frame on top is re-evaluated, until its
+        updated score stays on top (lazy greedy). The selection is the same as the one of
+        the greedy algorithm, with much fewer evaluations of dH, which pays off when the
+        frames are large or redundant. For small frames, the greedy selection computes all
+        scores at once and can be faster.
 
     Arguments:
         frames (list): descriptors of each of the frames
         initial_entropies (np.ndarray): array with initial entropies of each of the frames
-        descriptor_dict (dict): dictionary containing descriptors
         h (float): h value
         entropy_weight (float): weight that considers the "novelty" of a new sample based on
             the values of dH and the entropy of the sample itself. Higher weights favor samples
             with higher initial entropy.
+        value (int): number of frames selected after the initial one. If None, all frames
+            are sorted.
+        batch_size (int): maximum batch size to consider when performing a distance
+            calculation.
+        lazy (bool): if True, uses the lazy greedy selection.
+        epsilon (float): if given, each step selects the best of a random sample of
+            (n_frames / value) * log(1 / epsilon) remaining frames (stochastic greedy),
+            evaluated lazily. Implies `lazy`.
+        seed (int): seed of the random samples of the stochastic greedy selection.
 
     Returns: indexes (list): list of indexes of the most diverse frames in order
 
 
     """
 
-    indexes = []
+    initial_entropies = np.asarray(initial_entropies, dtype=np.float64)
+    x, offsets = pack_frames(list(frames))
+    n_frames = len(offsets) - 1
+    sizes = np.diff(offsets)
+
+    # frame of each environment, used to average the dH of each frame
+    labels = np.repeat(np.arange(n_frames), sizes)
 
-    # dictionary with index & descriptors
-    descriptor_dict = {}
-    for i in range(len(frames)):
-        descriptor_dict[i] = frames[i]
+    # kernel sums of each environment with respect to the selected frames
+    p_x = np.zeros(len(x), dtype=np.float64)
+    remaining = np.ones(n_frames, dtype=bool)
 
-    compressed_data = frames[initial_entropies.argmax()]
-    indexes.append(initial_entropies.argmax())
-    frames.pop(initial_entropies.argmax())
+    selected = int(np.nanargmax(initial_entropies))
+    indexes = [selected]
 
     # loop to find order of values
+    num = n_frames - 1 if value is None else min(value, n_frames - 1)
+
+    if lazy or epsilon is not None:
+        return _lazy_selection(
+            x,
+            offsets,
+            labels,
+            initial_entropies,
+            h,
+            entropy_weight,
+            num,
+            batch_size,
+            indexes,
+            epsilon,
+            seed,
+        )
+
+    for i in range(num):
+        remaining[selected] = False
+        envs = np.flatnonzero(remaining[labels])
+        new = x[offsets[selected] : offsets[selected + 1]]
+        p_x[envs] += kernel_sum(x[envs], new, h=h, batch_size=batch_size)
+        count("set_coverage_evaluations", int(remaining.sum()))
 
-    num = value if value != None else len(frames)
-    num = len(frames) if len(frames) <= num else num
+        # mean dH of each remaining frame with respect to the selected frames
+        dH = _frame_means(-_log(p_x[envs]), labels[envs], sizes)
+
+        entropy = dH + entropy_weight * initial_entropies
+        entropy[~remaining] = -np.inf
+
+        selected = int(entropy.argmax())
+        indexes.append(selected)
+
+    return indexes
+
+
+def _log(p: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.log(p)
+
+
+def _frame_means(values: np.ndarray, labels: np.ndarray, sizes: np.ndarray):
+    with np.errstate(invalid="ignore"):
+        return np.bincount(labels, weights=values, minlength=len(sizes)) / sizes
+
+
+def _lazy_selection(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    labels: np.ndarray,
+    initial_entropies: np.ndarray,
+    h: float,
+    entropy_weight: float,
+    num: int,
+    batch_size: int,
+    indexes: list,
+    epsilon: float = None,
+    seed: int = 0,
+):
+    n_frames = len(offsets) - 1
+    sizes = np.diff(offsets)
+
+    # descriptors of the selected frames, in the order of selection, and the
+    # number of rows after each selection
+    y = np.empty_like(x)
+    n_rows = [0]
+
+    # number of selected frames included in the kernel sums of each frame
+    updated = np.zeros(n_frames, dtype=np.int64)
+    p_x = np.zeros(len(x), dtype=np.float64)
+
+    def add(f: int):
+        start = n_rows[-1]
+        y[start : start + sizes[f]] = x[offsets[f] : offsets[f + 1]]
+        n_rows.append(start + sizes[f])
+
+    def evaluate(stale: list):
+        # updates the kernel sums only with the frames selected since the last
+        # update. Frames with the same update are computed at once
+        stale = np.array(stale, dtype=np.int64)
+        end = n_rows[-1]
+        for u in np.unique(updated[stale]):
+            group = stale[updated[stale] == u]
+            envs = np.concatenate([np.arange(offsets[f], offsets[f + 1]) for f in group])
+            if len(envs) > 0:
+                p_x[envs] += kernel_sum(
+                    x[envs], y[n_rows[u] : end], h=h, batch_size=batch_size
+                )
+
+        updated[stale] = len(n_rows) - 1
+        count("set_coverage_evaluations", len(stale))
+
+        for f in stale:
+            with np.errstate(invalid="ignore"):
+                dH = -_log(p_x[offsets[f] : offsets[f + 1]]).sum() / sizes[f]
+
+            bounds[f] = dH + entropy_weight * initial_entropies[f]
+
+    remaining = np.ones(n_frames, dtype=bool)
+    remaining[indexes[0]] = False
+    add(indexes[0])
+
+    # the first scores are computed at once
+    envs = np.flatnonzero(remaining[labels])
+    p_x[envs] = kernel_sum(x[envs], y[: n_rows[-1]], h=h, batch_size=batch_size)
+    updated[remaining] = 1
+    count("set_coverage_evaluations", int(remaining.sum()))
+
+    bounds = _frame_means(-_log(p_x[envs]), labels[envs], sizes)
+    bounds += entropy_weight * initial_entropies
+
+    # priority queue of the upper bounds of the scores. Ties are broken by the
+    # lowest index, as in the greedy selection
+    heap = [(-bounds[f], f) for f in np.flatnonzero(remaining).tolist()]
+    heapq.heapify(heap)
+
+    if epsilon is not None:
+        rng = np.random.default_rng(seed)
+        sample_size = math.ceil(n_frames / max(num, 1) * math.log(1 / epsilon))
 
     for i in range(num):
-        entropy = np.zeros(len(frames))
-        for a in range(len(frames)):
-            entropy[a] = (
-                np.mean(delta_entropy(frames[a], compressed_data, h=h))
-                + entropy_weight * initial_entropies[find_key(descriptor_dict, frames[a])]
-            )
-        compressed_data = np.concatenate(
-            (compressed_data, frames[entropy.argmax()]), axis=0
-        )
-        indexes.append(find_key(descriptor_dict, frames[entropy.argmax()]))
-        frames.pop(entropy.argmax())
+        # stochastic greedy: the queue only contains a sample of the frames
+        if epsilon is not None:
+            candidates = np.flatnonzero(remaining)
+            if sample_size < len(candidates):
+                candidates = rng.choice(candidates, sample_size, replace=False)
+
+            heap = [(-bounds[f], f) for f in candidates.tolist()]
+            heapq.heapify(heap)
+
+        # re-evaluates the frames on top until the best score is up to date. The
+        # frames are re-evaluated in small batches to reduce the overhead
+        while True:
+            _, f = heapq.heappop(heap)
+            if updated[f] == len(indexes):
+                break
+
+            popped = [f]
+            while heap and len(popped) < LAZY_BATCH:
+                popped.append(heapq.heappop(heap)[1])
+
+            evaluate([g for g in popped if updated[g] < len(indexes)])
+            for g in popped:
+                heapq.heappush(heap, (-bounds[g], g))
+
+        remaining[f] = False
+        indexes.append(f)
+        add(f)
 
     return indexes
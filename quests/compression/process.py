@@ -3,10 +3,10 @@ from typing import List
 import numpy as np
 from ase import Atoms
 from bayes_opt import BayesianOptimization
-from quests.descriptor import get_descriptors
-from quests.entropy import diversity, perfect_entropy
+from quests.descriptor import get_descriptors, get_frame_offsets
+from quests.entropy import diversity, frame_entropy, perfect_entropy
 
-from .farthest_point_sampling import farthest_point_sampling
+from .fps import fps
 from .minimum_set_coverage import minimum_set_coverage
 
 DEFAULT_CUTOFF: float = 5.0
@@ -34,17 +34,17 @@ def get_frame_descriptors(
 
     Returns:
         frames_orig (list): list of the descriptors of each frame (np.ndarray)
+        entropies (np.ndarray): entropy of each frame
 
     """
 
-    frames = []
-    entropies = []
-    for frame in dset:
-        y = get_descriptors([frame], k=k, cutoff=cutoff)
-        entropy = perfect_entropy(y, h=h, batch_size=batch_size)
-        frames.append(y)
-        entropies.append(entropy)
-    return frames, np.array(entropies)
+    # descriptors of all frames are computed at once and split afterwards
+    x = get_descriptors(dset, k=k, cutoff=cutoff)
+    offsets = get_frame_offsets(dset)
+    entropies, _ = frame_entropy(x, offsets, h=h, batch_size=batch_size)
+
+    frames = np.split(x, offsets[1:-1])
+    return frames, entropies
 
 
 def compress_dataset(
@@ -87,7 +87,7 @@ def compress_dataset(
 
     if c_type == "fps":
         # retrieve indexes
-        indexes = farthest_point_sampling(frames, entropies)
+        indexes = fps(frames, entropies, len(frames), method="fps")
 
     elif c_type == "msc":
         # retrieve indexes
@@ -0,0 +1,120 @@
+import math
+
+import numba as nb
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH
+
+DEFAULT_CORESET_SIZE = 10000
+
+
+def kernel_lipschitz(h: float = DEFAULT_BANDWIDTH) -> float:
+    """Returns the Lipschitz constant of the Gaussian kernel
+    exp(-r^2 / 2h^2) with respect to r, which is exp(-1/2) / h.
+    """
+    return math.exp(-0.5) / h
+
+
+def density_error_bound(radius: float, h: float = DEFAULT_BANDWIDTH) -> float:
+    """Bounds the error of the normalized density p(x) / N of a reference
+        that was replaced by a weighted coreset with covering radius `radius`.
+        Since each reference point is moved by at most `radius`, each kernel
+        changes by at most L * radius, with L the Lipschitz constant of the
+        kernel, regardless of `x`.
+
+    Arguments:
+        radius (float): maximum distance between a reference point and the
+            center that represents it.
+        h (float): bandwidth of the Gaussian kernel.
+
+    Returns:
+        error (float): maximum absolute error of p(x) / N.
+    """
+    return kernel_lipschitz(h) * radius
+
+
+def kcenter_coreset(
+    y: np.ndarray,
+    size: int = DEFAULT_CORESET_SIZE,
+    radius: float = None,
+    h: float = DEFAULT_BANDWIDTH,
+    tolerance: float = None,
+):
+    """Compresses the reference `y` into a weighted set of representative
+        points using the greedy k-center (farthest point) algorithm over the
+        environments. Each new center is the reference point farthest from
+        the existing centers, and each reference point is assigned to its
+        nearest center, whose weight is the number of points it represents.
+        The sampling stops when `size` centers were selected or when all
+        points are within `radius` of a center. The error of the density
+        of any query is then bounded by `density_error_bound`.
+
+        The centers and weights can be used as the reference of
+        `delta_entropy(x, centers, weights=weights)`, whose cost scales with
+        the size of the coreset instead of the size of the reference.
+
+    Arguments:
+        y (np.ndarray): an (N, d) matrix with the reference descriptors
+        size (int): maximum number of centers.
+        radius (float): if given, stops when the covering radius is smaller
+            than this value.
+        h (float): bandwidth of the kernel, used only with `tolerance`.
+        tolerance (float): if given, stops when the error of p(x) / N is
+            guaranteed to be smaller than this value. Overrides `radius`.
+
+    Returns:
+        centers (np.ndarray): an (n, d) matrix with the selected centers.
+        weights (np.ndarray): an (n,) vector with the number of reference
+            points represented by each center.
+        radius (float): covering radius of the coreset, i.e., the largest
+            distance between a reference point and its center.
+    """
+    if tolerance is not None:
+        radius = tolerance / kernel_lipschitz(h)
+
+    size = min(size, y.shape[0])
+    radius = 0.0 if radius is None else radius
+
+    indices, assignment, max_dist = _kcenter(y, size, radius)
+    weights = np.bincount(assignment, minlength=len(indices))
+
+    return np.asarray(y[indices]), weights, max_dist
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _kcenter(y: np.ndarray, size: int, radius: float):
+    N = y.shape[0]
+    d = y.shape[1]
+
+    # distance between each point and its nearest center so far
+    min_dist = np.full(N, np.inf)
+    assignment = np.zeros(N, dtype=np.int64)
+    indices = np.empty(size, dtype=np.int64)
+
+    next_i = 0
+    n_centers = 0
+    max_dist = np.inf
+    while n_centers < size:
+        indices[n_centers] = next_i
+        center = y[next_i]
+
+        # only the distances towards the newest center are computed
+        for i in nb.prange(N):
+            dist = 0.0
+            for k in range(d):
+                diff = y[i, k] - center[k]
+                dist += diff * diff
+
+            dist = math.sqrt(dist)
+            if dist < min_dist[i]:
+                min_dist[i] = dist
+                assignment[i] = n_centers
+
+        n_centers += 1
+
+        next_i = np.argmax(min_dist)
+        max_dist = min_dist[next_i]
+        if max_dist <= radius:
+            break
+
+    return indices[:n_centers], assignment, max_dist
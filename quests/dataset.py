@@ -0,0 +1,117 @@
+import os
+from typing import List
+
+import numpy as np
+from ase import Atoms
+
+from .precision import from_storage, get_dtype, to_storage
+
+METADATA_KEYS = ("offsets", "natoms", "volumes", "numbers", "positions", "cells", "pbc")
+
+
+def get_metadata(dset: List[Atoms]) -> dict:
+    """Creates a compact table with the metadata of the frames of `dset`,
+        which is used by downstream calculations instead of parsing the
+        dataset again. Per-atom arrays follow the order of the rows of
+        `get_descriptors(dset)`.
+
+    Arguments:
+        dset (List[Atoms]): dataset for which the descriptors are computed.
+
+    Returns:
+        metadata (dict): dictionary with the following arrays:
+            offsets (n_frames + 1,): index of the first atom of each frame,
+                followed by the total number of atoms.
+            natoms (n_frames,): number of atoms of each frame.
+            volumes (n_frames,): volume of each frame (NaN if not periodic).
+            numbers (n_atoms,): atomic number of each atom.
+            positions (n_atoms, 3): positions of each atom.
+            cells (n_frames, 3, 3): cell of each frame.
+            pbc (n_frames, 3): periodic boundary conditions of each frame.
+    """
+    natoms = np.array([len(atoms) for atoms in dset], dtype=np.int64)
+
+    return {
+        "offsets": np.concatenate([[0], np.cumsum(natoms)]).astype(np.int64),
+        "natoms": natoms,
+        "volumes": np.array(
+            [atoms.cell.volume if np.all(atoms.pbc) else np.nan for atoms in dset]
+        ),
+        "numbers": np.concatenate([atoms.numbers for atoms in dset]).astype(np.uint8),
+        "positions": np.concatenate([atoms.positions for atoms in dset]),
+        "cells": np.array([np.array(atoms.cell) for atoms in dset]).reshape(-1, 3, 3),
+        "pbc": np.array([atoms.pbc for atoms in dset], dtype=bool).reshape(-1, 3),
+    }
+
+
+def metadata_to_atoms(metadata: dict) -> List[Atoms]:
+    """Recreates the frames described by `metadata`. Only the structures are
+    recovered, as other properties of the original file are not stored.
+    """
+    offsets = metadata["offsets"]
+    return [
+        Atoms(
+            numbers=metadata["numbers"][start:end],
+            positions=metadata["positions"][start:end],
+            cell=metadata["cells"][i],
+            pbc=metadata["pbc"][i],
+        )
+        for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]))
+    ]
+
+
+def save_dataset(path: str, x: np.ndarray, metadata: dict = None, **attrs):
+    """Saves the descriptors `x` and the metadata of their frames to a
+        `.npz` file, which can be loaded with `load_dataset`.
+
+    Arguments:
+        path (str): path to the `.npz` file.
+        x (np.ndarray): matrix with the descriptors
+        metadata (dict): metadata table created with `get_metadata`.
+        **attrs: scalar attributes saved with the dataset, such as the
+            parameters of the descriptors.
+    """
+    arrays = {"descriptors": to_storage(x), "dtype": x.dtype.name}
+
+    if metadata is not None:
+        arrays.update({f"metadata_{key}": metadata[key] for key in METADATA_KEYS})
+
+    arrays.update({f"attr_{key}": value for key, value in attrs.items()})
+    np.savez(path, **arrays)
+
+
+def load_dataset(path: str):
+    """Loads the descriptors and metadata saved with `save_dataset`.
+
+    Arguments:
+        path (str): path to the `.npz` file.
+
+    Returns:
+        x (np.ndarray): matrix with the descriptors
+        metadata (dict): metadata table, or None if it was not saved.
+        attrs (dict): attributes saved with the dataset.
+    """
+    with np.load(path) as data:
+        x = from_storage(data["descriptors"])
+        if "dtype" in data:
+            x = x.astype(get_dtype(str(data["dtype"])), copy=False)
+
+        metadata = None
+        if all(f"metadata_{key}" in data for key in METADATA_KEYS):
+            metadata = {key: data[f"metadata_{key}"] for key in METADATA_KEYS}
+
+        attrs = {
+            key[len("attr_") :]: data[key].item()
+            for key in data.files
+            if key.startswith("attr_")
+        }
+
+    return x, metadata, attrs
+
+
+def source_stamp(file: str) -> str:
+    """Returns a string that changes when `file` is modified, used to check
+    whether a cached dataset is still valid.
+    """
+    stat = os.stat(file)
+    return f"{os.path.abspath(file)}:{stat.st_size}:{stat.st_mtime_ns}"
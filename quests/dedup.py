@@ -0,0 +1,66 @@
+from typing import Tuple
+
+import numpy as np
+
+DEFAULT_RESOLUTION = 1e-5
+
+
+def quantize(x: np.ndarray, resolution: float = DEFAULT_RESOLUTION) -> np.ndarray:
+    """Maps the descriptors `x` to the cells of a grid with spacing
+        `resolution`. Descriptors within the same cell share the same key.
+        If `resolution` is zero, the keys are the exact descriptors.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors
+        resolution (float): spacing of the quantization grid.
+
+    Returns:
+        keys (np.ndarray): an (N,) vector with one hashable key per row.
+    """
+    if resolution > 0:
+        grid = np.round(np.asarray(x) / resolution).astype(np.int64)
+    else:
+        grid = np.ascontiguousarray(x)
+
+    # each row is viewed as a single opaque item, so rows can be
+    # compared and sorted as a whole
+    grid = np.ascontiguousarray(grid)
+    return grid.view(np.dtype((np.void, grid.dtype.itemsize * grid.shape[1]))).ravel()
+
+
+def deduplicate(
+    x: np.ndarray,
+    resolution: float = DEFAULT_RESOLUTION,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Collapses exact or near-exact duplicates of the descriptors `x` into
+        unique rows with integer multiplicities. Two environments are merged
+        if their descriptors fall in the same cell of a grid with spacing
+        `resolution`, and the first of them is kept as the representative.
+        The counts can be used as `weights` in `quests.entropy` to reproduce
+        the results of the full dataset.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors
+        resolution (float): spacing of the quantization grid. If zero, only
+            exact duplicates are merged.
+
+    Returns:
+        unique (np.ndarray): an (U, d) matrix with the unique descriptors.
+        counts (np.ndarray): an (U,) vector with the multiplicity of each
+            unique descriptor.
+        inverse (np.ndarray): an (N,) vector with the index of the unique
+            descriptor of each row of `x`, such that `unique[inverse]`
+            recovers `x` up to `resolution`.
+    """
+    keys = quantize(x, resolution)
+    _, index, inverse, counts = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True
+    )
+
+    # keeps the unique descriptors in the order they first appear in `x`
+    order = np.argsort(index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    unique = np.asarray(x[index[order]])
+    return unique, counts[order], rank[inverse.ravel()]
@@ -8,6 +8,8 @@ from numba.typed import Dict, List
 
 from .geometry import cutoff_fn
 from .matrix import argsort, cdist, inverse_3d, pdist, stack_xyz
+from .precision import get_dtype
+from .profiling import count, is_profiling, stage
 
 IntList = types.ListType(types.int64)
 FloatArrayList = types.Array(types.float64, 1, "C")
@@ -100,18 +102,27 @@ def descriptor_x2(
     return x2
 
 
-@nb.njit(fastmath=True, cache=True)
 def descriptor_nopbc(
     xyz: np.ndarray,
     k: int = DEFAULT_K,
     cutoff: float = DEFAULT_CUTOFF,
     eps: float = EPS,
 ) -> np.ndarray:
-    dm = pdist(xyz)
-    sorter = argsort(dm)
+    """Computes the descriptors of a non-periodic frame. The neighbor search,
+    x1 and x2 are recorded as stages of the active profiler, if any.
+    """
+    with stage("neighbor_search"):
+        dm = pdist(xyz)
+        sorter = argsort(dm)
+
+    count("neighbor_pairs", len(xyz) * len(xyz))
+
+    with stage("x1"):
+        x1 = descriptor_x1(dm, sorter, k, cutoff)
+
+    with stage("x2"):
+        x2 = descriptor_x2(dm, sorter, k, cutoff)
 
-    x1 = descriptor_x1(dm, sorter, k, cutoff)
-    x2 = descriptor_x2(dm, sorter, k, cutoff)
     return x1, x2
 
 
@@ -203,16 +214,20 @@ def bin_atoms(xyz: np.ndarray, cell: np.ndarray, n_bins: np.ndarray):
 
 
 @nb.njit(fastmath=True, cache=True, parallel=True)
-def descriptor_pbc(
-    xyz: np.ndarray,
+def neighbors_pbc(
+    bins: np.ndarray,
+    cart_coords: np.ndarray,
     cell: np.ndarray,
+    n_bins: np.ndarray,
+    n_nbr_bins: np.ndarray,
     k: int = DEFAULT_K,
-    cutoff: float = DEFAULT_CUTOFF,
-    eps: float = EPS,
-) -> np.ndarray:
-    N = xyz.shape[0]
-
-    n_bins, n_nbr_bins = get_num_bins(cell, cutoff)
+):
+    """Finds the k-nearest neighbors of each atom of a periodic frame whose
+    atoms were separated into bins by `bin_atoms`. Returns an (N, k + 1, 3)
+    array with the positions of each atom followed by its neighbors, sorted
+    by distance, and the number of valid positions of each atom.
+    """
+    N = cart_coords.shape[0]
 
     # this is how many bins we will have to explore to make sure we get
     # all atoms within the cutoff
@@ -222,15 +237,13 @@ def descriptor_pbc(
     max_bins = np.prod(n_bins)
     n_bins_x, n_bins_y, n_bins_z = n_bins
 
-    bins, cart_coords = bin_atoms(xyz, cell, n_bins)
-
     bin_dict = create_bin_dict(bins, max_bins)
 
-    # initializes the descriptors
-    x1 = np.full((N, k), fill_value=0.0)
-    x2 = np.full((N, k - 1), fill_value=0.0)
+    # initializes the neighbors
+    nbr_xyz = np.full((N, k + 1, 3), fill_value=0.0)
+    n_nbrs = np.zeros(N, dtype=np.int64)
 
-    # now we can compute the descriptors by looping over bins
+    # now we can find the neighbors by looping over bins
     # this should be computed in parallel, so we simply use nb.prange
     # to separate this into different threads
     for i in nb.prange(max_bins):
@@ -293,41 +306,118 @@ def descriptor_pbc(
         sorter = argsort(dm)
         k_min = min([k + 1, len(nbrs_xyz)])
 
-        # loops over the atoms in the bin to avoid computing the
-        # distance matrix between all neighbors
+        # stores the nearest positions of each atom in the bin
         for j in range(n_atoms_bin):
             atom_j = atoms[j]
-
-            # get the positions from the neighbors
-            atom_xyz = np.empty((k_min, 3))
+            n_nbrs[atom_j] = k_min
             for nbr in range(k_min):
-                nbr_idx = sorter[j, nbr]
-                atom_xyz[nbr] = nbrs_xyz[nbr_idx]
+                nbr_xyz[atom_j, nbr] = nbrs_xyz[sorter[j, nbr]]
+
+    return nbr_xyz, n_nbrs
+
+
+@nb.njit(fastmath=True, cache=True, parallel=True)
+def descriptor_x1_pbc(
+    nbr_xyz: np.ndarray,
+    n_nbrs: np.ndarray,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    eps: float = 1e-16,
+) -> np.ndarray:
+    """Computes x1 from the neighbors found by `neighbors_pbc`. Only the
+    distances between each atom and its neighbors are needed.
+    """
+    N = nbr_xyz.shape[0]
+    x1 = np.full((N, k), fill_value=0.0)
+
+    for i in nb.prange(N):
+        n = n_nbrs[i]
+        jmax = k if n > k else (n - 1)
+
+        for j in range(jmax):
+            dist = 0.0
+            for d in range(3):
+                diff = nbr_xyz[i, 0, d] - nbr_xyz[i, j + 1, d]
+                dist += diff * diff
+
+            rij = np.sqrt(dist) + eps
+            wij = cutoff_fn(rij, cutoff)
+            x1[i, j] = wij / rij
+
+    return x1
+
 
-            # computes the distance matrix only for the atom and its
-            # k-nearest neighbors
-            atom_dm = pdist(atom_xyz)
+@nb.njit(fastmath=True, cache=True, parallel=True)
+def descriptor_x2_pbc(
+    nbr_xyz: np.ndarray,
+    n_nbrs: np.ndarray,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+) -> np.ndarray:
+    """Computes x2 from the neighbors found by `neighbors_pbc`."""
+    N = nbr_xyz.shape[0]
+    x2 = np.full((N, k - 1), fill_value=0.0)
 
-            # the new distance matrix is already sorted, so the new
-            # sorter is basically an arange
-            atom_sorter = np.empty((1, k_min), dtype=sorter.dtype)
-            for v in range(k_min):
-                atom_sorter[0, v] = v
+    for i in nb.prange(N):
+        n = n_nbrs[i]
 
-            # compute the descriptors only for the single atom under analysis
-            atom_x1 = descriptor_x1(atom_dm, atom_sorter, k, cutoff, max_rows=1)
-            atom_x2 = descriptor_x2(atom_dm, atom_sorter, k, cutoff, max_rows=1)
+        # computes the distance matrix only for the atom and its
+        # k-nearest neighbors
+        atom_dm = pdist(nbr_xyz[i, :n])
+
+        # the new distance matrix is already sorted, so the new
+        # sorter is basically an arange
+        atom_sorter = np.empty((1, n), dtype=np.int64)
+        for v in range(n):
+            atom_sorter[0, v] = v
+
+        # compute the descriptors only for the single atom under analysis
+        atom_x2 = descriptor_x2(atom_dm, atom_sorter, k, cutoff, max_rows=1)
+
+        # x2 has k-1 columns
+        for col in range(k - 1):
+            x2[i, col] = atom_x2[0, col]
+
+    return x2
 
-            # x1 has k columns
-            for col in range(k):
-                x1[atom_j, col] = atom_x1[0, col]
 
-            # x2 has k-1 columns
-            for col in range(k - 1):
-                x2[atom_j, col] = atom_x2[0, col]
+def descriptor_pbc(
+    xyz: np.ndarray,
+    cell: np.ndarray,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    eps: float = EPS,
+) -> np.ndarray:
+    """Computes the descriptors of a periodic frame. The atoms are binned,
+    their neighbors are found in parallel over the bins, and x1 and x2 are
+    computed in parallel over the atoms. Each step is recorded as a stage
+    of the active profiler, if any.
+    """
+    cell = np.asarray(cell, dtype=np.float64)
+
+    with stage("bin"):
+        n_bins, n_nbr_bins = get_num_bins(cell, cutoff)
+        bins, cart_coords = bin_atoms(xyz, cell, n_bins)
 
-    # finished processing this bin. Now, return and process
-    # another bin until everything is ready.
+    if is_profiling():
+        # each non-empty bin visits the stencil of bins within the cutoff
+        max_bins = int(np.prod(n_bins))
+        nonempty = np.count_nonzero(np.bincount(bins, minlength=max_bins))
+        count("bins", max_bins)
+        count("nonempty_bins", nonempty)
+        count("binned_atoms", len(bins))
+        count("bins_visited", nonempty * int(np.prod(2 * n_nbr_bins + 1)))
+
+    with stage("neighbor_search"):
+        nbr_xyz, n_nbrs = neighbors_pbc(
+            bins, cart_coords, cell, n_bins, n_nbr_bins, k
+        )
+
+    with stage("x1"):
+        x1 = descriptor_x1_pbc(nbr_xyz, n_nbrs, k, cutoff)
+
+    with stage("x2"):
+        x2 = descriptor_x2_pbc(nbr_xyz, n_nbrs, k, cutoff)
 
     return x1, x2
 
@@ -349,13 +439,18 @@ def get_descriptors(
         cutoff (float): cutoff radius for the weight function.
         concat (bool): if True, concatenates X1 and X2 column-wise and returns a
             single matrix X.
-        dtype (str): dtype for the matrix.
+        dtype (str): dtype for the matrix. Half-precision dtypes ("float16" or
+            "bfloat16") halve the memory, and are computed in float32 by
+            the functions in `quests.entropy`.
 
     Returns:
         X (np.ndarray): matrix containing descriptors for all atoms in `dset`.
     """
     x1, x2 = [], []
     for atoms in dset:
+        count("frames")
+        count("atoms", len(atoms))
+
         if not np.all(atoms.pbc):
             _x1, _x2 = descriptor_nopbc(atoms.positions, k=k, cutoff=cutoff)
         else:
@@ -369,10 +464,42 @@ def get_descriptors(
     x1 = np.concatenate(x1)
     x2 = np.concatenate(x2)
 
-    x1 = x1.astype(dtype)
-    x2 = x2.astype(dtype)
+    x1 = x1.astype(get_dtype(dtype))
+    x2 = x2.astype(get_dtype(dtype))
 
     if concat:
         return np.concatenate([x1, x2], axis=1)
 
     return x1, x2
+
+
+def get_frame_offsets(dset: List[Atoms]) -> np.ndarray:
+    """Returns the index of the first environment of each frame of `dset`
+        in the matrix of descriptors created by `get_descriptors`.
+
+    Arguments:
+        dset (List[Atoms]): dataset for which the descriptors were computed.
+
+    Returns:
+        offsets (np.ndarray): an (n_frames + 1,) vector with the offsets of
+            each frame followed by the total number of environments.
+    """
+    natoms = np.array([len(atoms) for atoms in dset], dtype=np.int64)
+    return np.concatenate([[0], np.cumsum(natoms)])
+
+
+def pack_frames(descriptors: List[np.ndarray]):
+    """Packs a list with the descriptors of each frame into a single matrix
+        and the offsets of each frame.
+
+    Arguments:
+        descriptors (List[np.ndarray]): list with the descriptors of each frame.
+
+    Returns:
+        x (np.ndarray): matrix containing the descriptors of all frames.
+        offsets (np.ndarray): an (n_frames + 1,) vector with the offsets of
+            each frame followed by the total number of environments.
+    """
+    sizes = np.array([len(x) for x in descriptors], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    return np.concatenate(descriptors, axis=0), offsets
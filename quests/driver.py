@@ -0,0 +1,278 @@
+import os
+import signal
+import threading
+import zlib
+from time import perf_counter
+
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, kernel_sum
+from .memory import get_num_threads
+from .precision import get_dtype
+
+DEFAULT_INTERVAL = 300.0
+CHECKPOINT_VERSION = 2
+
+
+class Cancelled(Exception):
+    """Raised when a calculation is cancelled between two chunks. The partial
+    results are saved to the checkpoint, if any, before raising.
+    """
+
+
+class ChunkedDriver:
+    """Computes kernel sums in chunks of rows of the test set, so that long
+    calculations report their progress and throughput, can be cancelled
+    between chunks (with `cancel`, SIGINT or SIGTERM) and are periodically
+    saved to a checkpoint with the partial p(x), the chunk size and a bitmap
+    of the chunks that were completed. A calculation with the same inputs
+    continues from the checkpoint if `resume` is True, with the chunk size
+    of the checkpoint, so it can be resumed with a different number of
+    threads.
+
+    The driver is used as a backend of the entropy functions, e.g.,
+
+        driver = ChunkedDriver(checkpoint="entropy.ckpt.npz", resume=True)
+        H = perfect_entropy(x, h=0.015, backend=driver)
+    """
+
+    supports_weights = True
+    supports_options = True
+
+    def __init__(
+        self,
+        chunk_size: int = None,
+        checkpoint: str = None,
+        resume: bool = False,
+        interval: float = DEFAULT_INTERVAL,
+        log=None,
+    ):
+        """Creates the driver.
+
+        Arguments:
+            chunk_size (int): number of rows of the test set computed at
+                once. If None, each chunk has one batch per numba thread.
+                When resuming, the chunk size of the checkpoint is used.
+            checkpoint (str): path to the `.npz` checkpoint. If None, the
+                partial results are not saved.
+            resume (bool): if True, continues from the checkpoint when it
+                matches the calculation.
+            interval (float): minimum time (in s) between two checkpoints.
+            log (callable): function that receives the progress messages. If
+                None, the progress is not reported.
+        """
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.interval = interval
+        self.log = log
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stops the calculation after the chunk that is being computed."""
+        self._cancel.set()
+
+    def kernel_sum(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        h: float = DEFAULT_BANDWIDTH,
+        batch_size: int = DEFAULT_BATCH,
+        block_size: int = None,
+        weights: np.ndarray = None,
+        memory_budget=None,
+        compute_dtype=None,
+        prefetch: bool = True,
+    ):
+        """Computes the kernel sum of `x` with respect to `y` chunk by chunk.
+            See `quests.entropy.kernel_sum` for the arguments, which are
+            passed to the kernel sum of each chunk.
+
+        Returns:
+            ki (np.ndarray): a (M,) vector containing the probability of x_i
+                given `y`, or an (n_h, M) matrix if `h` is a vector.
+        """
+        M = x.shape[0]
+        key = get_fingerprint(x, y, h, weights)
+
+        # results computed in another dtype are not resumed
+        if compute_dtype is not None:
+            key += f";dtype={get_dtype(compute_dtype).name}"
+        p_x, done, chunk_size = self._load(key)
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size or batch_size * get_num_threads()
+
+        n_chunks = max(-(-M // chunk_size), 1)
+        if done is None:
+            done = np.zeros(n_chunks, dtype=bool)
+        else:
+            done = np.unpackbits(done, count=n_chunks).astype(bool)
+            self._log_resume(done)
+
+        self._cancel.clear()
+        handlers = self._install_handlers()
+
+        start = perf_counter()
+        last_save = start
+        n_done = int(done.sum())
+        n_run = 0
+        rows = 0
+        try:
+            for c in np.flatnonzero(~done):
+                if self._cancel.is_set():
+                    self._save(key, p_x, done, chunk_size)
+                    raise Cancelled(self._cancel_message(done))
+
+                i, imax = c * chunk_size, min((c + 1) * chunk_size, M)
+                p = kernel_sum(
+                    x[i:imax],
+                    y,
+                    h=h,
+                    batch_size=batch_size,
+                    block_size=block_size,
+                    prefetch=prefetch,
+                    memory_budget=memory_budget,
+                    weights=weights,
+                    compute_dtype=compute_dtype,
+                )
+                p = np.atleast_2d(p)
+
+                if p_x is None:
+                    p_x = np.zeros((p.shape[0], M), dtype=p.dtype)
+
+                p_x[:, i:imax] = p
+                done[c] = True
+                n_done += 1
+                n_run += 1
+                rows += imax - i
+
+                now = perf_counter()
+                self._report(n_done, n_chunks, n_run, rows, y.shape[0], now - start)
+
+                if now - last_save >= self.interval:
+                    self._save(key, p_x, done, chunk_size)
+                    last_save = now
+        finally:
+            self._restore_handlers(handlers)
+
+        if p_x is None:
+            p_x = np.zeros((np.size(h), M))
+
+        self._save(key, p_x, done, chunk_size)
+
+        if np.ndim(h) == 0:
+            return p_x[0]
+
+        return p_x
+
+    def _report(self, n_done, n_chunks, n_run, rows, N, elapsed):
+        if self.log is None:
+            return
+
+        # the throughput only considers the chunks computed in this run
+        rate = rows / max(elapsed, 1e-12)
+        remaining = (n_chunks - n_done) / n_run * elapsed
+        self.log(
+            f"Chunk {n_done}/{n_chunks} ({100 * n_done / n_chunks:.1f}%): "
+            + f"{rate:.3g} envs/s, {rate * N:.3g} pairs/s, "
+            + f"ETA {remaining:.1f} s"
+        )
+
+    def _cancel_message(self, done) -> str:
+        msg = f"Cancelled after {int(done.sum())} of {len(done)} chunks"
+        if self.checkpoint is not None:
+            msg += f". Partial results saved to {self.checkpoint}"
+
+        return msg
+
+    def _load(self, key: str):
+        """Returns the partial p(x), the packed bitmap of completed chunks and
+        the chunk size of the checkpoint, or None if there is nothing to resume.
+        """
+        if not self.resume or self.checkpoint is None:
+            return None, None, None
+
+        if not os.path.exists(self.checkpoint):
+            return None, None, None
+
+        with np.load(self.checkpoint) as data:
+            if int(data["version"]) != CHECKPOINT_VERSION or str(data["key"]) != key:
+                raise ValueError(
+                    f"Checkpoint {self.checkpoint} was created for a different "
+                    + "calculation and cannot be resumed"
+                )
+
+            return data["p_x"], data["done"], int(data["chunk_size"])
+
+    def _log_resume(self, done):
+        if self.log is not None:
+            self.log(
+                f"Resuming from {self.checkpoint}: {done.sum()} of "
+                + f"{len(done)} chunks completed"
+            )
+
+    def _save(self, key: str, p_x: np.ndarray, done: np.ndarray, chunk_size: int):
+        if self.checkpoint is None or p_x is None:
+            return
+
+        # the checkpoint is replaced atomically, so an interruption while
+        # saving keeps the previous one
+        tmp = self.checkpoint + ".tmp.npz"
+        np.savez(
+            tmp,
+            version=CHECKPOINT_VERSION,
+            key=key,
+            p_x=p_x,
+            done=np.packbits(done),
+            chunk_size=chunk_size,
+        )
+        os.replace(tmp, self.checkpoint)
+
+    def _install_handlers(self) -> dict:
+        # signals can only be handled in the main thread
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+
+        handlers = {}
+
+        # the first signal stops the calculation after the current chunk, and
+        # the original handlers are restored so a second signal aborts it
+        def handler(signum, frame):
+            self._restore_handlers(handlers)
+            self.cancel()
+            if self.log is not None:
+                self.log("Stopping after the current chunk...")
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            handlers[sig] = signal.signal(sig, handler)
+
+        return handlers
+
+    def _restore_handlers(self, handlers: dict):
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+
+
+def get_fingerprint(x, y, h, weights=None) -> str:
+    """Returns a string that identifies a kernel sum, used to check that a
+    checkpoint belongs to the same calculation. The shapes and bandwidths
+    are compared, as well as checksums of samples of the rows.
+    """
+
+    def checksum(a):
+        if a is None:
+            return 0
+
+        step = max(len(a) // 1000, 1)
+        return zlib.crc32(np.ascontiguousarray(a[::step]).tobytes())
+
+    h = np.atleast_1d(np.asarray(h, dtype=np.float64))
+    return ";".join(
+        [
+            f"x={x.shape}:{checksum(x)}",
+            f"y={y.shape}:{checksum(y)}",
+            f"w={checksum(weights)}",
+            f"h={h.tolist()}",
+        ]
+    )
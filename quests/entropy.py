@@ -4,7 +4,13 @@ import numba as nb
 import numpy as np
 
 from .geometry import cutoff_fn
-from .matrix import cdist, norm, sum_positive, sumexp, wsumexp
+from .matrix import cdist, norm, sum_positive, sumexp
+from .memory import plan_kernel_sum
+from .precision import get_compute_dtype, is_half, to_compute
+from .profiling import count, stage
+from .store import as_descriptors
+from .stream import DEFAULT_BLOCK, is_out_of_core, iter_blocks
+from .threads import blas_limits, first_touch, numa_enabled
 
 DEFAULT_BANDWIDTH = 0.015
 DEFAULT_BATCH = 20000
@@ -16,6 +22,8 @@ def perfect_entropy(
     x: np.ndarray,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    weights: np.ndarray = None,
+    **kwargs,
 ):
     """Computes the perfect entropy of a dataset using a batch distance
         calculation. This is necessary because the full distance matrix
@@ -25,20 +33,28 @@ def perfect_entropy(
 
     Arguments:
         x (np.ndarray): an (N, d) matrix with the descriptors
-        h (int): bandwidth for the Gaussian kernel
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths computed in a single distance pass
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        weights (np.ndarray): if given, an (N,) vector with the multiplicity
+            of each row of `x`, such as the counts from `quests.dedup`.
+        **kwargs: additional arguments passed to `kernel_sum`.
 
     Returns:
-        entropy (float): entropy of the dataset given by `x`.
+        entropy (float or np.ndarray): entropy of the dataset given by `x`,
+            or an (n_h,) vector of entropies if `h` is a vector.
     """
-    N = x.shape[0]
-    p_x = kernel_sum(x, x, h=h, batch_size=batch_size)
+    N = x.shape[0] if weights is None else np.sum(weights)
+    p_x = kernel_sum(x, x, h=h, batch_size=batch_size, weights=weights, **kwargs)
 
     # normalizes the p(x) prior to the log for numerical stability
     p_x = np.log(p_x / N)
 
-    return -np.mean(p_x)
+    if weights is None:
+        return -np.mean(p_x, axis=-1)
+
+    return -np.sum(weights * p_x, axis=-1) / N
 
 
 def delta_entropy(
@@ -46,6 +62,8 @@ def delta_entropy(
     y: np.ndarray,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    weights: np.ndarray = None,
+    **kwargs,
 ):
     """Computes the differential entropy of a dataset `x` using the dataset
         `y` as reference. This function can be SLOW, despite the optimization
@@ -54,14 +72,19 @@ def delta_entropy(
     Arguments:
         x (np.ndarray): an (N, d) matrix with the descriptors of the test set
         y (np.ndarray): an (N, d) matrix with the descriptors of the reference
-        h (int): bandwidth for the Gaussian kernel
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths computed in a single distance pass
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        weights (np.ndarray): if given, an (N,) vector with the multiplicity
+            of each row of the reference `y`.
+        **kwargs: additional arguments passed to `kernel_sum`.
 
     Returns:
-        entropy (float): entropy of the dataset given by `x`.
+        entropy (np.ndarray): an (N,) vector with the differential entropy
+            of each point in `x`, or an (n_h, N) matrix if `h` is a vector.
     """
-    p_x = kernel_sum(x, y, h=h, batch_size=batch_size)
+    p_x = kernel_sum(x, y, h=h, batch_size=batch_size, weights=weights, **kwargs)
     return -np.log(p_x)
 
 
@@ -69,6 +92,8 @@ def diversity(
     x: np.ndarray,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    weights: np.ndarray = None,
+    **kwargs,
 ):
     """Computes the diversity of a dataset `x` by assuming a sum over the
         inverse p(x). This approximates the number of unique data points
@@ -76,40 +101,240 @@ def diversity(
 
     Arguments:
         x (np.ndarray): an (N, d) matrix with the descriptors of the dataset
-        h (int): bandwidth for the Gaussian kernel
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths computed in a single distance pass
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        weights (np.ndarray): if given, an (N,) vector with the multiplicity
+            of each row of `x`.
+        **kwargs: additional arguments passed to `kernel_sum`.
 
     Returns:
-        entropy (float): entropy of the dataset given by `x`.
+        diversity (float or np.ndarray): diversity of the dataset given by
+            `x`, or an (n_h,) vector of diversities if `h` is a vector.
     """
-    p_x = kernel_sum(x, x, h=h, batch_size=batch_size)
-    return np.log(np.sum(1 / p_x))
+    p_x = kernel_sum(x, x, h=h, batch_size=batch_size, weights=weights, **kwargs)
+
+    if weights is None:
+        return np.log(np.sum(1 / p_x, axis=-1))
+
+    return np.log(np.sum(weights / p_x, axis=-1))
 
 
-@nb.njit(fastmath=True, parallel=True, cache=True)
 def kernel_sum(
     x: np.ndarray,
     y: np.ndarray,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    block_size: int = None,
+    prefetch: bool = True,
+    backend=None,
+    memory_budget=None,
+    weights: np.ndarray = None,
+    compute_dtype=None,
 ):
     """Computes the kernel matrix K_ij for the descriptors x_i and y_j.
         Because the entire matrix cannot fit in the memory, this function
         automatically applies the kernel and sums the results, essentially
         recovering the probability distribution p(x) up to a normalization
-        constant.
+        constant. If a vector of bandwidths is given, each distance tile is
+        computed only once and fed to the kernels of all bandwidths.
+
+        If `block_size` is given, or if any of the inputs is memory-mapped,
+        the matrices are streamed from the disk in blocks of rows, so only
+        a few blocks are kept in the memory at any time.
+
+    Arguments:
+        x (np.ndarray): an (M, d) matrix with the test descriptors, or a
+            `quests.store.DescriptorStore`, which is memory-mapped
+        y (np.ndarray): an (N, d) matrix with the reference descriptors, or
+            a `quests.store.DescriptorStore`
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths
+        batch_size (int): maximum batch size to consider when
+            performing a distance calculation.
+        block_size (int): number of rows loaded into the memory at once when
+            streaming `x` and `y`. If None, the matrices are streamed only if
+            they are memory-mapped.
+        prefetch (bool): if True, reads the next block of `y` in a
+            background thread while the current block is processed.
+        backend: if given, an object with a `kernel_sum` method that computes
+            the kernel sums instead of the current process, such as
+            `quests.sharded.ShardedExecutor` or `quests.driver.ChunkedDriver`.
+            Backends with `supports_weights = True` also receive the
+            `weights`, and backends with `supports_options = True` receive
+            `memory_budget`, `compute_dtype` and `prefetch`, which raise an
+            error otherwise. If `y` itself has a `kernel_sum`
+            method, such as `quests.quantize.PQReference`, it is used as the
+            backend.
+        memory_budget (int or str): if given, the batch size (and block size,
+            when streaming) are derived from this memory budget in bytes
+            (e.g., "8G") and the number of threads, overriding `batch_size`.
+            "auto" uses a fraction of the available memory.
+        weights (np.ndarray): if given, an (N,) vector with the multiplicity
+            of each row of `y`, such that K_ij is summed w_j times. This
+            reproduces the kernel sums of a dataset whose duplicates were
+            collapsed with `quests.dedup.deduplicate`.
+        compute_dtype (np.dtype): dtype of the distances and kernel sums. By
+            default, half-precision (float16 or bfloat16) descriptors are
+            computed in float32 and other descriptors in their own dtype.
+            Descriptors stored in a different dtype are converted block by
+            block, so they are never converted as a whole.
+
+    Returns:
+        ki (np.ndarray): a (M,) vector containing the probability of x_i
+            given `y`, or an (n_h, M) matrix if `h` is a vector.
+    """
+    x, y = as_descriptors(x), as_descriptors(y)
+
+    # encoded references compute their own kernel sums
+    if backend is None and hasattr(y, "kernel_sum"):
+        backend = y
+
+    if backend is not None:
+        kwargs = {}
+        if weights is not None:
+            assert getattr(
+                backend, "supports_weights", False
+            ), "Weights are not supported by the backend"
+            kwargs["weights"] = weights
+
+        # options of the kernels that run in the current process
+        if memory_budget is not None or compute_dtype is not None or not prefetch:
+            assert getattr(backend, "supports_options", False), (
+                "memory_budget, compute_dtype and prefetch are not supported "
+                + "by the backend"
+            )
+            kwargs.update(
+                memory_budget=memory_budget,
+                compute_dtype=compute_dtype,
+                prefetch=prefetch,
+            )
+
+        return backend.kernel_sum(
+            x, y, h=h, batch_size=batch_size, block_size=block_size, **kwargs
+        )
+
+    dtype = x.dtype
+    streaming = is_out_of_core(x) or is_out_of_core(y)
+
+    # half-precision descriptors are upconverted when streamed
+    if compute_dtype is not None or is_half(x.dtype) or is_half(y.dtype):
+        dtype = np.promote_types(
+            get_compute_dtype(x.dtype, compute_dtype),
+            get_compute_dtype(y.dtype, compute_dtype),
+        )
+        streaming = True
+
+    bandwidths = np.atleast_1d(np.asarray(h, dtype=dtype))
+
+    if memory_budget is not None:
+        plan = plan_kernel_sum(
+            memory_budget,
+            M=x.shape[0],
+            N=y.shape[0],
+            d=x.shape[1],
+            dtype=dtype,
+            n_bandwidths=len(bandwidths),
+            streaming=streaming or block_size is not None,
+        )
+        batch_size = plan["batch_size"]
+        block_size = block_size or plan["block_size"]
+
+    if block_size is None and streaming:
+        block_size = DEFAULT_BLOCK
+
+    if weights is not None:
+        weights = np.asarray(weights, dtype=dtype)
+
+    _count_tiles(x.shape[0], y.shape[0], len(bandwidths), batch_size)
+
+    with stage("kernel_tiles"), blas_limits():
+        if block_size is None:
+            x, y = _place(x, y, batch_size)
+            p_x = _kernel_sum(x, y, bandwidths, batch_size, weights)
+        else:
+            p_x = _kernel_sum_blocks(
+                x, y, bandwidths, batch_size, block_size, prefetch, weights, dtype
+            )
+
+    if np.ndim(h) == 0:
+        return p_x[0]
+
+    return p_x
+
+
+def _count_tiles(M: int, N: int, n_h: int, batch_size: int):
+    """Counts the work of a kernel sum for `quests.profiling`."""
+    count("kernel_pairs", M * N)
+    count("kernel_evaluations", M * N * n_h)
+    count("kernel_tiles", math.ceil(M / batch_size) * math.ceil(N / batch_size))
+
+
+def _place(x: np.ndarray, y: np.ndarray, batch_size: int):
+    """Copies the inputs of the kernels with `quests.threads.first_touch` if
+    NUMA placement is enabled, so the pages of each batch are allocated in
+    the node of the thread that computes it.
+    """
+    if not numa_enabled():
+        return x, y
+
+    x_placed = first_touch(x, batch_size)
+    if y is x:
+        return x_placed, x_placed
+
+    return x_placed, first_touch(y, batch_size)
+
+
+def _kernel_sum_blocks(
+    x: np.ndarray,
+    y: np.ndarray,
+    h: np.ndarray,
+    batch_size: int = DEFAULT_BATCH,
+    block_size: int = DEFAULT_BLOCK,
+    prefetch: bool = True,
+    weights: np.ndarray = None,
+    dtype=None,
+):
+    """Computes the kernel sums of `x` with respect to `y` by streaming
+        blocks of rows of both matrices. The numba kernel releases the GIL,
+        so the next block of `y` is read while the current one is processed.
+        If `dtype` is given, each block is converted to it when it is read.
+    """
+    p_x = np.zeros((h.shape[0], x.shape[0]), dtype=h.dtype)
+
+    for i, imax, x_block in iter_blocks(x, block_size, prefetch=False, dtype=dtype):
+        y_blocks = iter_blocks(y, block_size, prefetch=prefetch, dtype=dtype)
+        for j, jmax, y_block in y_blocks:
+            w_block = None if weights is None else weights[j:jmax]
+            p_x[:, i:imax] += _kernel_sum(x_block, y_block, h, batch_size, w_block)
+
+    return p_x
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _kernel_sum(
+    x: np.ndarray,
+    y: np.ndarray,
+    h: np.ndarray,
+    batch_size: int = DEFAULT_BATCH,
+    weights: np.ndarray = None,
+):
+    """Computes the kernel sums of `x` with respect to `y` for all
+        bandwidths in `h` while computing each distance tile only once.
 
     Arguments:
         x (np.ndarray): an (M, d) matrix with the test descriptors
         y (np.ndarray): an (N, d) matrix with the reference descriptors
-        h (int): bandwidth for the Gaussian kernel
+        h (np.ndarray): an (n_h,) vector with the bandwidths of the kernels
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        weights (np.ndarray): an (N,) vector with the multiplicity of each
+            row of `y`. If None, the unweighted kernel is compiled.
 
     Returns:
-        ki (np.ndarray): a (M,) vector containing the probability of x_i
-            given `y`
+        ki (np.ndarray): an (n_h, M) matrix containing the probability
+            of x_i given `y` for each bandwidth
     """
     M = x.shape[0]
     max_step_x = math.ceil(M / batch_size)
@@ -121,8 +346,14 @@ def kernel_sum(
     norm_x = norm(x)
     norm_y = norm(y)
 
+    # exponent of the Gaussian kernel for each bandwidth
+    n_h = h.shape[0]
+    coef = np.empty(n_h, dtype=x.dtype)
+    for b in range(n_h):
+        coef[b] = -0.5 / (h[b] * h[b])
+
     # variables that are going to store the results
-    p_x = np.zeros(M, dtype=x.dtype)
+    p_x = np.zeros((n_h, M), dtype=x.dtype)
 
     # loops over rows and columns to compute the
     # distance matrix without keeping it entirely
@@ -140,53 +371,141 @@ def kernel_sum(
             y_batch = y[j:jmax]
             y_batch_norm = norm_y[j:jmax]
 
-            # computing the estimated probability distribution for the batch
+            # the distances are computed once and reused for all bandwidths
             z = cdist(x_batch, y_batch, x_batch_norm, y_batch_norm)
-            z = z / h
-            z = sumexp(-0.5 * (z**2))
 
-            for k in range(i, imax):
-                p_x[k] = p_x[k] + z[k - i]
+            for b in range(n_h):
+                c = coef[b]
+                for k in range(i, imax):
+                    _sum = 0.0
+                    if weights is None:
+                        for l in range(jmax - j):
+                            d = z[k - i, l]
+                            _sum += math.exp(c * d * d)
+                    else:
+                        for l in range(jmax - j):
+                            d = z[k - i, l]
+                            _sum += weights[j + l] * math.exp(c * d * d)
+
+                    p_x[b, k] = p_x[b, k] + _sum
 
     return p_x
 
 
-@nb.njit(fastmath=True, parallel=True, cache=True)
 def weighted_kernel_sum(
     x: np.ndarray,
     y: np.ndarray,
     w: np.ndarray,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
 ):
     """Computes the product w_j * K_ij for the descriptors x_i and y_j, and
-        a given weight w_j of same size as y_j.
+        a given weight w_j of same size as y_j. The kernel is evaluated only
+        once per pair and reused for p(x) and all columns of the weights.
 
     Arguments:
         x (np.ndarray): an (M, d) matrix with the test descriptors
         y (np.ndarray): an (N, d) matrix with the reference descriptors
-        w (np.ndarray): an (N, d) matrix with the weights
-        h (int): bandwidth for the Gaussian kernel
+        w (np.ndarray): an (N,) vector or an (N, m) matrix with the weights
+        h (float): bandwidth for the Gaussian kernel
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
 
     Returns:
-        q (np.ndarray): a (M,) vector containing the weighted average of w
+        q (np.ndarray): a (M,) vector (or (M, m) matrix) containing the
+            weighted average of w given `y`
+        p (np.ndarray): a (M,) vector containing the probability of x_i
             given `y`
     """
+    x, y = to_compute(x), to_compute(y)
+    w = np.asarray(w, dtype=x.dtype)
+    w_matrix = np.ascontiguousarray(w.reshape(w.shape[0], -1))
+
+    if memory_budget is not None:
+        plan = plan_kernel_sum(
+            memory_budget,
+            M=x.shape[0],
+            N=y.shape[0],
+            d=x.shape[1],
+            dtype=x.dtype,
+            n_bandwidths=w_matrix.shape[1] + 1,
+        )
+        batch_size = plan["batch_size"]
+
+    _count_tiles(x.shape[0], y.shape[0], 1, batch_size)
+
+    with stage("kernel_tiles"), blas_limits():
+        x, y = _place(x, y, batch_size)
+        w_x, p_x = _weighted_kernel_sum(x, y, w_matrix, h, batch_size)
+
+    if w.ndim == 1:
+        return w_x[:, 0], p_x
+
+    return w_x, p_x
+
+
+def kernel_regression(
+    x: np.ndarray,
+    y: np.ndarray,
+    values: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
+):
+    """Predicts properties of the environments `x` using a kernel-smoothed
+        (Nadaraya-Watson) average of the `values` of the reference `y`. All
+        properties are predicted at once, evaluating the kernel only once
+        per pair of environments.
+
+    Arguments:
+        x (np.ndarray): an (M, d) matrix with the test descriptors
+        y (np.ndarray): an (N, d) matrix with the reference descriptors
+        values (np.ndarray): an (N,) vector or an (N, m) matrix with the
+            properties of each environment of `y`
+        h (float): bandwidth for the Gaussian kernel
+        batch_size (int): maximum batch size to consider when
+            performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
+
+    Returns:
+        predictions (np.ndarray): an (M,) vector or an (M, m) matrix with the
+            predicted properties of `x`
+    """
+    predictions, _ = weighted_kernel_sum(
+        x, y, values, h=h, batch_size=batch_size, memory_budget=memory_budget
+    )
+    return predictions
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _weighted_kernel_sum(
+    x: np.ndarray,
+    y: np.ndarray,
+    w: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+):
     M = x.shape[0]
     max_step_x = math.ceil(M / batch_size)
 
     N = y.shape[0]
     max_step_y = math.ceil(N / batch_size)
 
+    # exponent of the Gaussian kernel in the dtype of the descriptors
+    n_cols = w.shape[1]
+    coef = np.full(1, -0.5 / (h * h), dtype=x.dtype)[0]
+
     # precomputing the norms saves us some time
     norm_x = norm(x)
     norm_y = norm(y)
 
     # variables that are going to store the results
     p_x = np.zeros(M, dtype=x.dtype)
-    w_x = np.zeros(M, dtype=x.dtype)
+    w_x = np.zeros((M, n_cols), dtype=x.dtype)
 
     # loops over rows and columns to compute the
     # distance matrix without keeping it entirely
@@ -206,25 +525,204 @@ def weighted_kernel_sum(
 
             w_batch = w[j:jmax]
 
-            # computing the estimated probability distribution for the batch
+            # the kernel is computed in place, once per pair
             z = cdist(x_batch, y_batch, x_batch_norm, y_batch_norm)
-            z = z / h
-            z = -0.5 * (z**2)
+            for k in range(imax - i):
+                _sum = 0.0
+                for l in range(jmax - j):
+                    d = z[k, l]
+                    z[k, l] = math.exp(coef * d * d)
+                    _sum += z[k, l]
+
+                p_x[i + k] = p_x[i + k] + _sum
 
-            # computed the expected value of the error
-            p = sumexp(z)
-            wp = wsumexp(z, w_batch)
+            # all columns of the weights are reduced at once
+            wp = np.dot(z, w_batch)
 
             for k in range(i, imax):
-                p_x[k] = p_x[k] + p[k - i]
-                w_x[k] = w_x[k] + wp[k - i]
+                for col in range(n_cols):
+                    w_x[k, col] = w_x[k, col] + wp[k - i, col]
 
         for k in range(i, imax):
-            w_x[k] = w_x[k] / p_x[k]
+            for col in range(n_cols):
+                w_x[k, col] = w_x[k, col] / p_x[k]
 
     return w_x, p_x
 
 
+def frame_entropy(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+):
+    """Computes the entropy and diversity of each frame of a dataset in a
+        single parallel call. The descriptors of all frames are packed in a
+        single matrix `x`, and the environments of frame `f` are given by the
+        rows `offsets[f]:offsets[f + 1]`. The calculation is parallelized
+        over frames, which avoids calling `perfect_entropy` once per frame.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors of all frames
+        offsets (np.ndarray): an (n_frames + 1,) vector with the index of the
+            first environment of each frame followed by N.
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths computed in a single distance pass
+        batch_size (int): maximum batch size to consider when
+            performing a distance calculation within a frame.
+
+    Returns:
+        entropies (np.ndarray): an (n_frames,) vector with the entropy of
+            each frame, or an (n_h, n_frames) matrix if `h` is a vector.
+        diversities (np.ndarray): diversity of each frame, with the same
+            shape as `entropies`. Frames without environments are NaN.
+    """
+    x = to_compute(x)
+    bandwidths = np.atleast_1d(np.asarray(h, dtype=x.dtype))
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    natoms = np.diff(offsets)
+    count("kernel_pairs", int(np.sum(natoms * natoms)))
+    count("kernel_evaluations", int(np.sum(natoms * natoms)) * len(bandwidths))
+
+    with stage("frame_kernel_tiles"), blas_limits():
+        entropies, diversities = _frame_entropy(x, offsets, bandwidths, batch_size)
+
+    if np.ndim(h) == 0:
+        return entropies[0], diversities[0]
+
+    return entropies, diversities
+
+
+def frame_delta_entropy(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    y: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    **kwargs,
+):
+    """Computes the differential entropy of the environments of all frames
+        packed in `x` with respect to the reference `y`, and summarizes them
+        per frame.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors of all frames
+        offsets (np.ndarray): an (n_frames + 1,) vector with the index of the
+            first environment of each frame followed by N.
+        y (np.ndarray): an (N, d) matrix with the descriptors of the reference
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths computed in a single distance pass
+        batch_size (int): maximum batch size to consider when
+            performing a distance calculation.
+        **kwargs: additional arguments passed to `kernel_sum`.
+
+    Returns:
+        dH_mean (np.ndarray): an (n_frames,) vector with the mean dH of each
+            frame, or an (n_h, n_frames) matrix if `h` is a vector.
+        dH_max (np.ndarray): maximum dH of each frame, with the same shape
+            as `dH_mean`.
+    """
+    delta = delta_entropy(x, y, h=h, batch_size=batch_size, **kwargs)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    dH_mean, dH_max = _segment_mean_max(np.atleast_2d(delta), offsets)
+
+    if np.ndim(h) == 0:
+        return dH_mean[0], dH_max[0]
+
+    return dH_mean, dH_max
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _frame_entropy(
+    x: np.ndarray,
+    offsets: np.ndarray,
+    h: np.ndarray,
+    batch_size: int = DEFAULT_BATCH,
+):
+    n_frames = offsets.shape[0] - 1
+    n_h = h.shape[0]
+
+    # exponent of the Gaussian kernel for each bandwidth
+    coef = np.empty(n_h, dtype=x.dtype)
+    for b in range(n_h):
+        coef[b] = -0.5 / (h[b] * h[b])
+
+    # empty frames are NaN, as in `_segment_mean_max`
+    entropies = np.full((n_h, n_frames), np.nan)
+    diversities = np.full((n_h, n_frames), np.nan)
+
+    # each thread processes entire frames
+    for f in nb.prange(n_frames):
+        start = offsets[f]
+        n = offsets[f + 1] - start
+        if n == 0:
+            continue
+
+        frame = x[start : start + n]
+        frame_norm = norm(frame)
+        p = np.zeros((n_h, n), dtype=np.float64)
+
+        # large frames are also split into batches
+        for i in range(0, n, batch_size):
+            imax = min(i + batch_size, n)
+            for j in range(0, n, batch_size):
+                jmax = min(j + batch_size, n)
+                z = cdist(
+                    frame[i:imax], frame[j:jmax], frame_norm[i:imax], frame_norm[j:jmax]
+                )
+
+                for b in range(n_h):
+                    c = coef[b]
+                    for k in range(imax - i):
+                        _sum = 0.0
+                        for l in range(jmax - j):
+                            d = z[k, l]
+                            _sum += math.exp(c * d * d)
+
+                        p[b, i + k] += _sum
+
+        # same expressions as `perfect_entropy` and `diversity`
+        for b in range(n_h):
+            _entropy = 0.0
+            _inverse = 0.0
+            for k in range(n):
+                _entropy += math.log(p[b, k] / n)
+                _inverse += 1 / p[b, k]
+
+            entropies[b, f] = -_entropy / n
+            diversities[b, f] = math.log(_inverse)
+
+    return entropies, diversities
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _segment_mean_max(values: np.ndarray, offsets: np.ndarray):
+    n_rows = values.shape[0]
+    n_frames = offsets.shape[0] - 1
+
+    means = np.full((n_rows, n_frames), np.nan)
+    maxes = np.full((n_rows, n_frames), np.nan)
+
+    for f in nb.prange(n_frames):
+        start = offsets[f]
+        end = offsets[f + 1]
+        if end == start:
+            continue
+
+        for b in range(n_rows):
+            _sum = 0.0
+            _max = values[b, start]
+            for k in range(start, end):
+                _sum += values[b, k]
+                _max = max(_max, values[b, k])
+
+            means[b, f] = _sum / (end - start)
+            maxes[b, f] = _max
+
+    return means, maxes
+
+
 def get_bandwidth(volume: float, method: str = "gaussian"):
     """Estimate of the bandwidth based on the dependence
         of the entropy w.r.t. volume per atom (or density).
@@ -252,6 +750,7 @@ def approx_delta_entropy(
     h: float = DEFAULT_BANDWIDTH,
     n: int = DEFAULT_UQ_NBRS,
     graph_neighbors: int = DEFAULT_GRAPH_NBRS,
+    weights: np.ndarray = None,
     **kwargs,
 ):
     """Computes an approximate differential entropy of a dataset `x` using the dataset
@@ -261,21 +760,32 @@ def approx_delta_entropy(
 
     Arguments:
         x (np.ndarray): an (N, d) matrix with the descriptors of the test set
-        y (np.ndarray): an (N, d) matrix with the descriptors of the reference
+        y (np.ndarray): an (N, d) matrix with the descriptors of the reference,
+            or an object with a `query` method, such as a
+            `quests.quantize.PQReference`, used instead of the PyNNDescent index.
         h (int): bandwidth for the Gaussian kernel
         k (int): number of nearest-neighbors to take into account when computing
             the approximate dH
+        weights (np.ndarray): if given, an (N,) vector with the weight of each
+            row of the reference, such as the weights of a coreset.
 
     Returns:
         dH (np.ndarray): approx. differential entropy of the dataset given by `x`.
     """
-    import pynndescent as nnd
+    if hasattr(y, "query"):
+        index = y
+    else:
+        import pynndescent as nnd
 
-    index = nnd.NNDescent(y, n_neighbors=graph_neighbors, **kwargs)
-    index.prepare()
+        index = nnd.NNDescent(y, n_neighbors=graph_neighbors, **kwargs)
+        index.prepare()
 
-    _, d = index.query(x, k=n)
+    i, d = index.query(x, k=n)
     z = d / h
-    p_x = sumexp(-0.5 * z**2)
+
+    if weights is None:
+        p_x = sumexp(-0.5 * z**2)
+    else:
+        p_x = np.sum(weights[i] * np.exp(-0.5 * z**2), axis=1)
 
     return -np.log(p_x)
@@ -0,0 +1,347 @@
+import itertools
+from typing import List
+
+import numpy as np
+import torch
+from ase import Atoms
+
+from quests.descriptor import DEFAULT_CUTOFF, DEFAULT_K, EPS, get_num_bins
+from quests.memory import AUTO_FRACTION, plan_descriptors
+
+from .matrix import cdist, inverse_3d
+
+DEFAULT_ATOM_BATCH = 10000
+
+
+def cutoff_fn(r: torch.tensor, cutoff: float):
+    z = torch.clamp(r, max=cutoff) / cutoff
+    return (1 - z**2) ** 2
+
+
+def descriptor_x1(
+    r: torch.tensor,
+    mask: torch.tensor,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    eps: float = 1e-16,
+) -> torch.tensor:
+    """Computes the x1 descriptor from the sorted distances between each
+        atom and its nearest neighbors.
+
+    Arguments:
+        r (torch.tensor): an (n, m) matrix with the distances towards the m
+            nearest neighbors of each atom, sorted in ascending order.
+        mask (torch.tensor): an (n, m) boolean matrix indicating which
+            neighbors exist.
+        k (int): number of nearest neighbors of the descriptor.
+        cutoff (float): cutoff radius for the weight function.
+
+    Returns:
+        x1 (torch.tensor): an (n, k) matrix with the descriptors
+    """
+    n, m = r.shape
+    x1 = torch.zeros((n, k), dtype=r.dtype, device=r.device)
+
+    rij = r + eps
+    wij = cutoff_fn(rij, cutoff)
+    x1[:, :m] = torch.where(mask, wij / rij, 0.0)
+
+    return x1
+
+
+def descriptor_x2(
+    nbr_dm: torch.tensor,
+    r: torch.tensor,
+    mask: torch.tensor,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    eps: float = EPS,
+) -> torch.tensor:
+    """Computes the x2 descriptor from the distances between each atom and
+        its nearest neighbors and the distances among the neighbors.
+
+    Arguments:
+        nbr_dm (torch.tensor): an (n, m, m) tensor with the distances between
+            the m nearest neighbors of each atom.
+        r (torch.tensor): an (n, m) matrix with the distances towards the m
+            nearest neighbors of each atom, sorted in ascending order.
+        mask (torch.tensor): an (n, m) boolean matrix indicating which
+            neighbors exist.
+        k (int): number of nearest neighbors of the descriptor.
+        cutoff (float): cutoff radius for the weight function.
+
+    Returns:
+        x2 (torch.tensor): an (n, k - 1) matrix with the descriptors
+    """
+    n, m = r.shape
+    wij = torch.where(mask, cutoff_fn(r, cutoff), 0.0)
+
+    # cross terms between neighbors j and l, excluding j == l
+    rjl = torch.zeros((n, k, k), dtype=r.dtype, device=r.device)
+    wjl = torch.sqrt(wij.unsqueeze(2) * wij.unsqueeze(1))
+    rjl[:, :m, :m] = wjl / (nbr_dm + eps)
+    rjl[:, torch.arange(k), torch.arange(k)] = 0.0
+
+    # the mean over the rows of the sorted matrix, largest first
+    r_sort, _ = torch.sort(rjl, dim=2)
+    x2 = r_sort[:, :, 1:].sum(dim=1) / k
+
+    return torch.flip(x2, dims=(1,))
+
+
+def descriptors_from_neighbors(
+    nbr_xyz: torch.tensor,
+    mask: torch.tensor,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+):
+    """Computes the descriptors x1 and x2 from the positions of the
+        neighbors of each atom.
+
+    Arguments:
+        nbr_xyz (torch.tensor): an (n, m + 1, 3) tensor with the position of
+            each atom followed by its m nearest neighbors in ascending order
+            of distance.
+        mask (torch.tensor): an (n, m) boolean matrix indicating which
+            neighbors exist.
+        k (int): number of nearest neighbors of the descriptor.
+        cutoff (float): cutoff radius for the weight function.
+
+    Returns:
+        x1, x2 (torch.tensor): (n, k) and (n, k - 1) matrices with the
+            descriptors.
+    """
+    nbrs = nbr_xyz[:, 1:]
+    r = torch.linalg.norm(nbrs - nbr_xyz[:, :1], dim=-1)
+    nbr_dm = torch.cdist(nbrs, nbrs)
+
+    x1 = descriptor_x1(r, mask, k, cutoff)
+    x2 = descriptor_x2(nbr_dm, r, mask, k, cutoff)
+
+    return x1, x2
+
+
+def descriptor_nopbc(
+    xyz: torch.tensor,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    batch_size: int = DEFAULT_ATOM_BATCH,
+):
+    """Computes the descriptors of a structure without periodic boundary
+        conditions. The atoms are processed in batches to bound the memory.
+
+    Arguments:
+        xyz (torch.tensor): an (N, 3) matrix with the positions of the atoms.
+        k (int): number of nearest neighbors to use when computing descriptors.
+        cutoff (float): cutoff radius for the weight function.
+        batch_size (int): number of atoms processed at once.
+
+    Returns:
+        x1, x2 (torch.tensor): (N, k) and (N, k - 1) matrices with the
+            descriptors.
+    """
+    N = xyz.shape[0]
+    n_nbrs = min(k + 1, N)
+
+    x1, x2 = [], []
+    for i in range(0, N, batch_size):
+        dm = cdist(xyz[i : i + batch_size], xyz)
+        _, sorter = torch.topk(dm, n_nbrs, dim=1, largest=False, sorted=True)
+
+        nbr_xyz = xyz[sorter]
+        mask = torch.ones(
+            (nbr_xyz.shape[0], n_nbrs - 1), dtype=torch.bool, device=xyz.device
+        )
+
+        _x1, _x2 = descriptors_from_neighbors(nbr_xyz, mask, k, cutoff)
+        x1.append(_x1)
+        x2.append(_x2)
+
+    return torch.cat(x1), torch.cat(x2)
+
+
+def bin_atoms(xyz: torch.tensor, cell: torch.tensor, n_bins: torch.tensor):
+    """Separates the atoms into bins by splitting the `cell` into
+    `n_bins` depending on the vector directions.
+    """
+    inv = inverse_3d(cell)
+    frac_coords = torch.round(xyz @ inv, decimals=12)  # numerical stability
+    frac_coords = torch.remainder(frac_coords, 1.0)  # wrap back to the unit cell
+    cart_coords = frac_coords @ cell
+
+    xyz_bins = torch.floor(frac_coords * n_bins).long()
+    xyz_bins = torch.minimum(xyz_bins, n_bins - 1)
+    bins = (
+        xyz_bins[:, 0]
+        + xyz_bins[:, 1] * n_bins[0]
+        + xyz_bins[:, 2] * n_bins[0] * n_bins[1]
+    )
+
+    return bins, cart_coords
+
+
+def descriptor_pbc(
+    xyz: torch.tensor,
+    cell: torch.tensor,
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    batch_size: int = DEFAULT_ATOM_BATCH,
+):
+    """Computes the descriptors of a periodic structure. The atoms are
+        split into bins of the size of the cutoff, and the nearest neighbors
+        of the atoms of each bin are searched among the (periodic images of)
+        atoms of the adjacent bins. Bins are processed in batches of tensors
+        padded to the most populated bin.
+
+    Arguments:
+        xyz (torch.tensor): an (N, 3) matrix with the positions of the atoms.
+        cell (torch.tensor): a (3, 3) matrix with the lattice vectors.
+        k (int): number of nearest neighbors to use when computing descriptors.
+        cutoff (float): cutoff radius for the weight function.
+        batch_size (int): approximate number of atoms processed at once.
+
+    Returns:
+        x1, x2 (torch.tensor): (N, k) and (N, k - 1) matrices with the
+            descriptors.
+    """
+    device, dtype = xyz.device, xyz.dtype
+    N = xyz.shape[0]
+
+    n_bins, n_nbr_bins = get_num_bins(cell.detach().cpu().numpy(), cutoff)
+    max_bins = int(np.prod(n_bins))
+    n_bins_t = torch.tensor(n_bins, device=device)
+
+    bins, cart_coords = bin_atoms(xyz, cell, n_bins_t)
+
+    # table with the atoms of each bin, padded with -1
+    order = torch.argsort(bins, stable=True)
+    counts = torch.bincount(bins, minlength=max_bins)
+    starts = torch.cumsum(counts, 0) - counts
+    max_per_bin = int(counts.max())
+    slot = torch.arange(N, device=device) - starts[bins[order]]
+    bin_table = torch.full((max_bins, max_per_bin), -1, dtype=torch.long, device=device)
+    bin_table[bins[order], slot] = order
+
+    # neighboring bins and the periodic shift of each of them
+    offsets = torch.tensor(
+        list(itertools.product(*[range(-d, d + 1) for d in n_nbr_bins])),
+        device=device,
+    )
+    bin_idx = torch.arange(max_bins, device=device)
+    bin_xyz = torch.stack(
+        [
+            bin_idx % n_bins_t[0],
+            (bin_idx // n_bins_t[0]) % n_bins_t[1],
+            bin_idx // (n_bins_t[0] * n_bins_t[1]),
+        ],
+        dim=1,
+    )
+    nbr_bin_xyz = bin_xyz.unsqueeze(1) + offsets.unsqueeze(0)
+    shifts = torch.div(nbr_bin_xyz, n_bins_t, rounding_mode="floor")
+    nbr_bin_xyz = nbr_bin_xyz - shifts * n_bins_t
+    nbr_bins = (
+        nbr_bin_xyz[..., 0]
+        + nbr_bin_xyz[..., 1] * n_bins_t[0]
+        + nbr_bin_xyz[..., 2] * n_bins_t[0] * n_bins_t[1]
+    )
+    shifts = shifts.to(dtype) @ cell
+
+    x1 = torch.zeros((N, k), dtype=dtype, device=device)
+    x2 = torch.zeros((N, k - 1), dtype=dtype, device=device)
+
+    bins_per_batch = max(batch_size // max_per_bin, 1)
+    for b in range(0, max_bins, bins_per_batch):
+        batch = slice(b, min(b + bins_per_batch, max_bins))
+        atoms = bin_table[batch]
+        n_batch = atoms.shape[0]
+
+        # candidate neighbors: atoms of adjacent bins and their images
+        cand = bin_table[nbr_bins[batch]]
+        cand_xyz = cart_coords[cand.clamp(min=0)] + shifts[batch].unsqueeze(2)
+        cand = cand.reshape(n_batch, -1)
+        cand_xyz = cand_xyz.reshape(n_batch, -1, 3)
+
+        # distances between the atoms of the bin and the candidates
+        center_xyz = cart_coords[atoms.clamp(min=0)]
+        dm = torch.cdist(center_xyz, cand_xyz)
+        dm = dm.masked_fill((cand < 0).unsqueeze(1), float("inf"))
+
+        n_nbrs = min(k + 1, cand.shape[1])
+        dist, sorter = torch.topk(dm, n_nbrs, dim=2, largest=False, sorted=True)
+
+        # keep only the slots of existing atoms
+        valid = atoms >= 0
+        dist, sorter = dist[valid], sorter[valid]
+        atom_bin = torch.arange(n_batch, device=device).unsqueeze(1)
+        atom_bin = atom_bin.expand(-1, max_per_bin)[valid]
+
+        nbr_xyz = cand_xyz[atom_bin.unsqueeze(1), sorter]
+        mask = torch.isfinite(dist[:, 1:])
+
+        _x1, _x2 = descriptors_from_neighbors(nbr_xyz, mask, k, cutoff)
+        x1[atoms[valid]] = _x1
+        x2[atoms[valid]] = _x2
+
+    return x1, x2
+
+
+def get_descriptors(
+    dset: List[Atoms],
+    k: int = DEFAULT_K,
+    cutoff: float = DEFAULT_CUTOFF,
+    concat: bool = True,
+    dtype: torch.dtype = torch.float32,
+    device: str = "cpu",
+    batch_size: int = DEFAULT_ATOM_BATCH,
+    memory_budget=None,
+):
+    """Computes the default representation for the QUESTS approach given a
+        dataset `dset` using PyTorch. The descriptors are created on `device`
+        and can be used directly by `quests.gpu.entropy` without copying them
+        to the host. On CPUs, the computation is parallelized with the
+        intra-op threads of PyTorch.
+
+    Arguments:
+        dset (List[Atoms]): dataset for which the descriptors will be computed.
+        k (int): number of nearest neighbors to use when computing descriptors.
+        cutoff (float): cutoff radius for the weight function.
+        concat (bool): if True, concatenates X1 and X2 column-wise and returns a
+            single matrix X.
+        dtype (torch.dtype): dtype for the matrix.
+        device (str): device where the descriptors are computed.
+        batch_size (int): approximate number of atoms processed at once.
+        memory_budget (int or str): if given, the number of atoms processed at
+            once is derived from this memory budget, overriding `batch_size`.
+
+    Returns:
+        X (torch.tensor): matrix containing descriptors for all atoms in `dset`.
+    """
+    if memory_budget == "auto" and torch.device(device).type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        memory_budget = int(AUTO_FRACTION * free)
+
+    if memory_budget is not None:
+        batch_size = plan_descriptors(memory_budget, k, dtype=torch.float64)
+
+    x1, x2 = [], []
+    for atoms in dset:
+        xyz = torch.tensor(atoms.positions, dtype=torch.float64, device=device)
+
+        if not np.all(atoms.pbc):
+            _x1, _x2 = descriptor_nopbc(xyz, k=k, cutoff=cutoff, batch_size=batch_size)
+        else:
+            cell = torch.tensor(np.array(atoms.cell), dtype=torch.float64, device=device)
+            _x1, _x2 = descriptor_pbc(
+                xyz, cell, k=k, cutoff=cutoff, batch_size=batch_size
+            )
+
+        x1.append(_x1)
+        x2.append(_x2)
+
+    x1 = torch.cat(x1).to(dtype)
+    x2 = torch.cat(x2).to(dtype)
+
+    if concat:
+        return torch.cat([x1, x2], dim=1)
+
+    return x1, x2
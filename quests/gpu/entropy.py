@@ -2,6 +2,8 @@ import math
 
 import torch
 
+from quests.memory import AUTO_FRACTION, plan_kernel_sum
+
 from .matrix import cdist, norm, sum_positive, sumexp, wsumexp
 
 DEFAULT_BANDWIDTH = 0.015
@@ -14,6 +16,7 @@ def perfect_entropy(
     x: torch.tensor,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
 ):
     """Computes the perfect entropy of a dataset using a batch distance
         calculation. This is necessary because the full distance matrix
@@ -26,12 +29,14 @@ def perfect_entropy(
         h (int): bandwidth for the Gaussian kernel
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
 
     Returns:
         entropy (float): entropy of the dataset given by `x`.
     """
     N = x.shape[0]
-    p_x = kernel_sum(x, x, h=h, batch_size=batch_size)
+    p_x = kernel_sum(x, x, h=h, batch_size=batch_size, memory_budget=memory_budget)
 
     # normalizes the p(x) prior to the log for numerical stability
     p_x = torch.log(p_x / N)
@@ -44,6 +49,7 @@ def delta_entropy(
     y: torch.tensor,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
 ):
     """Computes the differential entropy of a dataset `x` using the dataset
         `y` as reference. This function can be SLOW, despite the optimization
@@ -55,11 +61,13 @@ def delta_entropy(
         h (int): bandwidth for the Gaussian kernel
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
 
     Returns:
         entropy (float): entropy of the dataset given by `x`.
     """
-    p_x = kernel_sum(x, y, h=h, batch_size=batch_size)
+    p_x = kernel_sum(x, y, h=h, batch_size=batch_size, memory_budget=memory_budget)
     return -torch.log(p_x)
 
 
@@ -67,6 +75,7 @@ def diversity(
     x: torch.tensor,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
 ):
     """Computes the diversity of a dataset `x` by assuming a sum over the
         inverse p(x). This approximates the number of unique data points
@@ -77,11 +86,13 @@ def diversity(
         h (int): bandwidth for the Gaussian kernel
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
 
     Returns:
         entropy (float): entropy of the dataset given by `x`.
     """
-    p_x = kernel_sum(x, x, h=h, batch_size=batch_size)
+    p_x = kernel_sum(x, x, h=h, batch_size=batch_size, memory_budget=memory_budget)
     return torch.sum(1 / p_x)
 
 
@@ -90,6 +101,7 @@ def kernel_sum(
     y: torch.tensor,
     h: float = DEFAULT_BANDWIDTH,
     batch_size: int = DEFAULT_BATCH,
+    memory_budget=None,
 ):
     """Computes the kernel matrix K_ij for the descriptors x_i and y_j.
         Because the entire matrix cannot fit in the memory, this function
@@ -103,11 +115,16 @@ def kernel_sum(
         h (int): bandwidth for the Gaussian kernel
         batch_size (int): maximum batch size to consider when
             performing a distance calculation.
+        memory_budget (int or str): if given, the batch size is derived from
+            this memory budget, overriding `batch_size`.
 
     Returns:
         ki (torch.tensor): a (M,) vector containing the probability of x_i
             given `y`
     """
+    if memory_budget is not None:
+        batch_size = get_batch_size(x, y, memory_budget)
+
     M = x.shape[0]
     max_step_x = math.ceil(M / batch_size)
 
@@ -143,3 +160,25 @@ def kernel_sum(
             p_x[i:imax] = p_x[i:imax] + z
 
     return p_x
+
+
+def get_batch_size(x: torch.tensor, y: torch.tensor, memory_budget) -> int:
+    """Derives the batch size of `kernel_sum` from a memory budget. The
+        budget "auto" uses a fraction of the free memory of the device.
+    """
+    if memory_budget == "auto" and x.is_cuda:
+        free, _ = torch.cuda.mem_get_info(x.device)
+        memory_budget = int(AUTO_FRACTION * free)
+
+    # the distances, their square and their exponential coexist in memory
+    plan = plan_kernel_sum(
+        memory_budget,
+        M=x.shape[0],
+        N=y.shape[0],
+        d=x.shape[1],
+        dtype=x.dtype,
+        n_threads=1,
+        n_tiles=4,
+    )
+
+    return plan["batch_size"]
@@ -36,7 +36,7 @@ def cdist_Linf(A, B):
 
 
 def pdist(A):
-    return torch.pdist(A, p=2).square_().view(A.size(0), A.size(0))
+    return torch.cdist(A, A, p=2)
 
 
 def argsort(X, sort_max=-1):
@@ -51,7 +51,7 @@ def inverse_3d(matrix):
     by = torch.cross(matrix[2], matrix[0], dim=0)
     bz = torch.cross(matrix[0], matrix[1], dim=0)
     det = torch.dot(matrix[0], bx)
-    return torch.stack([bx / det, by / det, bz / det], dim=0)
+    return torch.stack([bx / det, by / det, bz / det], dim=1)
 
 
 def stack_xyz(arrays):
@@ -0,0 +1,191 @@
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+AUTO_FRACTION = 0.5
+MIN_BATCH = 256
+MAX_BATCH = 100000
+MIN_BLOCK = 10000
+
+UNITS = {
+    "": 1,
+    "b": 1,
+    "k": 1024,
+    "m": 1024**2,
+    "g": 1024**3,
+    "t": 1024**4,
+}
+
+
+def parse_memory(value) -> int:
+    """Parses a memory size given as a number of bytes or as a string
+        with units, such as "512M", "8G" or "1.5GB".
+
+    Arguments:
+        value (int or str): memory size.
+
+    Returns:
+        size (int): memory size in bytes.
+    """
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([kmgt]?)i?b?\s*", value.lower())
+    if match is None:
+        raise ValueError(f"Memory size '{value}' not understood")
+
+    number, unit = match.groups()
+    return int(float(number) * UNITS[unit])
+
+
+def format_memory(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size = size / 1024
+
+    return f"{size:.1f} TB"
+
+
+def available_memory() -> int:
+    """Returns the memory available to new allocations, in bytes."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+def resolve_budget(memory_budget) -> int:
+    """Converts a memory budget into bytes. The budget "auto" uses a
+    fraction of the memory that is currently available.
+    """
+    if memory_budget is None:
+        return None
+
+    if isinstance(memory_budget, str) and memory_budget.strip().lower() == "auto":
+        return int(AUTO_FRACTION * available_memory())
+
+    return parse_memory(memory_budget)
+
+
+def get_itemsize(dtype) -> int:
+    """Returns the size in bytes of numpy or torch dtypes."""
+    itemsize = getattr(dtype, "itemsize", None)
+    if isinstance(itemsize, int):
+        return itemsize
+
+    return np.dtype(dtype).itemsize
+
+
+def get_num_threads() -> int:
+    import numba as nb
+
+    return nb.get_num_threads()
+
+
+def plan_kernel_sum(
+    memory_budget,
+    M: int,
+    N: int,
+    d: int,
+    dtype="float32",
+    n_bandwidths: int = 1,
+    n_threads: int = None,
+    n_tiles: int = 1,
+    streaming: bool = False,
+) -> dict:
+    """Derives the batch size (and block size, for streamed inputs) of the
+        kernel sums from a memory budget. Each thread keeps `n_tiles` distance
+        tiles of (batch_size, batch_size) in the memory, so the working set
+        scales with the square of the batch size times the number of threads.
+        The batch size is also limited so that all threads have work.
+
+    Arguments:
+        memory_budget (int or str): total memory allowed for the calculation.
+        M (int): number of test descriptors.
+        N (int): number of reference descriptors.
+        d (int): dimension of the descriptors.
+        dtype (np.dtype or torch.dtype): dtype of the computation.
+        n_bandwidths (int): number of bandwidths computed at once.
+        n_threads (int): number of threads. If None, uses the numba threads.
+        n_tiles (int): number of tiles kept in memory by each thread.
+        streaming (bool): if True, also sizes the blocks loaded into memory.
+
+    Returns:
+        plan (dict): dictionary with the `batch_size` and the `block_size`
+            (None if not streaming).
+    """
+    budget = resolve_budget(memory_budget)
+    itemsize = get_itemsize(dtype)
+    n_threads = n_threads or get_num_threads()
+
+    # outputs and norms are kept in memory regardless of the batch size
+    reserved = (n_bandwidths * M + M + N) * itemsize
+
+    # one block of x, the current block of y and the prefetched one
+    block_size = None
+    if streaming:
+        block_budget = max((budget - reserved) // 2, 0)
+        block_size = int(block_budget // (3 * d * itemsize))
+        block_size = max(block_size, MIN_BLOCK)
+        reserved += 3 * block_size * d * itemsize
+        M = min(M, block_size)
+
+    tile_budget = max(budget - reserved, 0)
+    batch_size = int(math.sqrt(tile_budget / (n_threads * n_tiles * itemsize)))
+
+    # every thread should receive at least one batch of rows
+    batch_size = min(batch_size, math.ceil(M / n_threads), MAX_BATCH)
+    batch_size = max(batch_size, MIN_BATCH)
+
+    logger.info(
+        f"Memory budget of {format_memory(budget)} with {n_threads} threads: "
+        + f"batch_size = {batch_size}, block_size = {block_size}"
+    )
+
+    return {"batch_size": batch_size, "block_size": block_size}
+
+
+def plan_descriptors(memory_budget, k: int, dtype="float64") -> int:
+    """Derives the number of atoms whose descriptors are computed at once
+        from a memory budget. Each atom requires a few (k, k) matrices with
+        the distances between its neighbors and their sorted values.
+
+    Arguments:
+        memory_budget (int or str): total memory allowed for the calculation.
+        k (int): number of nearest neighbors of the descriptor.
+        dtype (np.dtype or torch.dtype): dtype of the computation.
+
+    Returns:
+        batch_size (int): number of atoms computed at once.
+    """
+    budget = resolve_budget(memory_budget)
+    itemsize = get_itemsize(dtype)
+
+    # cross-distance matrices, their sorted copies, the sorting indices and
+    # the distances towards the candidate neighbors
+    per_atom = 3 * k * k * itemsize + k * k * 8 + 64 * k * itemsize
+    batch_size = max(int(budget // per_atom), 1)
+
+    logger.info(
+        f"Memory budget of {format_memory(budget)}: descriptor batch_size = {batch_size}"
+    )
+
+    return batch_size
@@ -0,0 +1,177 @@
+import json
+import os
+import zipfile
+
+import numpy as np
+
+DEFAULT_CHUNK = 1000000
+BINARY_FORMATS = (".npz", ".npy", ".parquet", ".arrow", ".feather")
+
+
+def is_binary_output(path: str) -> bool:
+    """Returns True if the extension of `path` selects a binary format."""
+    return path is not None and os.path.splitext(path)[1] in BINARY_FORMATS
+
+
+def get_chunk(
+    values: dict,
+    offsets: np.ndarray,
+    numbers: np.ndarray,
+    start: int,
+    end: int,
+) -> dict:
+    """Creates the rows `start:end` of a per-environment table: the index of
+    the frame, the index of the atom within its frame, the atomic number and
+    the values of each environment.
+    """
+    rows = np.arange(start, end)
+    frame = np.searchsorted(offsets, rows, side="right") - 1
+
+    chunk = {
+        "frame": frame.astype(np.int64),
+        "atom": (rows - offsets[frame]).astype(np.int32),
+        "species": np.asarray(numbers[start:end], dtype=np.uint8),
+    }
+    for name, value in values.items():
+        chunk[name] = np.asarray(value[start:end])
+
+    return chunk
+
+
+def write_environments(
+    path: str,
+    values: dict,
+    offsets: np.ndarray = None,
+    numbers: np.ndarray = None,
+    attrs: dict = None,
+    chunk_size: int = DEFAULT_CHUNK,
+):
+    """Writes per-environment results as a binary table whose format is
+        selected by the extension of `path`:
+
+            .npz: one array per column, plus the attributes.
+            .npy: a structured array with one field per column.
+            .parquet, .arrow, .feather: Arrow tables (requires `pyarrow`).
+
+        The table has the columns `frame`, `atom` and `species`, followed by
+        one column per entry of `values`. Rows are written in chunks of
+        `chunk_size`, so the table is never created in memory at once.
+
+    Arguments:
+        path (str): path to the output file.
+        values (dict): dictionary of (M,) or (M, n) arrays with the values
+            of each environment, such as {"dH": dH}.
+        offsets (np.ndarray): index of the first environment of each frame,
+            followed by M. If None, all environments belong to one frame.
+        numbers (np.ndarray): atomic number of each environment. If None,
+            the species are set to zero.
+        attrs (dict): JSON-serializable attributes saved with the table
+            (ignored by .npy files). Dictionaries are saved as json strings
+            in .npz files.
+        chunk_size (int): number of rows written at once.
+    """
+    M = len(next(iter(values.values())))
+    offsets = np.array([0, M]) if offsets is None else np.asarray(offsets)
+    numbers = np.zeros(M, dtype=np.uint8) if numbers is None else numbers
+    attrs = attrs or {}
+
+    def chunks():
+        for i in range(0, M, chunk_size):
+            yield get_chunk(values, offsets, numbers, i, min(i + chunk_size, M))
+
+    # a single row describes the dtype and shape of the columns
+    template = get_chunk(values, offsets, numbers, 0, min(M, 1))
+
+    ext = os.path.splitext(path)[1]
+    if ext == ".npz":
+        _write_npz(path, template, chunks, M, attrs)
+    elif ext == ".npy":
+        _write_npy(path, template, chunks, M)
+    elif ext in (".parquet", ".arrow", ".feather"):
+        _write_arrow(path, chunks, attrs, parquet=ext == ".parquet")
+    else:
+        raise ValueError(f"Output format {ext} not supported")
+
+
+def _write_npz(path: str, template: dict, chunks, M: int, attrs: dict):
+    # entries of a zip file are written one at a time, so the chunks are
+    # streamed once per column
+    with zipfile.ZipFile(path, "w", allowZip64=True) as zf:
+        for name, column in template.items():
+            header = {
+                "descr": np.lib.format.dtype_to_descr(column.dtype),
+                "fortran_order": False,
+                "shape": (M, *column.shape[1:]),
+            }
+            with zf.open(f"{name}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array_header_2_0(f, header)
+                for chunk in chunks():
+                    f.write(np.ascontiguousarray(chunk[name]).tobytes())
+
+        for key, value in attrs.items():
+            # None would be saved as an object array
+            if value is None:
+                continue
+
+            # nested attributes, such as the profile, are saved as json
+            if isinstance(value, dict):
+                value = json.dumps(value)
+
+            with zf.open(f"attr_{key}.npy", "w") as f:
+                np.lib.format.write_array(f, np.asarray(value))
+
+
+def _write_npy(path: str, template: dict, chunks, M: int):
+    dtype = np.dtype(
+        [(name, column.dtype, column.shape[1:]) for name, column in template.items()]
+    )
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(M,))
+
+    i = 0
+    for chunk in chunks():
+        n = len(chunk["frame"])
+        for name, column in chunk.items():
+            out[name][i : i + n] = column
+        i += n
+
+    out.flush()
+    del out
+
+
+def _write_arrow(path: str, chunks, attrs: dict, parquet: bool = True):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "Arrow and Parquet outputs require the package `pyarrow`. "
+            + "Install it with `pip install quests[arrow]`"
+        )
+
+    writer = None
+    try:
+        for chunk in chunks():
+            # Arrow columns are one-dimensional, so (M, n) values are split
+            # into the columns name_0, ..., name_{n - 1}
+            columns = {}
+            for name, column in chunk.items():
+                if column.ndim == 1:
+                    columns[name] = column
+                    continue
+
+                for j in range(column.shape[1]):
+                    columns[f"{name}_{j}"] = column[:, j]
+
+            batch = pa.RecordBatch.from_pydict(columns)
+            if writer is None:
+                metadata = {key: json.dumps(value) for key, value in attrs.items()}
+                schema = batch.schema.with_metadata(metadata)
+                if parquet:
+                    writer = pq.ParquetWriter(path, schema)
+                else:
+                    writer = pa.ipc.new_file(path, schema)
+
+            writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,76 @@
+import numpy as np
+
+HALF_DTYPES = ("float16", "bfloat16")
+COMPUTE_DTYPE = np.float32
+
+
+def get_dtype(dtype) -> np.dtype:
+    """Returns the numpy dtype given by `dtype`. The name "bfloat16" is
+    resolved with the optional `ml_dtypes` package.
+    """
+    if isinstance(dtype, str) and dtype.lower() == "bfloat16":
+        try:
+            import ml_dtypes
+        except ImportError:
+            raise ImportError(
+                "bfloat16 descriptors require the package `ml_dtypes`. "
+                + "Install it with `pip install quests[bf16]`"
+            )
+
+        return np.dtype(ml_dtypes.bfloat16)
+
+    return np.dtype(dtype)
+
+
+def is_half(dtype) -> bool:
+    """Returns True if `dtype` is a 16-bit floating point storage dtype."""
+    return np.dtype(dtype).name in HALF_DTYPES
+
+
+def get_compute_dtype(dtype, compute_dtype=None) -> np.dtype:
+    """Returns the dtype used by the kernels for descriptors stored as
+        `dtype`. Half-precision descriptors are computed in float32, as
+        their arithmetic is slow and inaccurate, and other dtypes are
+        computed in their own precision unless `compute_dtype` is given.
+
+    Arguments:
+        dtype (np.dtype): storage dtype of the descriptors.
+        compute_dtype (np.dtype): if given, overrides the default.
+
+    Returns:
+        dtype (np.dtype): dtype of the computation.
+    """
+    if compute_dtype is not None:
+        return np.dtype(compute_dtype)
+
+    if is_half(dtype):
+        return np.dtype(COMPUTE_DTYPE)
+
+    return np.dtype(dtype)
+
+
+def to_compute(x: np.ndarray, compute_dtype=None) -> np.ndarray:
+    """Converts the whole matrix `x` to its compute dtype. Used by kernels
+    that do not stream their inputs block by block.
+    """
+    return np.asarray(x, dtype=get_compute_dtype(x.dtype, compute_dtype))
+
+
+def to_storage(x: np.ndarray) -> np.ndarray:
+    """Returns an array that can be saved with `np.save`. bfloat16 is not a
+    native numpy dtype, so its bits are stored as uint16.
+    """
+    if x.dtype.name == "bfloat16":
+        return x.view(np.uint16)
+
+    return x
+
+
+def from_storage(x: np.ndarray) -> np.ndarray:
+    """Inverse of `to_storage`. Descriptors are never unsigned integers, so
+    uint16 (or raw 2-byte) arrays are interpreted as bfloat16.
+    """
+    if x.dtype == np.uint16 or x.dtype == np.dtype("V2"):
+        return x.view(get_dtype("bfloat16"))
+
+    return x
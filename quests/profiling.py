@@ -0,0 +1,226 @@
+import resource
+import sys
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+import numpy as np
+from numba.core import event
+
+# profiler that receives the stages and counters of the hot paths
+_PROFILER = None
+
+
+def peak_rss() -> int:
+    """Returns the peak resident set size of the process in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports the size in kilobytes, and macOS in bytes
+    if sys.platform == "darwin":
+        return rss
+
+    return rss * 1024
+
+
+class Profiler:
+    """Records the wall time, compilation time and memory of named stages of
+    a calculation, as well as counters of the work that was done
+    (such as pairs of environments evaluated by the kernels). The time spent
+    by numba compiling the kernels is subtracted from the stage in which the
+    compilation happened, so the run time of the stages excludes the JIT.
+    The memory is tracked with the peak resident set size of the process,
+    which never decreases: each stage records the peak at its end
+    (`max_rss_so_far`) and how much the stage raised it (`max_rss_increase`).
+
+    Stages and counters are recorded by the functions `stage` and `count`
+    while the profiler is active, e.g.,
+
+        with profiling() as profiler:
+            H = perfect_entropy(x, h=0.015)
+
+        print(format_profile(profiler.report()))
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._stack = []
+        self._compile_depth = 0
+        self._start = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the block of code as the stage `name`. Nested stages are
+        recorded with their full path, e.g., "descriptors/bin".
+        """
+        self._stack.append([name, 0.0])
+        path = "/".join(s[0] for s in self._stack)
+
+        # stages are created on entry, so outer stages are listed first
+        record = self.stages.setdefault(
+            path,
+            {
+                "calls": 0,
+                "time": 0.0,
+                "compile_time": 0.0,
+                "max_rss_so_far": 0,
+                "max_rss_increase": 0,
+            },
+        )
+
+        rss_start = peak_rss()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            _, compile_time = self._stack.pop()
+
+            record["calls"] += 1
+            record["time"] += elapsed
+            record["compile_time"] += compile_time
+            record["max_rss_so_far"] = peak_rss()
+            record["max_rss_increase"] += record["max_rss_so_far"] - rss_start
+
+            # compilation of the inner stages is also part of the outer ones
+            if self._stack:
+                self._stack[-1][1] += compile_time
+
+    def count(self, name: str, value=1):
+        """Adds `value` to the counter `name`."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def compile_started(self):
+        if self._compile_depth == 0:
+            self._compile_start = perf_counter()
+        self._compile_depth += 1
+
+    def compile_ended(self):
+        # nested compilations are part of the outermost one
+        self._compile_depth -= 1
+        if self._compile_depth > 0:
+            return
+
+        elapsed = perf_counter() - self._compile_start
+        self.count("compile_time", elapsed)
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def report(self) -> dict:
+        """Returns the stages and counters as a JSON-serializable dict. The
+        run time of each stage is its wall time minus its compilation time.
+        """
+        stages = {}
+        for path, record in self.stages.items():
+            stages[path] = {
+                **record,
+                "run_time": max(record["time"] - record["compile_time"], 0.0),
+            }
+
+        counters = {key: _to_number(value) for key, value in self.counters.items()}
+        if counters.get("nonempty_bins"):
+            counters["mean_atoms_per_bin"] = (
+                counters["binned_atoms"] / counters["nonempty_bins"]
+            )
+
+        return {
+            "total_time": perf_counter() - self._start,
+            "peak_rss": peak_rss(),
+            "stages": stages,
+            "counters": counters,
+        }
+
+
+class _CompileListener(event.Listener):
+    """Forwards the compilation events of numba to a profiler."""
+
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+
+    def on_start(self, event):
+        self.profiler.compile_started()
+
+    def on_end(self, event):
+        self.profiler.compile_ended()
+
+
+@contextmanager
+def profiling():
+    """Activates a `Profiler` within the context and listens to the numba
+    compilations. Returns the profiler.
+    """
+    global _PROFILER
+
+    previous = _PROFILER
+    profiler = Profiler()
+    _PROFILER = profiler
+
+    try:
+        with event.install_listener("numba:compile", _CompileListener(profiler)):
+            yield profiler
+    finally:
+        _PROFILER = previous
+
+
+def get_profiler():
+    """Returns the active profiler, or None if profiling is not active."""
+    return _PROFILER
+
+
+def stage(name: str):
+    """Times a block of code as a stage of the active profiler. Does nothing
+    if profiling is not active.
+    """
+    if _PROFILER is None:
+        return nullcontext()
+
+    return _PROFILER.stage(name)
+
+
+def count(name: str, value=1):
+    """Adds `value` to a counter of the active profiler, if any."""
+    if _PROFILER is not None:
+        _PROFILER.count(name, value)
+
+
+def is_profiling() -> bool:
+    """Returns True if a profiler is active. Used to skip the computation of
+    counters that are not free.
+    """
+    return _PROFILER is not None
+
+
+def _to_number(value):
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def format_profile(report: dict) -> str:
+    """Formats the output of `Profiler.report` as a table."""
+    lines = [
+        f"{'stage':<40s} {'calls':>7s} {'time (s)':>10s} "
+        + f"{'compile (s)':>12s} {'run (s)':>10s} {'max RSS (MB)':>13s} "
+        + f"{'+RSS (MB)':>10s}"
+    ]
+    for path, record in report["stages"].items():
+        depth = path.count("/")
+        name = "  " * depth + path.split("/")[-1]
+        lines.append(
+            f"{name:<40s} {record['calls']:>7d} {record['time']:>10.4f} "
+            + f"{record['compile_time']:>12.4f} {record['run_time']:>10.4f} "
+            + f"{record['max_rss_so_far'] / 2**20:>13.1f} "
+            + f"{record['max_rss_increase'] / 2**20:>10.1f}"
+        )
+
+    lines.append("")
+    for key, value in report["counters"].items():
+        if isinstance(value, float):
+            lines.append(f"{key:<40s} {value:>.4g}")
+        else:
+            lines.append(f"{key:<40s} {value:>d}")
+
+    lines.append(f"{'total time (s)':<40s} {report['total_time']:.4f}")
+    lines.append(f"{'peak RSS (MB)':<40s} {report['peak_rss'] / 2**20:.1f}")
+
+    return "\n".join(lines)
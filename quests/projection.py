@@ -0,0 +1,252 @@
+import math
+
+import numba as nb
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH
+from .matrix import norm
+from .stream import DEFAULT_BLOCK, iter_blocks
+from .threads import blas_limits
+
+DEFAULT_VARIANCE = 0.99
+DEFAULT_TOLERANCE = 1e-6
+
+
+class PCAReference:
+    """Stores a reference in a reduced space obtained with a principal
+    component analysis (PCA) of its descriptors, and computes exact kernel
+    sums with a coarse-to-fine strategy. For descriptors projected onto the
+    first r components, a and the norm of their residual, rho,
+
+        |x - y|^2 >= |a_x - a_y|^2 + (rho_x - rho_y)^2,
+
+    so the distances in r dimensions bound the kernel of each pair from
+    above. Only pairs whose kernel could be larger than `tolerance` are
+    refined with the full descriptors, and the remaining pairs are skipped.
+    The error of p(x) / N is therefore smaller than `tolerance`.
+
+    The reference can be used as a backend for the entropy functions, e.g.,
+
+        reference = PCAReference(variance=0.99).fit(y)
+        dH = delta_entropy(x, y, h=0.015, backend=reference)
+    """
+
+    def __init__(
+        self,
+        n_components: int = None,
+        variance: float = DEFAULT_VARIANCE,
+        tolerance: float = DEFAULT_TOLERANCE,
+        block_size: int = DEFAULT_BLOCK,
+    ):
+        """Creates the (empty) reference.
+
+        Arguments:
+            n_components (int): number of principal components r. If None,
+                uses the smallest number of components that explains
+                `variance` of the variance of the reference.
+            variance (float): fraction of the variance explained by the
+                principal components when `n_components` is None.
+            tolerance (float): kernels smaller than this value are not
+                computed with the full descriptors.
+            block_size (int): number of rows processed at once when fitting
+                and projecting the descriptors.
+        """
+        self.n_components = n_components
+        self.variance = variance
+        self.tolerance = tolerance
+        self.block_size = block_size
+
+        self.mean = None
+        self.components = None
+        self.explained_variance = None
+        self.refined_fraction = None
+
+        self._reference = None
+        self._reduced = None
+        self._residual = None
+
+    def fit(self, y: np.ndarray):
+        """Computes the principal components of `y` and stores the reference
+            in the reduced space. The covariance is accumulated in blocks,
+            so memory-mapped references are read in a single pass.
+
+        Arguments:
+            y (np.ndarray): an (N, d) matrix with the reference descriptors
+
+        Returns:
+            self (PCAReference): the fitted reference.
+        """
+        N, d = y.shape
+        total = np.zeros(d)
+        cov = np.zeros((d, d))
+        for _, _, block in iter_blocks(y, self.block_size, dtype=np.float64):
+            total += block.sum(axis=0)
+            cov += np.dot(block.T, block)
+
+        self.mean = total / N
+        cov = cov / N - np.outer(self.mean, self.mean)
+
+        # eigenvalues are sorted in decreasing order of the explained variance
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        eigvals, eigvecs = eigvals[::-1].clip(min=0), eigvecs[:, ::-1]
+
+        r = self.n_components
+        if r is None:
+            explained = np.cumsum(eigvals) / max(eigvals.sum(), 1e-300)
+            r = int(np.searchsorted(explained, self.variance) + 1)
+
+        r = min(r, d)
+        self.components = np.ascontiguousarray(eigvecs[:, :r])
+        self.explained_variance = eigvals[:r]
+
+        self._reduced, self._residual = self.transform(y)
+        self._reference = y
+
+        return self
+
+    def set_reference(self, y: np.ndarray):
+        self.fit(y)
+
+    def transform(self, x: np.ndarray):
+        """Projects the descriptors `x` onto the principal components.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the descriptors
+
+        Returns:
+            reduced (np.ndarray): an (M, r) matrix with the projections
+            residual (np.ndarray): an (M,) vector with the norm of the
+                component of `x` orthogonal to the principal components.
+        """
+        M = x.shape[0]
+        reduced = np.empty((M, self.components.shape[1]))
+        residual = np.empty(M)
+
+        for i, imax, block in iter_blocks(x, self.block_size, dtype=np.float64):
+            centered = block - self.mean
+            proj = np.dot(centered, self.components)
+            res = np.sum(centered**2, axis=1) - np.sum(proj**2, axis=1)
+
+            reduced[i:imax] = proj
+            residual[i:imax] = np.sqrt(res.clip(min=0))
+
+        return reduced, residual
+
+    def kernel_sum(
+        self,
+        x: np.ndarray,
+        y: np.ndarray = None,
+        h: float = DEFAULT_BANDWIDTH,
+        batch_size: int = DEFAULT_BATCH,
+        block_size: int = None,
+    ):
+        """Computes the kernel sum of `x` with respect to the reference.
+            If `y` is given and differs from the fitted reference, the
+            reference is fitted again.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the test descriptors
+            y (np.ndarray): an (N, d) matrix with the reference descriptors
+            h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+                (n_h,) vector of bandwidths
+            batch_size (int): maximum batch size to consider when
+                performing a distance calculation.
+            block_size (int): unused, kept for compatibility with the
+                backends of `kernel_sum`.
+
+        Returns:
+            ki (np.ndarray): a (M,) vector containing the probability of x_i
+                given the reference, or an (n_h, M) matrix if `h` is a vector.
+        """
+        if y is not None and y is not self._reference:
+            self.fit(y)
+
+        bandwidths = np.atleast_1d(np.asarray(h, dtype=np.float64))
+
+        # kernels of pairs farther than this distance are below the tolerance
+        # for all bandwidths
+        max_dist_sq = -2 * bandwidths.max() ** 2 * math.log(self.tolerance)
+
+        x_reduced, x_residual = self.transform(x)
+        with blas_limits():
+            p_x, n_refined = _projected_kernel_sum(
+                x,
+                x_reduced,
+                x_residual,
+                self._reference,
+                self._reduced,
+                self._residual,
+                bandwidths,
+                batch_size,
+                max_dist_sq,
+            )
+        n_pairs = x.shape[0] * self._reference.shape[0]
+        self.refined_fraction = n_refined / max(n_pairs, 1)
+
+        if np.ndim(h) == 0:
+            return p_x[0]
+
+        return p_x
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _projected_kernel_sum(
+    x: np.ndarray,
+    x_reduced: np.ndarray,
+    x_residual: np.ndarray,
+    y: np.ndarray,
+    y_reduced: np.ndarray,
+    y_residual: np.ndarray,
+    h: np.ndarray,
+    batch_size: int,
+    max_dist_sq: float,
+):
+    M = x.shape[0]
+    max_step_x = math.ceil(M / batch_size)
+
+    N = y.shape[0]
+    max_step_y = math.ceil(N / batch_size)
+
+    d = x.shape[1]
+    norm_x = norm(x_reduced)
+    norm_y = norm(y_reduced)
+
+    n_h = h.shape[0]
+    coef = np.empty(n_h)
+    for b in range(n_h):
+        coef[b] = -0.5 / (h[b] * h[b])
+
+    p_x = np.zeros((n_h, M), dtype=x.dtype)
+    n_refined = 0
+
+    for step_x in nb.prange(0, max_step_x):
+        i = step_x * batch_size
+        imax = min(i + batch_size, M)
+
+        for step_y in range(0, max_step_y):
+            j = step_y * batch_size
+            jmax = min(j + batch_size, N)
+
+            # coarse distances in the reduced space
+            dot = np.dot(x_reduced[i:imax], y_reduced[j:jmax].T)
+
+            for k in range(i, imax):
+                for l in range(j, jmax):
+                    diff = x_residual[k] - y_residual[l]
+                    lower = norm_x[k] + norm_y[l] - 2.0 * dot[k - i, l - j]
+                    lower += diff * diff
+                    if lower > max_dist_sq:
+                        continue
+
+                    # refinement with the full descriptors
+                    dist = 0.0
+                    for m in range(d):
+                        diff = x[k, m] - y[l, m]
+                        dist += diff * diff
+
+                    for b in range(n_h):
+                        p_x[b, k] += math.exp(coef[b] * dist)
+
+                    n_refined += 1
+
+    return p_x, n_refined
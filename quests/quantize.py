@@ -0,0 +1,413 @@
+import math
+
+import numba as nb
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH
+from .stream import DEFAULT_BLOCK, iter_blocks
+
+DEFAULT_SUBSPACES = 8
+DEFAULT_CENTROIDS = 256
+DEFAULT_TRAIN_SIZE = 100000
+DEFAULT_KMEANS_ITER = 25
+DEFAULT_TOLERANCE = 1e-6
+RERANK_FACTOR = 10
+
+
+def _sq_distances(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    dist = -2 * np.dot(x, centroids.T)
+    dist += np.sum(x**2, axis=1)[:, None]
+    dist += np.sum(centroids**2, axis=1)[None, :]
+    return np.maximum(dist, 0)
+
+
+def kmeans(
+    x: np.ndarray,
+    k: int,
+    n_iter: int = DEFAULT_KMEANS_ITER,
+    seed: int = 0,
+) -> np.ndarray:
+    """Clusters the rows of `x` into `k` clusters with Lloyd's algorithm
+        initialized with random rows of `x`. Empty clusters are reseeded
+        with the points that are farthest from their centroids.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the data
+        k (int): number of clusters.
+        n_iter (int): number of iterations.
+        seed (int): seed of the random initialization.
+
+    Returns:
+        centroids (np.ndarray): a (k, d) matrix with the centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        dist = _sq_distances(x, centroids)
+        labels = dist.argmin(axis=1)
+
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+
+        empty = np.where(counts == 0)[0]
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+        if len(empty) > 0:
+            farthest = np.argsort(dist[np.arange(len(x)), labels])[::-1]
+            centroids[empty] = x[farthest[: len(empty)]]
+
+    return centroids
+
+
+class PQReference:
+    """Stores a reference as product-quantized (PQ) codes. The descriptors
+    are split into `n_subspaces` groups of dimensions, and each group is
+    replaced by the index of its nearest centroid in a codebook learned
+    with k-means, so each environment takes `n_subspaces` bytes.
+
+    Kernel sums use asymmetric distances: the exact squared distances
+    between each subvector of a query and all centroids are computed once
+    in lookup tables, and the distance to each reference point is the sum
+    of `n_subspaces` table entries. If `rerank` is True, the reference is
+    also kept (e.g., memory-mapped from the disk), and the pairs whose
+    kernel could be larger than `tolerance` are recomputed with the full
+    vectors. Since the asymmetric distance differs from the true one by at
+    most the quantization error of each reference point, the kernel sums
+    are then exact within the tolerance.
+
+    The reference can be given to the entropy functions instead of `y`, e.g.,
+
+        reference = PQReference(n_subspaces=8).fit(y)
+        dH = delta_entropy(x, reference, h=0.015)
+    """
+
+    def __init__(
+        self,
+        n_subspaces: int = DEFAULT_SUBSPACES,
+        n_centroids: int = DEFAULT_CENTROIDS,
+        rerank: bool = False,
+        tolerance: float = DEFAULT_TOLERANCE,
+        train_size: int = DEFAULT_TRAIN_SIZE,
+        n_iter: int = DEFAULT_KMEANS_ITER,
+        block_size: int = DEFAULT_BLOCK,
+        seed: int = 0,
+    ):
+        """Creates the (empty) reference.
+
+        Arguments:
+            n_subspaces (int): number of groups of dimensions (bytes per
+                environment).
+            n_centroids (int): number of centroids of each codebook (at
+                most 256, so codes fit in one byte).
+            rerank (bool): if True, keeps the full reference and recomputes
+                the non-negligible kernels with the full vectors.
+            tolerance (float): kernels smaller than this value are not
+                recomputed when `rerank` is True.
+            train_size (int): number of descriptors used to train the
+                codebooks.
+            n_iter (int): number of k-means iterations.
+            block_size (int): number of rows encoded at once.
+            seed (int): seed used to sample the training set.
+        """
+        assert n_centroids <= 256, "Codes are stored as uint8"
+
+        self.n_subspaces = n_subspaces
+        self.n_centroids = n_centroids
+        self.rerank = rerank
+        self.tolerance = tolerance
+        self.train_size = train_size
+        self.n_iter = n_iter
+        self.block_size = block_size
+        self.seed = seed
+
+        self.bounds = None
+        self.codebooks = None
+        self.codes = None
+        self.errors = None
+        self._reference = None
+
+    @property
+    def shape(self):
+        return (self.codes.shape[0], self.bounds[-1])
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def fit(self, y: np.ndarray):
+        """Learns the codebooks from a sample of `y` and encodes `y`.
+
+        Arguments:
+            y (np.ndarray): an (N, d) matrix with the reference descriptors
+
+        Returns:
+            self (PQReference): the fitted reference.
+        """
+        N, d = y.shape
+        sizes = [len(s) for s in np.array_split(np.arange(d), self.n_subspaces)]
+        self.bounds = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(N, size=min(N, self.train_size), replace=False))
+        train = np.asarray(y[sample], dtype=np.float32)
+
+        # all codebooks are padded to the same number of centroids
+        k = min(self.n_centroids, len(train))
+        self.codebooks = np.zeros((self.n_subspaces, k, max(sizes)), dtype=np.float32)
+        for s in range(self.n_subspaces):
+            start, end = self.bounds[s], self.bounds[s + 1]
+            self.codebooks[s, :, : end - start] = kmeans(
+                train[:, start:end], k, n_iter=self.n_iter, seed=self.seed + s
+            )
+
+        self.codes, self.errors = self.encode(y)
+        self._reference = y if self.rerank else None
+
+        return self
+
+    def encode(self, x: np.ndarray):
+        """Encodes the descriptors `x` with the codebooks.
+
+        Arguments:
+            x (np.ndarray): an (N, d) matrix with the descriptors
+
+        Returns:
+            codes (np.ndarray): an (N, n_subspaces) matrix of uint8 codes.
+            errors (np.ndarray): an (N,) vector with the distance between
+                each descriptor and its reconstruction.
+        """
+        N = x.shape[0]
+        codes = np.empty((N, self.n_subspaces), dtype=np.uint8)
+        errors = np.zeros(N, dtype=np.float64)
+
+        for i, imax, block in iter_blocks(x, self.block_size, dtype=np.float32):
+            for s in range(self.n_subspaces):
+                start, end = self.bounds[s], self.bounds[s + 1]
+                dist = _sq_distances(block[:, start:end], self._codebook(s))
+                codes[i:imax, s] = dist.argmin(axis=1)
+                errors[i:imax] += dist.min(axis=1)
+
+        return codes, np.sqrt(errors).astype(np.float32)
+
+    def decode(self, codes: np.ndarray = None) -> np.ndarray:
+        """Reconstructs the descriptors from their codes.
+
+        Arguments:
+            codes (np.ndarray): an (N, n_subspaces) matrix of codes. If None,
+                decodes the reference.
+
+        Returns:
+            x (np.ndarray): an (N, d) matrix with the reconstructed descriptors
+        """
+        codes = self.codes if codes is None else codes
+        return np.concatenate(
+            [self._codebook(s)[codes[:, s]] for s in range(self.n_subspaces)], axis=1
+        )
+
+    def _codebook(self, s: int) -> np.ndarray:
+        return self.codebooks[s, :, : self.bounds[s + 1] - self.bounds[s]]
+
+    def lookup_tables(self, x: np.ndarray) -> np.ndarray:
+        """Computes the squared distances between each subvector of the
+            queries `x` and the centroids of the corresponding codebook.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the query descriptors
+
+        Returns:
+            tables (np.ndarray): an (M, n_subspaces, n_centroids) array
+        """
+        x = np.asarray(x, dtype=np.float32)
+        tables = np.empty(
+            (x.shape[0], self.n_subspaces, self.codebooks.shape[1]), dtype=np.float32
+        )
+        for s in range(self.n_subspaces):
+            start, end = self.bounds[s], self.bounds[s + 1]
+            tables[:, s] = _sq_distances(x[:, start:end], self._codebook(s))
+
+        return tables
+
+    def kernel_sum(
+        self,
+        x: np.ndarray,
+        y: np.ndarray = None,
+        h: float = DEFAULT_BANDWIDTH,
+        batch_size: int = DEFAULT_BATCH,
+        block_size: int = None,
+    ):
+        """Computes the kernel sum of `x` with respect to the encoded
+            reference using asymmetric distances.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the test descriptors
+            y (np.ndarray): unused. If given, has to be this reference.
+            h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+                (n_h,) vector of bandwidths
+            batch_size (int): number of queries whose lookup tables are
+                kept in the memory at once.
+            block_size (int): unused, kept for compatibility with the
+                backends of `kernel_sum`.
+
+        Returns:
+            ki (np.ndarray): a (M,) vector containing the probability of x_i
+                given the reference, or an (n_h, M) matrix if `h` is a vector.
+        """
+        assert y is None or y is self, "PQReference cannot use another reference"
+
+        bandwidths = np.atleast_1d(np.asarray(h, dtype=np.float64))
+        coef = -0.5 / bandwidths**2
+        max_dist_sq = -2 * bandwidths.max() ** 2 * math.log(self.tolerance)
+
+        M = x.shape[0]
+        p_x = np.zeros((len(bandwidths), M), dtype=np.float64)
+        for i, imax, x_batch in iter_blocks(x, batch_size, dtype=np.float32):
+            tables = self.lookup_tables(x_batch)
+
+            if self._reference is None:
+                p_x[:, i:imax] = _adc_kernel_sum(tables, self.codes, coef)
+            else:
+                p_x[:, i:imax] = _adc_kernel_sum_rerank(
+                    tables,
+                    self.codes,
+                    coef,
+                    x_batch,
+                    self._reference,
+                    self.errors,
+                    max_dist_sq,
+                )
+
+        if np.ndim(h) == 0:
+            return p_x[0]
+
+        return p_x
+
+    def query(self, x: np.ndarray, k: int = 1, batch_size: int = DEFAULT_BATCH):
+        """Finds the `k` nearest neighbors of `x` in the reference using the
+            asymmetric distances. If the full reference is kept, the
+            `RERANK_FACTOR * k` nearest candidates are re-sorted with their
+            exact distances.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the query descriptors
+            k (int): number of neighbors.
+            batch_size (int): number of queries processed at once.
+
+        Returns:
+            indices (np.ndarray): an (M, k) matrix with the neighbors.
+            distances (np.ndarray): an (M, k) matrix with their distances.
+        """
+        M = x.shape[0]
+        indices = np.empty((M, k), dtype=np.int64)
+        distances = np.empty((M, k), dtype=np.float32)
+
+        n_candidates = k
+        if self._reference is not None:
+            n_candidates = min(RERANK_FACTOR * k, len(self))
+
+        for i, imax, x_batch in iter_blocks(x, batch_size, dtype=np.float32):
+            tables = self.lookup_tables(x_batch)
+            idx, dist = _adc_knn(tables, self.codes, n_candidates)
+
+            if self._reference is not None:
+                nbrs = np.asarray(self._reference[idx.ravel()], dtype=np.float32)
+                nbrs = nbrs.reshape(*idx.shape, -1)
+                dist = np.sqrt(np.sum((nbrs - x_batch[:, None]) ** 2, axis=-1))
+
+                order = np.argsort(dist, axis=1)[:, :k]
+                idx = np.take_along_axis(idx, order, axis=1)
+                dist = np.take_along_axis(dist, order, axis=1)
+
+            indices[i:imax] = idx
+            distances[i:imax] = dist
+
+        return indices, distances
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _adc_kernel_sum(tables: np.ndarray, codes: np.ndarray, coef: np.ndarray):
+    M, n_subspaces, _ = tables.shape
+    N = codes.shape[0]
+    n_h = coef.shape[0]
+
+    p_x = np.zeros((n_h, M))
+    for i in nb.prange(M):
+        table = tables[i]
+        for j in range(N):
+            dist = 0.0
+            for s in range(n_subspaces):
+                dist += table[s, codes[j, s]]
+
+            for b in range(n_h):
+                p_x[b, i] += math.exp(coef[b] * dist)
+
+    return p_x
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True, nogil=True)
+def _adc_kernel_sum_rerank(
+    tables: np.ndarray,
+    codes: np.ndarray,
+    coef: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    errors: np.ndarray,
+    max_dist_sq: float,
+):
+    M, n_subspaces, _ = tables.shape
+    N, d = y.shape
+    n_h = coef.shape[0]
+
+    p_x = np.zeros((n_h, M))
+    for i in nb.prange(M):
+        table = tables[i]
+        for j in range(N):
+            dist = 0.0
+            for s in range(n_subspaces):
+                dist += table[s, codes[j, s]]
+
+            # |x - y| >= |x - y_pq| - |y - y_pq| bounds the kernel from above
+            lower = math.sqrt(dist) - errors[j]
+            if lower > 0 and lower * lower > max_dist_sq:
+                continue
+
+            dist = 0.0
+            for m in range(d):
+                diff = x[i, m] - y[j, m]
+                dist += diff * diff
+
+            for b in range(n_h):
+                p_x[b, i] += math.exp(coef[b] * dist)
+
+    return p_x
+
+
+@nb.njit(fastmath=True, parallel=True, cache=True)
+def _adc_knn(tables: np.ndarray, codes: np.ndarray, k: int):
+    M, n_subspaces, _ = tables.shape
+    N = codes.shape[0]
+
+    indices = np.zeros((M, k), dtype=np.int64)
+    distances = np.full((M, k), np.inf, dtype=np.float32)
+    for i in nb.prange(M):
+        table = tables[i]
+        for j in range(N):
+            dist = 0.0
+            for s in range(n_subspaces):
+                dist += table[s, codes[j, s]]
+
+            if dist >= distances[i, k - 1]:
+                continue
+
+            # insertion into the sorted list of neighbors
+            pos = k - 1
+            while pos > 0 and distances[i, pos - 1] > dist:
+                distances[i, pos] = distances[i, pos - 1]
+                indices[i, pos] = indices[i, pos - 1]
+                pos -= 1
+
+            distances[i, pos] = dist
+            indices[i, pos] = j
+
+    return indices, np.sqrt(distances)
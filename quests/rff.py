@@ -0,0 +1,225 @@
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH
+from .precision import get_compute_dtype
+from .stream import iter_blocks
+
+DEFAULT_FEATURES = 2048
+DEFAULT_SEED = 0
+EPS = 1e-15
+
+
+def random_frequencies(
+    d: int,
+    n_features: int = DEFAULT_FEATURES,
+    seed: int = DEFAULT_SEED,
+    dtype="float32",
+) -> np.ndarray:
+    """Samples the frequencies of the random Fourier features of a Gaussian
+        kernel with unit bandwidth. Each frequency gives rise to a cosine and
+        a sine feature, so `n_features / 2` frequencies are sampled and the
+        self-similarity z(x) . z(x) = 1 is exact. The frequencies of a kernel
+        with bandwidth `h` are obtained by dividing these ones by `h`, so a
+        single draw is shared by all bandwidths.
+
+    Arguments:
+        d (int): dimension of the descriptors.
+        n_features (int): number of random features D (must be even).
+        seed (int): seed of the random number generator.
+        dtype (np.dtype): dtype of the frequencies.
+
+    Returns:
+        w (np.ndarray): a (d, D / 2) matrix with the random frequencies.
+    """
+    assert n_features % 2 == 0, "The number of random features has to be even"
+
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((d, n_features // 2)).astype(dtype)
+
+
+def random_features(x: np.ndarray, w: np.ndarray, h: float) -> np.ndarray:
+    """Maps the descriptors `x` to the random Fourier features z(x) of the
+        Gaussian kernel with bandwidth `h`, such that z(x) . z(y) is an
+        unbiased estimate of exp(-|x - y|^2 / 2h^2).
+
+    Arguments:
+        x (np.ndarray): an (M, d) matrix with the descriptors
+        w (np.ndarray): a (d, D / 2) matrix with the random frequencies
+        h (float): bandwidth of the Gaussian kernel
+
+    Returns:
+        z (np.ndarray): an (M, D) matrix with the random features of `x`
+    """
+    proj = np.dot(x, w / w.dtype.type(h))
+    scale = np.sqrt(1 / w.shape[1]).astype(proj.dtype)
+    return np.concatenate([np.cos(proj), np.sin(proj)], axis=1) * scale
+
+
+def mean_embedding(
+    y: np.ndarray,
+    w: np.ndarray,
+    h: np.ndarray,
+    batch_size: int = DEFAULT_BATCH,
+) -> np.ndarray:
+    """Computes the mean of the random features of the reference `y`.
+        The reference is streamed in batches, so only (batch_size, D)
+        features are kept in the memory at once, and memory-mapped
+        references are read from the disk in a single pass.
+
+    Arguments:
+        y (np.ndarray): an (N, d) matrix with the reference descriptors
+        w (np.ndarray): a (d, D / 2) matrix with the random frequencies
+        h (np.ndarray): an (n_h,) vector of bandwidths
+        batch_size (int): number of descriptors transformed at once.
+
+    Returns:
+        mu (np.ndarray): an (n_h, D) matrix with the mean embedding of `y`
+            for each bandwidth.
+    """
+    mu = np.zeros((len(h), 2 * w.shape[1]), dtype=np.float64)
+    for _, _, y_batch in iter_blocks(y, batch_size, dtype=w.dtype):
+        for b, _h in enumerate(h):
+            mu[b] += random_features(y_batch, w, _h).sum(axis=0, dtype=np.float64)
+
+    return mu / y.shape[0]
+
+
+def kernel_sum(
+    x: np.ndarray,
+    y: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    n_features: int = DEFAULT_FEATURES,
+    seed: int = DEFAULT_SEED,
+):
+    """Approximates the kernel sum of `x` with respect to `y` using D random
+        Fourier features. Instead of computing the (M, N) kernel matrix, the
+        mean embedding of `y` is computed once and p(x_i) = N z(x_i) . mu,
+        which scales as O((M + N) D). The error of each p(x_i) decreases as
+        1 / sqrt(D) relative to N, so the approximation is accurate for
+        points in dense regions and noisy where p(x) is small.
+
+    Arguments:
+        x (np.ndarray): an (M, d) matrix with the test descriptors
+        y (np.ndarray): an (N, d) matrix with the reference descriptors
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths
+        batch_size (int): number of descriptors transformed at once.
+        n_features (int): number of random features D.
+        seed (int): seed used to sample the random features.
+
+    Returns:
+        ki (np.ndarray): a (M,) vector containing the approximated probability
+            of x_i given `y`, or an (n_h, M) matrix if `h` is a vector.
+    """
+    bandwidths = np.atleast_1d(np.asarray(h, dtype=np.float64))
+    dtype = get_compute_dtype(x.dtype)
+    w = random_frequencies(x.shape[1], n_features, seed=seed, dtype=dtype)
+
+    N = y.shape[0]
+    mu = mean_embedding(y, w, bandwidths, batch_size=batch_size)
+
+    M = x.shape[0]
+    p_x = np.zeros((len(bandwidths), M), dtype=np.float64)
+    for i, imax, x_batch in iter_blocks(x, batch_size, dtype=w.dtype):
+        for b, _h in enumerate(bandwidths):
+            z = random_features(x_batch, w, _h)
+            p_x[b, i:imax] = N * np.dot(z, mu[b])
+
+    if np.ndim(h) == 0:
+        return p_x[0]
+
+    return p_x
+
+
+def perfect_entropy(
+    x: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    n_features: int = DEFAULT_FEATURES,
+    seed: int = DEFAULT_SEED,
+):
+    """Approximates the entropy of a dataset with random Fourier features.
+        Since every point is similar to itself, p(x) is bounded from below
+        by one, which keeps the logarithm finite when the approximation
+        underestimates p(x).
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths
+        batch_size (int): number of descriptors transformed at once.
+        n_features (int): number of random features D.
+        seed (int): seed used to sample the random features.
+
+    Returns:
+        entropy (float or np.ndarray): approximated entropy of the dataset
+            given by `x`, or an (n_h,) vector of entropies if `h` is a vector.
+    """
+    N = x.shape[0]
+    p_x = kernel_sum(
+        x, x, h=h, batch_size=batch_size, n_features=n_features, seed=seed
+    )
+    p_x = np.log(np.maximum(p_x, 1) / N)
+
+    return -np.mean(p_x, axis=-1)
+
+
+def delta_entropy(
+    x: np.ndarray,
+    y: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    n_features: int = DEFAULT_FEATURES,
+    seed: int = DEFAULT_SEED,
+):
+    """Approximates the differential entropy of a dataset `x` using the
+        dataset `y` as reference. As the error of p(x) does not decrease
+        with p(x), the approximation cannot resolve very large values of
+        dH, and p(x) is clipped at `EPS` before computing the logarithm.
+
+    Arguments:
+        x (np.ndarray): an (M, d) matrix with the descriptors of the test set
+        y (np.ndarray): an (N, d) matrix with the descriptors of the reference
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths
+        batch_size (int): number of descriptors transformed at once.
+        n_features (int): number of random features D.
+        seed (int): seed used to sample the random features.
+
+    Returns:
+        entropy (np.ndarray): an (M,) vector with the approximated differential
+            entropy of each point in `x`, or an (n_h, M) matrix if `h` is a vector.
+    """
+    p_x = kernel_sum(
+        x, y, h=h, batch_size=batch_size, n_features=n_features, seed=seed
+    )
+    return -np.log(np.maximum(p_x, EPS))
+
+
+def diversity(
+    x: np.ndarray,
+    h: float = DEFAULT_BANDWIDTH,
+    batch_size: int = DEFAULT_BATCH,
+    n_features: int = DEFAULT_FEATURES,
+    seed: int = DEFAULT_SEED,
+):
+    """Approximates the diversity of a dataset `x` with random Fourier
+        features. As in `perfect_entropy`, p(x) is bounded from below by one.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix with the descriptors of the dataset
+        h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+            (n_h,) vector of bandwidths
+        batch_size (int): number of descriptors transformed at once.
+        n_features (int): number of random features D.
+        seed (int): seed used to sample the random features.
+
+    Returns:
+        diversity (float or np.ndarray): approximated diversity of the dataset
+            given by `x`, or an (n_h,) vector of diversities if `h` is a vector.
+    """
+    p_x = kernel_sum(
+        x, x, h=h, batch_size=batch_size, n_features=n_features, seed=seed
+    )
+    return np.log(np.sum(1 / np.maximum(p_x, 1), axis=-1))
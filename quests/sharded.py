@@ -0,0 +1,321 @@
+import mmap
+import multiprocessing as mp
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import numba as nb
+import numpy as np
+
+from .entropy import DEFAULT_BANDWIDTH, DEFAULT_BATCH, kernel_sum
+from .precision import from_storage, get_compute_dtype
+
+DEFAULT_BLOCK = 100000
+
+
+def _open_array(spec: dict):
+    """Recreates an array in the worker from its description. Arrays are
+    either in shared memory or memory-mapped from a `.npy` file.
+    """
+    shape, dtype = spec["shape"], np.dtype(spec["dtype"])
+
+    if spec["kind"] == "memmap":
+        array = np.memmap(
+            spec["filename"], dtype=dtype, mode="r", offset=spec["offset"], shape=shape
+        )
+        return from_storage(array), None
+
+    # workers share the resource tracker of the executor, which owns the
+    # shared memory and unlinks it when it is no longer needed
+    shm = SharedMemory(name=spec["name"])
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    if spec["kind"] == "shm_slice":
+        start, end = spec["rows"]
+        array = array[start:end]
+
+    return from_storage(array), shm
+
+
+def _worker(conn, rank: int, threads: int):
+    """Main loop of a worker process. The worker owns a shard of the
+    reference and computes the partial kernel sums of the blocks of `x`
+    broadcast by the executor, writing them to the shared output.
+    """
+    if threads is not None:
+        nb.set_num_threads(threads)
+
+    handles = {}
+    arrays = {}
+
+    def release(key):
+        arrays.pop(key, None)
+        shm = handles.pop(key, None)
+        if shm is not None:
+            shm.close()
+
+    while True:
+        cmd, args = conn.recv()
+
+        if cmd == "close":
+            break
+
+        if cmd == "open":
+            key, spec = args
+            release(key)
+            arrays[key], handles[key] = _open_array(spec)
+            conn.send(True)
+            continue
+
+        if cmd == "release":
+            release(args)
+            conn.send(True)
+            continue
+
+        if cmd == "kernel_sum":
+            x_key, start, end, h, batch_size, block_size = args
+            shard = arrays["shard"]
+            x_block = arrays[x_key][start:end]
+
+            if len(shard) > 0:
+                p = kernel_sum(
+                    x_block, shard, h=h, batch_size=batch_size, block_size=block_size
+                )
+            else:
+                p = np.zeros((len(h), end - start), dtype=h.dtype)
+
+            arrays["output"][rank, :, start:end] = p
+            conn.send(True)
+
+    for key in list(arrays.keys()):
+        release(key)
+
+    conn.close()
+
+
+class ShardedExecutor:
+    """Computes kernel sums by splitting the reference across worker
+    processes. Each worker owns a contiguous shard of the reference, which
+    is placed in shared memory (or memory-mapped from the disk), computes
+    the partial p(x) of blocks of `x` that are broadcast to all workers, and
+    writes them to a shared output matrix. The partial results are then
+    summed by the executor.
+
+    The executor can be used as a backend for the entropy functions, e.g.,
+
+        with ShardedExecutor(n_workers=4) as executor:
+            H = perfect_entropy(x, h=0.015, backend=executor)
+    """
+
+    def __init__(
+        self,
+        n_workers: int = None,
+        threads_per_worker: int = None,
+        block_size: int = DEFAULT_BLOCK,
+        start_method: str = "spawn",
+    ):
+        """Starts the pool of workers.
+
+        Arguments:
+            n_workers (int): number of worker processes. If None, uses
+                one worker per CPU.
+            threads_per_worker (int): number of numba threads used by each
+                worker. If None, splits the available CPUs among workers.
+            block_size (int): number of rows of `x` broadcast at once.
+            start_method (str): multiprocessing start method of the workers.
+        """
+        n_cpus = os.cpu_count() or 1
+        self.n_workers = n_workers if n_workers is not None else n_cpus
+        if threads_per_worker is None:
+            threads_per_worker = max(n_cpus // self.n_workers, 1)
+
+        self.threads_per_worker = threads_per_worker
+        self.block_size = block_size
+
+        ctx = mp.get_context(start_method)
+        self._conns = []
+        self._procs = []
+        for rank in range(self.n_workers):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker, args=(child, rank, threads_per_worker), daemon=True
+            )
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+        self._shms = {}
+        self._reference = None
+        self._shard_bounds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _request(self, conns, cmd, args_list):
+        for conn, args in zip(conns, args_list):
+            conn.send((cmd, args))
+
+        return [conn.recv() for conn in conns]
+
+    def _share(self, key: str, array: np.ndarray, rows: tuple = None):
+        """Makes `array` available to the workers under the name `key`.
+        Top-level memory-mapped arrays are reopened by the workers from the
+        file, whereas all other arrays are copied to shared memory. If `rows`
+        is given, each worker receives only its own slice of rows.
+        """
+        self._unshare(key)
+
+        if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+            spec = {
+                "kind": "memmap",
+                "filename": array.filename,
+                "offset": array.offset,
+                "shape": array.shape,
+                "dtype": array.dtype.str,
+            }
+        else:
+            array = np.ascontiguousarray(array)
+            shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared[:] = array
+            self._shms[key] = shm
+            spec = {
+                "kind": "shm",
+                "name": shm.name,
+                "shape": array.shape,
+                "dtype": array.dtype.str,
+            }
+
+        specs = [spec] * self.n_workers
+        if rows is not None:
+            specs = [self._slice_spec(spec, *bounds) for bounds in rows]
+
+        self._request(self._conns, "open", [(key, s) for s in specs])
+
+    def _slice_spec(self, spec: dict, start: int, end: int) -> dict:
+        spec = dict(spec)
+        shape = spec["shape"]
+        row_bytes = int(np.prod(shape[1:])) * np.dtype(spec["dtype"]).itemsize
+
+        if spec["kind"] == "memmap":
+            spec["offset"] = spec["offset"] + start * row_bytes
+            spec["shape"] = (end - start, *shape[1:])
+            return spec
+
+        # shared memory cannot be offset, so slicing is done in the worker
+        spec["kind"] = "shm_slice"
+        spec["rows"] = (start, end)
+        return spec
+
+    def _unshare(self, key: str):
+        shm = self._shms.pop(key, None)
+        if shm is None:
+            return
+
+        self._request(self._conns, "release", [key] * self.n_workers)
+        shm.close()
+        shm.unlink()
+
+    def set_reference(self, y: np.ndarray):
+        """Splits the reference `y` into contiguous shards, one per worker.
+
+        Arguments:
+            y (np.ndarray): an (N, d) matrix with the reference descriptors
+        """
+        N = y.shape[0]
+        shard_size = int(np.ceil(N / self.n_workers))
+        self._shard_bounds = [
+            (min(r * shard_size, N), min((r + 1) * shard_size, N))
+            for r in range(self.n_workers)
+        ]
+        self._share("shard", y, rows=self._shard_bounds)
+        self._reference = y
+
+    def kernel_sum(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        h: float = DEFAULT_BANDWIDTH,
+        batch_size: int = DEFAULT_BATCH,
+        block_size: int = None,
+    ):
+        """Computes the kernel sum of `x` with respect to `y` using the
+            workers. The reference is sharded only if it differs from the
+            one used in the previous call.
+
+        Arguments:
+            x (np.ndarray): an (M, d) matrix with the test descriptors
+            y (np.ndarray): an (N, d) matrix with the reference descriptors
+            h (float or np.ndarray): bandwidth for the Gaussian kernel, or an
+                (n_h,) vector of bandwidths
+            batch_size (int): maximum batch size to consider when
+                performing a distance calculation.
+            block_size (int): number of rows streamed at once by the workers
+                when their shards are memory-mapped.
+
+        Returns:
+            ki (np.ndarray): a (M,) vector containing the probability of x_i
+                given `y`, or an (n_h, M) matrix if `h` is a vector.
+        """
+        dtype = get_compute_dtype(x.dtype)
+        bandwidths = np.atleast_1d(np.asarray(h, dtype=dtype))
+
+        if y is not self._reference:
+            self.set_reference(y)
+
+        self._share("x", x)
+
+        # each worker writes its partial p(x) to its own row of the output
+        M = x.shape[0]
+        output = np.zeros((self.n_workers, len(bandwidths), M), dtype=dtype)
+        self._share("output", output)
+        shared_output = np.ndarray(
+            output.shape, dtype=output.dtype, buffer=self._shms["output"].buf
+        )
+
+        # broadcasts the blocks of x to all workers. The commands are sent in
+        # advance, so workers process the next block as soon as they finish
+        blocks = [(i, min(i + self.block_size, M)) for i in range(0, M, self.block_size)]
+        for i, imax in blocks:
+            for conn in self._conns:
+                conn.send(
+                    ("kernel_sum", ("x", i, imax, bandwidths, batch_size, block_size))
+                )
+
+        for _ in blocks:
+            for conn in self._conns:
+                conn.recv()
+
+        # reduction of the partial kernel sums
+        p_x = shared_output.sum(axis=0)
+        del shared_output
+        self._unshare("output")
+        self._unshare("x")
+
+        if np.ndim(h) == 0:
+            return p_x[0]
+
+        return p_x
+
+    def close(self):
+        """Stops the workers and releases the shared memory."""
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+
+        for proc in self._procs:
+            proc.join()
+
+        for key in list(self._shms.keys()):
+            shm = self._shms.pop(key)
+            shm.close()
+            shm.unlink()
+
+        self._conns = []
+        self._procs = []
+        self._reference = None
@@ -0,0 +1,317 @@
+import json
+import os
+
+import numpy as np
+
+from .dataset import METADATA_KEYS
+from .precision import from_storage, get_dtype, to_storage
+from .stream import DEFAULT_BLOCK
+
+STORE_VERSION = 1
+STORE_SUFFIX = ".qds"
+
+HEADER_FILE = "header.json"
+OFFSETS_FILE = "offsets.npy"
+DATA_FILE = "descriptors.bin"
+METADATA_FILE = "metadata.npz"
+
+# arrays of the metadata table with one row per atom instead of per frame
+ATOM_KEYS = ("numbers", "positions")
+
+
+def is_store(path: str) -> bool:
+    """Returns True if `path` is a descriptor store."""
+    return os.path.isfile(os.path.join(path, HEADER_FILE))
+
+
+class DescriptorStore:
+    """Container of descriptors that is opened lazily. A store is a folder
+    with a header (k, cutoff, dtype, dimension, numbers of rows and frames
+    and version of the format), an index with the offsets of the frames, an
+    optional metadata table (see `quests.dataset.get_metadata`) and the
+    descriptors, which are written as contiguous blocks of rows to a raw
+    binary file. The header is written last by each append, so frames of an
+    interrupted append are ignored.
+
+    The descriptors are memory-mapped, so `store.descriptors` can be given
+    to `kernel_sum` and the entropy functions without loading the whole
+    matrix, and single frames are read with `store.frame(i)`. New frames
+    are appended to the end of the file without rewriting it, e.g.,
+
+        store = DescriptorStore.create("dataset.qds", d=x.shape[1], k=32, cutoff=5.0)
+        store.append(x, metadata=get_metadata(dset))
+        H = perfect_entropy(store.descriptors, h=0.015)
+    """
+
+    def __init__(self, path: str, mode: str = "r"):
+        """Opens an existing store.
+
+        Arguments:
+            path (str): path to the folder of the store.
+            mode (str): "r" to open the store for reading, "a" to also
+                append frames to it.
+        """
+        if not is_store(path):
+            raise FileNotFoundError(f"{path} is not a descriptor store")
+
+        assert mode in ("r", "a"), "mode should be 'r' or 'a'"
+
+        self.path = path
+        self.mode = mode
+
+        with open(os.path.join(path, HEADER_FILE), "r") as f:
+            self.header = json.load(f)
+
+        if self.header["version"] > STORE_VERSION:
+            raise ValueError(
+                f"Store version {self.header['version']} is not supported "
+                + f"(maximum: {STORE_VERSION})"
+            )
+
+        # the header defines the valid frames. Entries written by an
+        # interrupted append past these frames are ignored
+        offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.header.setdefault("n_frames", len(offsets) - 1)
+        self.header.setdefault(
+            "metadata", os.path.exists(os.path.join(path, METADATA_FILE))
+        )
+
+        self.offsets = offsets[: self.header["n_frames"] + 1]
+        self._metadata = None
+        self._descriptors = None
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        d: int,
+        k: int,
+        cutoff: float,
+        dtype="float32",
+        overwrite: bool = False,
+    ):
+        """Creates an empty store, which is opened for appending.
+
+        Arguments:
+            path (str): path to the folder of the store.
+            d (int): dimension of the descriptors.
+            k (int): number of neighbors of the descriptors.
+            cutoff (float): cutoff of the descriptors.
+            dtype (str): storage dtype of the descriptors.
+            overwrite (bool): if True, replaces an existing store.
+
+        Returns:
+            store (DescriptorStore): the empty store.
+        """
+        if is_store(path) and not overwrite:
+            raise FileExistsError(f"Store {path} already exists")
+
+        os.makedirs(path, exist_ok=True)
+        header = {
+            "version": STORE_VERSION,
+            "k": k,
+            "cutoff": cutoff,
+            "dtype": get_dtype(dtype).name,
+            "d": d,
+            "n_rows": 0,
+            "n_frames": 0,
+            "metadata": False,
+        }
+
+        open(os.path.join(path, DATA_FILE), "wb").close()
+        np.save(os.path.join(path, OFFSETS_FILE), np.zeros(1, dtype=np.int64))
+        if os.path.exists(os.path.join(path, METADATA_FILE)):
+            os.remove(os.path.join(path, METADATA_FILE))
+
+        _write_header(path, header)
+
+        return cls(path, mode="a")
+
+    @property
+    def k(self) -> int:
+        return self.header["k"]
+
+    @property
+    def cutoff(self) -> float:
+        return self.header["cutoff"]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return get_dtype(self.header["dtype"])
+
+    @property
+    def shape(self) -> tuple:
+        return (self.header["n_rows"], self.header["d"])
+
+    @property
+    def n_frames(self) -> int:
+        return self.header["n_frames"]
+
+    def __len__(self) -> int:
+        return self.header["n_rows"]
+
+    @property
+    def descriptors(self) -> np.ndarray:
+        """(N, d) memory-mapped matrix with all the descriptors."""
+        if self._descriptors is None:
+            self._descriptors = self._open()
+
+        return self._descriptors
+
+    @property
+    def metadata(self) -> dict:
+        """Metadata table of the frames, or None if it was not stored."""
+        if self._metadata is None and self.header["metadata"]:
+            with np.load(os.path.join(self.path, METADATA_FILE)) as data:
+                self._metadata = {
+                    key: data[key][: len(self) if key in ATOM_KEYS else self.n_frames]
+                    for key in data.files
+                }
+            self._metadata["offsets"] = self.offsets
+
+        return self._metadata
+
+    def frame(self, i: int) -> np.ndarray:
+        """Returns the memory-mapped descriptors of the frame `i`."""
+        return self.descriptors[self.offsets[i] : self.offsets[i + 1]]
+
+    def frames(self, indices) -> tuple:
+        """Reads the descriptors of the frames `indices` into the memory.
+
+        Arguments:
+            indices (list): indices of the frames.
+
+        Returns:
+            x (np.ndarray): descriptors of the frames, in the given order.
+            offsets (np.ndarray): offsets of the frames within `x`.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        natoms = self.offsets[indices + 1] - self.offsets[indices]
+        offsets = np.concatenate([[0], np.cumsum(natoms)])
+
+        x = np.empty((offsets[-1], self.shape[1]), dtype=self.dtype)
+        for j, i in enumerate(indices):
+            x[offsets[j] : offsets[j + 1]] = self.frame(i)
+
+        return x, offsets
+
+    def append(
+        self,
+        x: np.ndarray,
+        offsets: np.ndarray = None,
+        metadata: dict = None,
+        block_size: int = DEFAULT_BLOCK,
+    ):
+        """Appends frames to the end of the store. The descriptors are
+            converted to the dtype of the store and written in blocks of
+            rows, so `x` can itself be memory-mapped.
+
+        Arguments:
+            x (np.ndarray): (n, d) matrix with the descriptors of the frames.
+            offsets (np.ndarray): offsets of the frames within `x`. If None,
+                uses the offsets of `metadata`, or `x` is a single frame.
+            metadata (dict): metadata table of the frames, created with
+                `quests.dataset.get_metadata`. Required if the store
+                already has a metadata table.
+            block_size (int): number of rows written at once.
+        """
+        assert self.mode == "a", "Store was not opened for appending"
+
+        x = x.reshape(-1, x.shape[-1])
+        if x.shape[1] != self.shape[1]:
+            raise ValueError(
+                f"Descriptors of dimension {x.shape[1]} cannot be appended "
+                + f"to a store of dimension {self.shape[1]}"
+            )
+
+        if offsets is None and metadata is not None:
+            offsets = metadata["offsets"]
+        if offsets is None:
+            offsets = np.array([0, len(x)])
+
+        offsets = np.asarray(offsets, dtype=np.int64)
+        assert offsets[-1] == len(x), "offsets do not match the descriptors"
+
+        has_metadata = self.metadata is not None
+        if len(self) > 0 and has_metadata != (metadata is not None):
+            raise ValueError("Frames should have metadata only if the store has it")
+
+        n_rows = len(self)
+        row_bytes = self.shape[1] * self.dtype.itemsize
+
+        # rows written by an interrupted append are past the end of the store
+        # given by the header and are overwritten. The index and metadata
+        # are replaced before the header, which commits the new frames
+        with open(os.path.join(self.path, DATA_FILE), "r+b") as f:
+            f.truncate(n_rows * row_bytes)
+            f.seek(n_rows * row_bytes)
+            for i in range(0, len(x), block_size):
+                block = np.ascontiguousarray(x[i : i + block_size], dtype=self.dtype)
+                f.write(to_storage(block).tobytes())
+
+        if metadata is not None:
+            self._append_metadata(metadata)
+
+        self.offsets = np.concatenate([self.offsets, n_rows + offsets[1:]])
+        _replace(os.path.join(self.path, OFFSETS_FILE), np.save, self.offsets)
+
+        self.header["n_rows"] = n_rows + len(x)
+        self.header["n_frames"] = len(self.offsets) - 1
+        self.header["metadata"] = metadata is not None
+        _write_header(self.path, self.header)
+
+        self._descriptors = None
+        self._metadata = None
+
+    def _append_metadata(self, metadata: dict):
+        arrays = {key: metadata[key] for key in METADATA_KEYS if key != "offsets"}
+
+        current = self.metadata
+        if current is not None:
+            arrays = {
+                key: np.concatenate([current[key], arrays[key]]) for key in arrays
+            }
+
+        _replace(os.path.join(self.path, METADATA_FILE), np.savez, **arrays)
+
+    def _open(self) -> np.ndarray:
+        storage = to_storage(np.empty(0, dtype=self.dtype)).dtype
+
+        if len(self) == 0:
+            return from_storage(np.empty(self.shape, dtype=storage))
+
+        x = np.memmap(
+            os.path.join(self.path, DATA_FILE),
+            dtype=storage,
+            mode="r",
+            shape=self.shape,
+        )
+        return from_storage(x)
+
+
+def _write_header(path: str, header: dict):
+    # the header is replaced atomically, as it defines the valid rows
+    tmp = os.path.join(path, HEADER_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(header, f, indent=4)
+
+    os.replace(tmp, os.path.join(path, HEADER_FILE))
+
+
+def _replace(path: str, save_fn, *args, **kwargs):
+    # files are written to a temporary file and replaced atomically, so an
+    # interrupted append keeps a readable file
+    root, ext = os.path.splitext(path)
+    tmp = root + ".tmp" + ext
+    save_fn(tmp, *args, **kwargs)
+    os.replace(tmp, path)
+
+
+def as_descriptors(x) -> np.ndarray:
+    """Returns the descriptor matrix of `x`, which is either a matrix or a
+    `DescriptorStore`. The matrix of a store is memory-mapped, not copied.
+    """
+    if isinstance(x, DescriptorStore):
+        return x.descriptors
+
+    return x
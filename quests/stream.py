@@ -0,0 +1,130 @@
+import queue
+import threading
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from .precision import from_storage, get_dtype, to_storage
+
+DEFAULT_BLOCK = 1000000
+
+
+def load_descriptors(path: str, mmap: bool = True) -> np.ndarray:
+    """Opens a descriptor matrix saved with `save_descriptors` or `np.save`.
+        If `mmap` is True, `.npy` matrices are memory-mapped and only the
+        blocks that are accessed are read from the disk. Half-precision
+        descriptors are kept in their storage dtype.
+
+    Arguments:
+        path (str): path to the `.npy` or `.npz` file.
+        mmap (bool): if True, memory-maps the file instead of loading it.
+
+    Returns:
+        x (np.ndarray): an (N, d) matrix (or `np.memmap`) with the descriptors
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            key = "descriptors" if "descriptors" in data else data.files[0]
+            x = data[key]
+            if "dtype" in data:
+                return from_storage(x).astype(get_dtype(str(data["dtype"])), copy=False)
+
+        return from_storage(x)
+
+    mmap_mode = "r" if mmap else None
+    return from_storage(np.load(path, mmap_mode=mmap_mode))
+
+
+def save_descriptors(path: str, x: np.ndarray):
+    """Saves a descriptor matrix to a `.npy` or `.npz` file. bfloat16
+        descriptors are saved as their uint16 bits, and `.npz` files also
+        record the name of the dtype.
+
+    Arguments:
+        path (str): path to the `.npy` or `.npz` file.
+        x (np.ndarray): matrix with the descriptors
+    """
+    if path.endswith(".npz"):
+        np.savez(path, descriptors=to_storage(x), dtype=x.dtype.name)
+        return
+
+    with open(path, "wb") as f:
+        np.save(f, to_storage(x))
+
+
+def is_out_of_core(x) -> bool:
+    """Returns True if the descriptors `x` are not resident in the memory
+    and should be streamed in blocks.
+    """
+    return isinstance(x, np.memmap)
+
+
+def _read_block(x, start: int, end: int, dtype=None) -> np.ndarray:
+    block = np.ascontiguousarray(x[start:end])
+    if dtype is not None and block.dtype != dtype:
+        block = block.astype(dtype)
+
+    return block
+
+
+def iter_blocks(
+    x,
+    block_size: int = DEFAULT_BLOCK,
+    prefetch: bool = True,
+    dtype=None,
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """Iterates over contiguous blocks of rows of `x`, loading each of them
+        into the memory. If `prefetch` is True, a background thread reads the
+        next block while the current one is being processed. At most two
+        blocks are resident at any time, so the memory is set by `block_size`.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix, usually memory-mapped.
+        block_size (int): number of rows in each block.
+        prefetch (bool): if True, reads the next block in a background thread.
+        dtype (np.dtype): if given, converts each block to this dtype.
+
+    Returns:
+        blocks (Iterator): tuples of (start, end, block) with the rows of
+            the block and its contents.
+    """
+    N = x.shape[0]
+    bounds = [(i, min(i + block_size, N)) for i in range(0, N, block_size)]
+
+    if not prefetch or len(bounds) <= 1:
+        for i, imax in bounds:
+            yield i, imax, _read_block(x, i, imax, dtype)
+        return
+
+    # the queue holds only the next block, which bounds the memory
+    blocks = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for i, imax in bounds:
+                if stop.is_set():
+                    return
+                blocks.put((i, imax, _read_block(x, i, imax, dtype)))
+        except BaseException as e:
+            blocks.put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    try:
+        for _ in bounds:
+            item = blocks.get()
+            if isinstance(item, BaseException):
+                raise item
+
+            yield item
+    finally:
+        # unblocks the reader if the iteration stops earlier
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                pass
+            thread.join(timeout=0.01)
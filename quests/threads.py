@@ -0,0 +1,237 @@
+import glob
+import os
+import warnings
+from contextlib import nullcontext
+
+import numba as nb
+import numpy as np
+
+BLAS_ENV_VARS = (
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+THREADING_LAYERS = ("default", "safe", "threadsafe", "forksafe", "tbb", "omp", "workqueue")
+DEFAULT_BLAS_THREADS = 1
+DEFAULT_TOUCH_BATCH = 20000
+
+# settings applied by `configure_threads`, reported by `thread_report`
+_CONFIG = {"blas_threads": None, "numa": False, "blas_controller": None}
+
+
+def limit_blas_threads(n: int = DEFAULT_BLAS_THREADS):
+    """Limits the number of threads of the BLAS libraries within the
+        parallel kernels. The distances of the kernels call `np.dot` inside
+        the `nb.prange` loops, so a threaded BLAS would start a team of
+        threads for each numba thread. The limit is applied by `blas_limits`
+        around the kernels with `threadpoolctl`, so the serial BLAS calls
+        (e.g., the PCA of `quests.projection` or the k-means of
+        `quests.quantize`) keep all threads. The environment is also set, so
+        libraries loaded later and worker processes start with `n` threads.
+        Without `threadpoolctl`, the libraries that are already loaded keep
+        their number of threads and are reported as not limited.
+
+    Arguments:
+        n (int): number of BLAS threads.
+    """
+    for var in BLAS_ENV_VARS:
+        os.environ[var] = str(n)
+
+    try:
+        from threadpoolctl import ThreadpoolController
+    except ImportError:
+        warnings.warn(
+            "threadpoolctl is not installed, so the BLAS libraries that are "
+            + "already loaded are not limited"
+        )
+        _CONFIG["blas_controller"] = None
+    else:
+        # the loaded libraries are found once, and limited by each kernel
+        _CONFIG["blas_controller"] = ThreadpoolController()
+
+    _CONFIG["blas_threads"] = n
+
+
+def blas_limits():
+    """Returns a context that limits the BLAS libraries to the number of
+    threads set by `limit_blas_threads` while the parallel kernels run, or
+    a context that does nothing if no limit was set.
+    """
+    controller = _CONFIG["blas_controller"]
+    if controller is None or _CONFIG["blas_threads"] is None:
+        return nullcontext()
+
+    return controller.limit(limits=_CONFIG["blas_threads"], user_api="blas")
+
+
+def get_threading_layer() -> str:
+    """Returns the threading layer used by numba, or the requested layer if
+    no parallel kernel was executed yet.
+    """
+    try:
+        return nb.threading_layer()
+    except ValueError:
+        return nb.config.THREADING_LAYER
+
+
+def set_threading_layer(layer: str):
+    """Selects the threading layer of numba ("omp", "tbb", "workqueue", or
+        one of the generic options "default", "safe", "threadsafe" and
+        "forksafe"). The layer is chosen when the first parallel kernel is
+        executed, and cannot be changed afterwards.
+
+    Arguments:
+        layer (str): name of the threading layer.
+    """
+    if layer not in THREADING_LAYERS:
+        raise ValueError(
+            f"Threading layer {layer} not supported. Options: {THREADING_LAYERS}"
+        )
+
+    try:
+        current = nb.threading_layer()
+    except ValueError:
+        nb.config.THREADING_LAYER = layer
+        return
+
+    if layer not in ("default", current):
+        warnings.warn(
+            f"Threading layer {current} was already initialized and "
+            + f"cannot be changed to {layer}"
+        )
+
+
+def get_numa_nodes() -> int:
+    """Returns the number of NUMA nodes of the machine (1 if unknown)."""
+    nodes = glob.glob("/sys/devices/system/node/node[0-9]*")
+    return max(len(nodes), 1)
+
+
+def numa_enabled() -> bool:
+    """Returns True if the kernels should place their inputs with
+    `first_touch` (see `configure_threads`).
+    """
+    return _CONFIG["numa"]
+
+
+@nb.njit(parallel=True, cache=True)
+def _first_touch(x: np.ndarray, out: np.ndarray, batch_size: int):
+    n_batches = (x.shape[0] + batch_size - 1) // batch_size
+    for step in nb.prange(n_batches):
+        i = step * batch_size
+        imax = min(i + batch_size, x.shape[0])
+        for k in range(i, imax):
+            for l in range(x.shape[1]):
+                out[k, l] = x[k, l]
+
+
+def first_touch(x: np.ndarray, batch_size: int = DEFAULT_TOUCH_BATCH) -> np.ndarray:
+    """Copies `x` into a new matrix whose batches of rows are written by the
+        numba threads. Linux places the memory pages in the NUMA node of the
+        thread that touches them first, so the batches of the test set end
+        up in the node of the thread that processes them in `kernel_sum`,
+        and the pages of the reference are spread across all nodes instead
+        of the node of the thread that loaded the file.
+
+    Arguments:
+        x (np.ndarray): an (N, d) matrix.
+        batch_size (int): number of rows of each batch, which should match
+            the batch size of the kernels.
+
+    Returns:
+        x (np.ndarray): the copy of `x`.
+    """
+    out = np.empty(x.shape, dtype=x.dtype)
+    _first_touch(x, out, batch_size)
+    return out
+
+
+def configure_threads(
+    jobs: int = None,
+    blas_threads: int = DEFAULT_BLAS_THREADS,
+    layer: str = None,
+    numa: bool = False,
+) -> dict:
+    """Applies the thread configuration of the kernels.
+
+    Arguments:
+        jobs (int): number of numba threads. If None, uses all threads.
+        blas_threads (int): number of BLAS threads. If None, the BLAS
+            libraries are not limited.
+        layer (str): numba threading layer (see `set_threading_layer`).
+        numa (bool): if True, the kernels copy in-memory inputs with
+            `first_touch` before computing the kernel sums.
+
+    Returns:
+        report (dict): the effective configuration (see `thread_report`).
+    """
+    if layer is not None:
+        set_threading_layer(layer)
+
+    if jobs is not None:
+        nb.set_num_threads(jobs)
+
+    if blas_threads is not None:
+        limit_blas_threads(blas_threads)
+
+    _CONFIG["numa"] = numa
+
+    return thread_report()
+
+
+def thread_report() -> dict:
+    """Returns the effective thread configuration: the number of numba
+    threads and their threading layer, the BLAS limits, the number of NUMA
+    nodes and whether first-touch placement is enabled. The number of BLAS
+    threads is read from the loaded libraries within `blas_limits`, as in
+    the kernels, and is None if they were not limited with `threadpoolctl`.
+    """
+    report = {
+        "numba_threads": nb.get_num_threads(),
+        "threading_layer": get_threading_layer(),
+        "blas_threads": None,
+        "blas_requested": _CONFIG["blas_threads"],
+        "numa_nodes": get_numa_nodes(),
+        "first_touch": _CONFIG["numa"],
+        "cpus": os.cpu_count(),
+    }
+
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return report
+
+    with blas_limits():
+        info = threadpool_info()
+
+    report["blas"] = [
+        {
+            key: lib.get(key)
+            for key in ("internal_api", "num_threads", "threading_layer", "filepath")
+        }
+        for lib in info
+        if lib.get("user_api") == "blas"
+    ]
+
+    if _CONFIG["blas_controller"] is not None and report["blas"]:
+        report["blas_threads"] = max(info["num_threads"] for info in report["blas"])
+
+    return report
+
+
+def format_report(report: dict) -> str:
+    """Formats the output of `thread_report` as a single line."""
+    if report["blas_threads"] is None:
+        blas = "BLAS: not limited"
+    else:
+        blas = f"BLAS: {report['blas_threads']} in the kernels"
+
+    msg = (
+        f"Threads: {report['numba_threads']} numba ({report['threading_layer']}), "
+        + f"{blas}, {report['numa_nodes']} NUMA node(s)"
+    )
+    if report["first_touch"]:
+        msg += ", first-touch placement"
+
+    return msg
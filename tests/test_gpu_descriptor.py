@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.build import bulk
+
+from quests.descriptor import get_descriptors
+
+torch = pytest.importorskip("torch")
+
+from quests.gpu import descriptor as gpu_descriptor  # noqa: E402
+
+K = 32
+CUTOFF = 5.0
+
+
+def rattle(atoms: Atoms, stdev: float = 0.05, seed: int = 0) -> Atoms:
+    # noise removes the ties between neighbors at the same distance, which
+    # both implementations break arbitrarily
+    atoms = atoms.copy()
+    atoms.rattle(stdev=stdev, seed=seed)
+    return atoms
+
+
+def periodic():
+    return rattle(bulk("Cu", "fcc", a=3.6, cubic=True).repeat((3, 3, 3)))
+
+
+def triclinic():
+    rng = np.random.default_rng(1)
+    cell = np.array([[7.5, 0.0, 0.0], [2.1, 7.0, 0.0], [-1.3, 1.8, 8.2]])
+    frac = rng.random((40, 3))
+    return Atoms("Cu40", scaled_positions=frac, cell=cell, pbc=True)
+
+
+def small_cell():
+    # the cell is smaller than the cutoff, so its images are neighbors
+    return rattle(bulk("Cu", "fcc", a=3.6, cubic=True), seed=2)
+
+
+def nonperiodic():
+    atoms = periodic()[:50]
+    atoms.pbc = False
+    atoms.cell = None
+    return atoms
+
+
+def assert_parity(dset, **kwargs):
+    expected = get_descriptors(dset, k=K, cutoff=CUTOFF, dtype="float64")
+    x = gpu_descriptor.get_descriptors(
+        dset, k=K, cutoff=CUTOFF, dtype=torch.float64, device="cpu", **kwargs
+    )
+
+    x = x.cpu().numpy()
+    assert x.shape == expected.shape
+    np.testing.assert_allclose(x, expected, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize(
+    "make_atoms", [periodic, triclinic, small_cell, nonperiodic]
+)
+def test_parity(make_atoms):
+    assert_parity([make_atoms()])
+
+
+def test_parity_dataset():
+    assert_parity([periodic(), triclinic(), small_cell(), nonperiodic()])
+
+
+@pytest.mark.parametrize("make_atoms", [periodic, nonperiodic])
+def test_parity_small_batch(make_atoms):
+    atoms = make_atoms()
+    assert 8 < len(atoms)
+    assert_parity([atoms], batch_size=8)